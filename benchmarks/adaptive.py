@@ -0,0 +1,90 @@
+"""
+Latency benchmark of the adaptive generation parameters.
+
+Generates the completions through the conversation agent against the local fake OpenAI server, whose latency grows
+with the number of the generated tokens, while the load goes from a few concurrent users to many and back. The many
+users wait for the limited request slots, which pushes the latency above the target. The run with fixed parameters
+is compared with the adaptive controller, which generates fewer choices and tokens, and with --fast-model switches to
+a faster model while the target is missed. Reported are the latency percentiles and the average number of choices per
+phase.
+
+Usage: python -m benchmarks.adaptive [--target-p95 1.0] [--phase-seconds 8] [--light 2] [--heavy 16] [--fast-model M]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from benchmarks.fake_openai import FakeOpenAI, Latency
+from tindermate.configuration import Configuration, OpenAIConfiguration
+from tindermate.conversation.adaptive import AdaptiveController, degradation_levels
+from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.gpt import GPTClient
+from tindermate.conversation.usage import UsageLedger
+from tindermate.tracing import Histogram, tracer
+
+
+async def run_phase(agent: ConversationAgent, users: int, seconds: float) -> tuple[Histogram, float]:
+    """Let the users generate completions one after another, return the latency and the average number of choices"""
+    latency = Histogram(window=100_000)
+    choices: list[int] = []
+    deadline = time.perf_counter() + seconds
+
+    async def user(idx: int) -> None:
+        while (start := time.perf_counter()) < deadline:
+            suggestions = await agent.complete_rendered(f"Prompt of the user {idx} at {start}", [])
+            latency.observe((time.perf_counter() - start) * 1000)
+            choices.append(len(suggestions))
+
+    await asyncio.gather(*(user(idx) for idx in range(users)))
+    return latency, sum(choices) / max(1, len(choices))
+
+
+async def run(args: argparse.Namespace) -> None:
+    config = OpenAIConfiguration()
+    config.FAST_MODEL = args.fast_model
+    phases = [("light", args.light), ("heavy", args.heavy), ("light", args.light)]
+    print(f"target p95 {args.target_p95:.2f}s, levels {degradation_levels(config)}")
+    print(f"{'controller':<10} {'phase':<7} {'users':>5} {'requests':>9} {'p50':>8} {'p95':>8} {'choices':>8}")
+    server = FakeOpenAI(Latency("fixed", (0.05,)), token_interval=0.002, model_speed={args.fast_model: 4})
+    async with server:
+        for adaptive in (False, True):
+            tracer.reset()
+            controller = AdaptiveController(degradation_levels(config), args.target_p95) if adaptive else None
+            agent = ConversationAgent(
+                "sk-fake",
+                GPTClient(config.MODEL, server.api_base, api_key="sk-fake"),
+                UsageLedger(),
+                controller=controller,
+            )
+            for name, users in phases:
+                # the client reports the completions cut by the token limit
+                with contextlib.redirect_stdout(io.StringIO()):
+                    latency, choices = await run_phase(agent, users, args.phase_seconds)
+                print(
+                    f"{'adaptive' if adaptive else 'fixed':<10} {name:<7} {users:>5} {latency.count:>9} "
+                    f"{latency.percentile(50) / 1000:7.2f}s {latency.percentile(95) / 1000:7.2f}s {choices:8.2f}"
+                )
+            if adaptive:
+                degraded, restored = tracer.counters["adaptive.degrade"], tracer.counters["adaptive.restore"]
+                print(f"{degraded:.0f} degradations, {restored:.0f} restorations")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target-p95", type=float, default=1.0, help="Target p95 latency in seconds")
+    parser.add_argument("--phase-seconds", type=float, default=8)
+    parser.add_argument("--light", type=int, default=2, help="Number of the concurrent users under light load")
+    parser.add_argument("--heavy", type=int, default=16, help="Number of the concurrent users under heavy load")
+    parser.add_argument(
+        "--fast-model",
+        default=Configuration.OPENAI_CONFIG.FAST_MODEL,
+        help="Model the completions fall back to, four times faster on the fake server, none by default",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
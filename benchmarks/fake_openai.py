@@ -0,0 +1,290 @@
+"""
+Deterministic local stand-in of the OpenAI completions API for offline load tests.
+
+Implements `POST /v1/completions` (with `n`, `stop`, `max_tokens`, `stream` and the `usage` and `finish_reason` of
+the real API) and `GET /v1/models`. The completions are generated from the prompt and the seed, so the same request
+always gets the same answer. The responses are delayed according to the latency distribution, the requests can be
+rejected with 429 at random or above a concurrency limit, and with 401 when the api key is not one of the accepted.
+
+Point the app or the benchmarks to it with `OPENAI_API_BASE=http://127.0.0.1:8089/v1`.
+
+Usage: python -m benchmarks.fake_openai [--port 8089] [--latency lognormal:1.0,0.3] [--straggler-rate 0.02]
+       [--rate-limit-rate 0.05] [--max-concurrency 20] [--api-key sk-test] [--token-interval 0.002]
+       [--fast-model text-curie-001] [--seed 0]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from tindermate.conversation.usage import estimate_prompt_tokens
+from tindermate.type_aliases import AnyDict
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+HOST = "127.0.0.1"
+WORDS = (
+    "hey hi hello how are you doing today I love your photos that hike looks amazing we should grab a coffee "
+    "sometime what is your favourite place in the city tell me more about your travels haha nice"
+).split()
+
+
+@dataclass
+class Latency:
+    """Distribution of the delay before the first token, in seconds"""
+
+    kind: str = "fixed"
+    params: tuple[float, ...] = (0.0,)
+    straggler_rate: float = 0.0
+    """Share of the requests taking `straggler_factor` times longer"""
+    straggler_factor: float = 10.0
+
+    @classmethod
+    def parse(cls, spec: str, **kwargs: float) -> "Latency":
+        """Parse `fixed:SECONDS`, `uniform:LOW,HIGH` or `lognormal:MEDIAN,SIGMA`"""
+        kind, _, params = spec.partition(":")
+        if kind not in {"fixed", "uniform", "lognormal"}:
+            raise ValueError(f"Unknown latency distribution {kind!r}")
+        return cls(kind, tuple(map(float, params.split(","))), **kwargs)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            latency = rng.uniform(*self.params)
+        elif self.kind == "lognormal":
+            median, sigma = self.params
+            latency = median * rng.lognormvariate(0, sigma)
+        else:
+            latency = self.params[0]
+        if rng.random() < self.straggler_rate:
+            latency *= self.straggler_factor
+        return latency
+
+
+def generate(prompt: str, index: int, max_tokens: int, stop: list[str], seed: int) -> tuple[list[str], str]:
+    """Return the tokens of the choice and its finish reason, the same for the same arguments"""
+    digest = hashlib.sha256(f"{seed}:{index}:{prompt}".encode()).digest()
+    rng = random.Random(digest)
+    length = rng.randint(1, max(1, max_tokens * 3 // 2))
+    tokens = [" " + rng.choice(WORDS) for _ in range(min(length, max_tokens))]
+    text = "".join(tokens)
+    for word in stop:
+        if (pos := text.find(word)) >= 0:
+            # the stop sequence itself is not returned
+            return [text[:pos]], "stop"
+    return tokens, "length" if length > max_tokens else "stop"
+
+
+class FakeOpenAI:
+    """Fake OpenAI API server, `stats` counts the responses by their status"""
+
+    def __init__(
+        self,
+        latency: Latency | None = None,
+        api_keys: set[str] | None = None,
+        rate_limit_rate: float = 0.0,
+        max_concurrency: int | None = None,
+        token_interval: float = 0.0,
+        seed: int = 0,
+        model_speed: dict[str, float] | None = None,
+    ):
+        self.latency = latency or Latency()
+        self.api_keys = api_keys
+        """Accepted api keys, any key is accepted if None"""
+        self.rate_limit_rate = rate_limit_rate
+        self.max_concurrency = max_concurrency
+        self.token_interval = token_interval
+        """Seconds to generate a token, the tokens of all the choices add up unless they are streamed"""
+        self.seed = seed
+        self.model_speed = model_speed or {}
+        """How many times faster the models generate the tokens, 1 for the models not listed"""
+        self.stats: Counter[int] = Counter()
+        self.completion_tokens = 0
+        self._rng = random.Random(seed)
+        self._in_flight = 0
+        self._runner: "web.AppRunner | None" = None
+        self.port = 0
+
+    @property
+    def api_base(self) -> str:
+        return f"http://{HOST}:{self.port}/v1"
+
+    async def __aenter__(self) -> "FakeOpenAI":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def start(self, port: int = 0) -> None:
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/v1/completions", self._completions)
+        app.router.add_get("/v1/models", self._models)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, HOST, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _error(self, status: int, message: str, error_type: str, code: str | None = None) -> "web.Response":
+        from aiohttp import web
+
+        self.stats[status] += 1
+        body = {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+        headers = {"retry-after": "1"} if status == 429 else None
+        return web.json_response(body, status=status, headers=headers)
+
+    def _check_key(self, request: "web.Request") -> "web.Response | None":
+        key = request.headers.get("authorization", "").removeprefix("Bearer ")
+        if self.api_keys is not None and key not in self.api_keys:
+            return self._error(401, "Incorrect API key provided", "invalid_request_error", "invalid_api_key")
+        return None
+
+    async def _models(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+
+        if (error := self._check_key(request)) is not None:
+            return error
+        self.stats[200] += 1
+        models = [{"id": model, "object": "model", "owned_by": "openai"} for model in ("text-davinci-003",)]
+        return web.json_response({"object": "list", "data": models})
+
+    async def _completions(self, request: "web.Request") -> "web.StreamResponse":
+        if (error := self._check_key(request)) is not None:
+            return error
+        if self._rng.random() < self.rate_limit_rate or (
+            self.max_concurrency is not None and self._in_flight >= self.max_concurrency
+        ):
+            return self._error(429, "Rate limit reached for requests", "requests")
+
+        self._in_flight += 1
+        try:
+            params = await request.json()
+            await asyncio.sleep(self.latency.sample(self._rng))
+            if params.get("stream"):
+                return await self._stream(request, params)
+            return await self._complete(params)
+        finally:
+            self._in_flight -= 1
+
+    def _choices(self, params: AnyDict) -> list[tuple[list[str], str]]:
+        prompt = params["prompt"] if isinstance(params["prompt"], str) else "".join(params["prompt"])
+        stop = params.get("stop") or []
+        stop = [stop] if isinstance(stop, str) else stop
+        return [
+            generate(prompt, idx, params.get("max_tokens", 16), stop, self.seed) for idx in range(params.get("n", 1))
+        ]
+
+    def _choice(self, params: AnyDict, index: int, text: str, reason: str | None) -> AnyDict:
+        choice = {"text": text, "index": index, "logprobs": None, "finish_reason": reason}
+        if "chat" in params["model"]:
+            # the chat model reports the finish reason differently
+            choice["finish_details"] = {"type": reason} if reason is not None else None
+        return choice
+
+    def _envelope(self, params: AnyDict, choices: list[AnyDict]) -> AnyDict:
+        return {
+            "id": f"cmpl-{self.stats.total()}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": params["model"],
+            "choices": choices,
+        }
+
+    def _token_interval(self, params: AnyDict) -> float:
+        return self.token_interval / self.model_speed.get(params["model"], 1)
+
+    async def _complete(self, params: AnyDict) -> "web.Response":
+        from aiohttp import web
+
+        choices = self._choices(params)
+        completion_tokens = sum(len(tokens) for tokens, _ in choices)
+        await asyncio.sleep(completion_tokens * self._token_interval(params))
+        self.completion_tokens += completion_tokens
+        self.stats[200] += 1
+        prompt_tokens = estimate_prompt_tokens(str(params["prompt"]))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        body = [self._choice(params, idx, "".join(tokens), reason) for idx, (tokens, reason) in enumerate(choices)]
+        return web.json_response(self._envelope(params, body) | {"usage": usage})
+
+    async def _stream(self, request: "web.Request", params: AnyDict) -> "web.StreamResponse":
+        from aiohttp import web
+
+        response = web.StreamResponse(headers={"content-type": "text/event-stream"})
+        await response.prepare(request)
+        choices = self._choices(params)
+        # the tokens of the choices are interleaved, as by the real API
+        for position in range(max(len(tokens) for tokens, _ in choices) + 1):
+            chunk = []
+            for idx, (tokens, reason) in enumerate(choices):
+                if position < len(tokens):
+                    chunk.append(self._choice(params, idx, tokens[position], None))
+                elif position == len(tokens):
+                    chunk.append(self._choice(params, idx, "", reason))
+            for choice in chunk:
+                await response.write(f"data: {json.dumps(self._envelope(params, [choice]))}\n\n".encode())
+            await asyncio.sleep(self._token_interval(params))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        self.completion_tokens += sum(len(tokens) for tokens, _ in choices)
+        self.stats[200] += 1
+        return response
+
+
+async def serve(args: argparse.Namespace) -> None:
+    latency = Latency.parse(args.latency, straggler_rate=args.straggler_rate)
+    server = FakeOpenAI(
+        latency,
+        set(args.api_key) if args.api_key else None,
+        rate_limit_rate=args.rate_limit_rate,
+        max_concurrency=args.max_concurrency,
+        token_interval=args.token_interval,
+        seed=args.seed,
+        model_speed={model: 4 for model in args.fast_model},
+    )
+    await server.start(args.port)
+    print(f"Fake OpenAI API listening, set OPENAI_API_BASE={server.api_base}")
+    try:
+        while True:
+            await asyncio.sleep(args.report_interval)
+            print(f"responses by status: {dict(server.stats)}, {server.completion_tokens} completion tokens")
+    finally:
+        await server.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:1.0,0.3", help="Delay before the first token in seconds")
+    parser.add_argument("--straggler-rate", type=float, default=0.0, help="Share of the requests taking 10x longer")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of the requests rejected with 429")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Reject the requests above with 429")
+    parser.add_argument("--api-key", action="append", help="Accepted api key, can be repeated (default: any)")
+    parser.add_argument("--token-interval", type=float, default=0.002, help="Seconds to generate a token")
+    parser.add_argument(
+        "--fast-model", action="append", default=[], help="Model generating the tokens 4x faster, can be repeated"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report-interval", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Tail latency benchmark of the hedged completions.
+
+Sends the same sequence of completions to the local fake OpenAI server with a heavy-tailed latency, i.e. mostly quick
+responses with a few stragglers taking ten times longer, once directly and once through the hedged client. The hedges
+are sent after the 95th percentile of the measured latency, reported are the latency percentiles and the number of
+the requests the server received per completion.
+
+Usage: python -m benchmarks.hedging [--requests 500] [--concurrency 10] [--straggler-rate 0.03] [--median 0.1]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+
+from benchmarks.fake_openai import FakeOpenAI, Latency
+from tindermate.conversation.gpt import GPTClient, HedgedGPTClient
+from tindermate.tracing import Histogram
+
+
+async def measure(client: GPTClient, args: argparse.Namespace) -> Histogram:
+    latency = Histogram(window=args.requests)
+    slots = asyncio.Semaphore(args.concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def request() -> None:
+        async with slots:
+            start = loop.time()
+            await client.complete_text("prompt", 1, 100, 0.8)
+            latency.observe((loop.time() - start) * 1000)
+
+    await asyncio.gather(*(request() for _ in range(args.requests)))
+    return latency
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(f"{'client':<10} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'requests':>9}")
+    for hedged in (False, True):
+        latency = Latency("lognormal", (args.median, 0.3), straggler_rate=args.straggler_rate)
+        async with FakeOpenAI(latency) as server:
+            backend = GPTClient("text-davinci-003", server.api_base, api_key="sk-fake")
+            client = HedgedGPTClient(backend, percentile=95) if hedged else backend
+            # the client reports the completions cut by the token limit
+            with contextlib.redirect_stdout(io.StringIO()):
+                histogram = await measure(client, args)
+        print(
+            f"{'hedged' if hedged else 'direct':<10} "
+            + " ".join(f"{histogram.percentile(q):7.1f}ms" for q in (50, 95, 99))
+            + f" {histogram.max:7.1f}ms {server.stats.total() / args.requests:8.2f}x"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--straggler-rate", type=float, default=0.03, help="Share of the requests taking 10x longer")
+    parser.add_argument("--median", type=float, default=0.1, help="Median latency of the server in seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
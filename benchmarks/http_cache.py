@@ -0,0 +1,84 @@
+"""
+Benchmark of the HTTP cache of the Tinder client.
+
+Loads the profiles of the same matches in several rounds, as the app does when the matches are displayed again,
+from a local stub of the Tinder API delaying every response by the latency. The stub sends an ETag with every profile
+and answers the conditional requests with 304 Not Modified. The caching headers of the stub vary: none (the
+heuristic freshness of the profiles applies), `no-cache` (every response is revalidated) and `max-age`. Reported are
+the requests and bytes the stub served and the wall time, without and with the cache.
+
+Usage: python -m benchmarks.http_cache [--matches 50] [--rounds 5] [--latency-ms 50]
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+from collections import Counter
+
+from benchmarks.transport import HOST, user_body
+from tindermate.ratelimit import RateLimiter
+from tindermate.tinder.client import TinderClient
+from tindermate.tracing import tracer
+from tindermate.transport import AiohttpTransport
+
+POLICIES = {"heuristic": None, "no-cache": "no-cache", "max-age": "max-age=3600"}
+
+
+async def run(policy: str, http_cache: bool, args: argparse.Namespace) -> None:
+    from aiohttp import web
+
+    stats: Counter[str] = Counter()
+
+    async def profile(request: web.Request) -> web.Response:
+        await asyncio.sleep(args.latency_ms / 1000)
+        body = user_body(request.path)
+        headers = {"etag": f'"{hashlib.sha256(body).hexdigest()[:16]}"'}
+        if (cache_control := POLICIES[policy]) is not None:
+            headers["cache-control"] = cache_control
+        stats["requests"] += 1
+        if request.headers.get("if-none-match") == headers["etag"]:
+            stats["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+        stats["bytes"] += len(body)
+        return web.Response(body=body, headers=headers, content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get("/user/{user_id}", profile)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, 0).start()
+    client = TinderClient(
+        "token", rate_limiter=RateLimiter(0), transport=AiohttpTransport(args.matches), http_cache=http_cache
+    )
+    client._BASE_URL = f"http://{HOST}:{runner.addresses[0][1]}"
+    tracer.reset()
+    try:
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            await asyncio.gather(*(client._user_detail(f"user{i}") for i in range(args.matches)))
+        wall = time.perf_counter() - start
+    finally:
+        await client.close()
+        await runner.cleanup()
+    print(
+        f"{policy:<10} {'on' if http_cache else 'off':<6} {stats['requests']:>9} {stats['not_modified']:>6} "
+        f"{stats['bytes'] / 1024:9.1f} {wall * 1000:9.1f} {tracer.counters['http_cache.bytes_saved'] / 1024:12.1f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matches", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    print(f"{args.matches} profiles loaded {args.rounds} times, {args.latency_ms} ms latency")
+    print(f"{'headers':<10} {'cache':<6} {'requests':>9} {'304':>6} {'sent KiB':>9} {'wall ms':>9} {'saved KiB':>12}")
+    for policy in POLICIES:
+        for http_cache in (False, True):
+            asyncio.run(run(policy, http_cache, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Event loop lag benchmark of the CPU-bound steps.
+
+Validates pages of matches, as returned by the matches endpoint, and renders the reply prompts of the matches into the
+Markdown shown by the app, through the offload layer while the lag of the event loop is sampled every few milliseconds.
+The lag is the time by which the loop wakes up later than scheduled, i.e. the input latency the terminal UI would
+suffer. Every executor kind is measured with the same steps. The time per thousand characters of the payload compares
+the costs of the steps, which the weights of the offload sizes (`MARKDOWN_COST`) are based on.
+
+Usage: python -m benchmarks.offload [--pages 20] [--matches 100] [--messages 10] [--interval-ms 5] [--workers 2]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from tindermate.conversation.prompts import CompactProfile, MessageReplyPrompt
+from tindermate.offload import MARKDOWN_COST, ExecutorKind, Offloader
+from tindermate.tinder.client import parse_matches
+from tindermate.tinder.schemas import UserDetail
+from tindermate.tracing import Histogram, monitor_loop_lag, tracer
+from tindermate.type_aliases import AnyDict
+
+FLAGS = (
+    "closed",
+    "dead",
+    "pending",
+    "is_super_like",
+    "is_boost_match",
+    "is_super_boost_match",
+    "is_primetime_boost_match",
+    "is_experiences_match",
+    "is_fast_match",
+    "is_preferences_match",
+    "is_matchmaker_match",
+    "is_opener",
+    "has_shown_initial_interest",
+    "is_archived",
+)
+
+
+def match_payload(idx: int, messages: int) -> AnyDict:
+    created = datetime(2023, 1, 1, tzinfo=timezone.utc) + timedelta(hours=idx)
+    return {flag: False for flag in FLAGS} | {
+        "seen": {},
+        "id": f"match{idx}",
+        "created_date": created.isoformat(),
+        "last_activity_date": created.isoformat(),
+        "message_count": messages,
+        "messages": [
+            {
+                "match_id": f"match{idx}",
+                "sent_date": (created + timedelta(minutes=i)).isoformat(),
+                "message": f"Message number {i} of the conversation with a few more words",
+                "to": "me" if i % 2 else f"user{idx}",
+                "from": f"user{idx}" if i % 2 else "me",
+                "timestamp": int((created + timedelta(minutes=i)).timestamp() * 1000),
+            }
+            for i in range(messages)
+        ],
+        "participants": [f"user{idx}"],
+        "person": {
+            "_id": f"user{idx}",
+            "bio": "I like hiking and coffee " * 5,
+            "birth_date": "1995-01-01T00:00:00Z",
+            "gender": 1,
+            "name": f"Name {idx}",
+            "photos": [{"id": f"photo{i}", "url": f"https://images.gotinder.com/{i}.jpg"} for i in range(6)],
+        },
+    }
+
+
+@dataclass
+class Step:
+    func: Callable[..., Any]
+    payload: Any
+    chars: int
+    """Characters of the payload"""
+    size: int
+    """Characters of the payload weighted by the cost of the step, as the app offloads it"""
+
+
+def render_steps(pages: list[list[AnyDict]]) -> list[Step]:
+    """Render the reply prompts of the first page into Markdown, as the app does when the prompt is shown"""
+    # the terminal UI is a heavy import, only needed by this step
+    from tindermate.ui.components.tinder_match import render_prompt
+
+    profile = CompactProfile.of(UserDetail.parse_obj(pages[0][0]["person"]))
+    steps = []
+    for match in parse_matches(pages[0]):
+        rendered = MessageReplyPrompt(profile, profile, match.message_log).render()
+        steps.append(Step(render_prompt, rendered, len(rendered), len(rendered) * MARKDOWN_COST))
+    return steps
+
+
+async def measure(kind: ExecutorKind, steps: list[Step], args: argparse.Namespace) -> tuple[float, Histogram]:
+    """Run the steps one after another, return the wall time in ms and the histogram of the loop lag"""
+    offloader = Offloader(kind, workers=args.workers, threshold=1)
+    # start the workers before the measurement
+    await offloader.run(1, len, steps[0].payload)
+    tracer.reset()
+    monitor = asyncio.create_task(monitor_loop_lag(args.interval_ms / 1000))
+    start = time.perf_counter()
+    for step in steps:
+        await offloader.run(step.size, step.func, step.payload)
+        # let the loop handle the other events between the steps, as the UI would
+        await asyncio.sleep(0)
+    wall_ms = (time.perf_counter() - start) * 1000
+    monitor.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await monitor
+    offloader.shutdown()
+    return wall_ms, tracer.histograms["loop.lag"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--matches", type=int, default=100, help="Number of the matches per page")
+    parser.add_argument("--messages", type=int, default=10, help="Number of the messages embedded in every match")
+    parser.add_argument("--interval-ms", type=float, default=5, help="Sampling interval of the loop lag")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    pages = [
+        [match_payload(page * args.matches + i, args.messages) for i in range(args.matches)]
+        for page in range(args.pages)
+    ]
+    steps = {
+        "parse": [Step(parse_matches, page, chars := len(json.dumps(page)), chars) for page in pages],
+        "render": render_steps(pages),
+    }
+    print(f"{args.pages} pages of {args.matches} matches with {args.messages} messages each")
+    print(
+        f"{'step':<8} {'executor':<10} {'size':>8} {'wall':>10} {'ms/kchar':>9} {'lag p50':>10} {'lag p95':>10} "
+        f"{'lag max':>10}"
+    )
+    for name, step_list in steps.items():
+        size = sum(step.size for step in step_list) // len(step_list)
+        kchars = sum(step.chars for step in step_list) / 1000
+        for kind in ExecutorKind:
+            wall_ms, lag = asyncio.run(measure(kind, step_list, args))
+            print(
+                f"{name:<8} {kind.value:<10} {size:>8} {wall_ms:8.1f}ms {wall_ms / kchars:9.3f} "
+                f"{lag.percentile(50):8.1f}ms {lag.percentile(95):8.1f}ms {lag.max:8.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Throughput benchmark of the prompt rendering pipeline.
+
+Renders a synthetic corpus of compact jobs, a mix of the first messages and the replies to conversations of varying
+length, through the prompt pipeline with an increasing number of worker processes. Zero workers render the prompts
+on the event loop. The speed-up is bounded by the number of the available cores.
+
+Usage: python -m benchmarks.pipeline [--jobs 50000] [--shard-size 256] [--max-workers N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections.abc import AsyncIterator
+
+from tindermate.conversation.pipeline import PromptJob, PromptPipeline
+from tindermate.conversation.prompts import CompactProfile
+from tindermate.tinder.message_log import LogEntry
+
+INTERESTS = ("Hiking", "Coffee", "Art", "Travel", "Cooking", "Music", "Climbing", "Cinema")
+
+
+def profile(idx: int, gender: int, rng: random.Random) -> CompactProfile:
+    return CompactProfile(
+        id=f"user{idx}",
+        name=f"Name {idx}",
+        gender=gender,
+        age=rng.randint(20, 40),
+        bio="I like hiking and coffee, " * rng.randint(0, 10),
+        city_name="Prague",
+        school="Charles University" if idx % 3 else None,
+        job="Designer" if idx % 2 else None,
+        interests=tuple(rng.sample(INTERESTS, 3)),
+        gender_filter=1 if gender == 0 else None,
+    )
+
+
+def corpus(size: int, seed: int = 0) -> list[PromptJob]:
+    rng = random.Random(seed)
+    me = profile(0, 0, rng)
+    jobs = []
+    for idx in range(1, size + 1):
+        matched = profile(idx, 1, rng)
+        if idx % 3 == 0:
+            jobs.append(PromptJob(f"match{idx}", me, matched))
+            continue
+        length = rng.randint(1, 40)
+        history = tuple(
+            LogEntry(me.id if i % 2 else matched.id, f"Message number {i} of our conversation", 1000 + i)
+            for i in range(max(0, length - 10), length)
+        )
+        jobs.append(PromptJob(f"match{idx}", me, matched, history, earlier_messages=length - len(history)))
+    return jobs
+
+
+async def iter_jobs(jobs: list[PromptJob]) -> AsyncIterator[PromptJob]:
+    for job in jobs:
+        yield job
+
+
+async def measure(jobs: list[PromptJob], workers: int, shard_size: int) -> float:
+    """Render all the jobs, return the wall time in seconds"""
+    pipeline = PromptPipeline(workers, shard_size=shard_size)
+    # start the workers and load the templates before the measurement
+    async for _ in pipeline.render(iter_jobs(jobs[: max(1, workers)])):
+        pass
+    start = time.perf_counter()
+    rendered = 0
+    async for _ in pipeline.render(iter_jobs(jobs)):
+        rendered += 1
+    elapsed = time.perf_counter() - start
+    pipeline.close()
+    assert rendered == len(jobs)
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=50_000)
+    parser.add_argument("--shard-size", type=int, default=256)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    jobs = corpus(args.jobs)
+    print(f"{len(jobs)} jobs, shards of {args.shard_size}, {os.cpu_count()} cores")
+    print(f"{'workers':<10} {'wall':>10} {'prompts/s':>12} {'speed-up':>10}")
+    baseline = None
+    for workers in range(args.max_workers + 1):
+        elapsed = asyncio.run(measure(jobs, workers, args.shard_size))
+        baseline = baseline or elapsed
+        print(f"{workers:<10} {elapsed:9.2f}s {len(jobs) / elapsed:12.0f} {baseline / elapsed:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Startup time benchmark of the TinderMate application.
+
+Measures the import time of the UI entry point using `python -X importtime` and the time it takes to paint
+the first screen of a headless application. Exits with a non-zero status when a budget is exceeded
+or when one of the lazily loaded modules is imported eagerly.
+
+Usage: python -m benchmarks.startup [--runs 5] [--import-budget-ms 1000] [--paint-budget-ms 1500]
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+ENTRY_MODULE = "tindermate.ui.app"
+LAZY_MODULES = ("openai", "jinja2", "aiohttp", "httpx")
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$")
+
+FIRST_PAINT_SCRIPT = """
+import time
+start = time.perf_counter()
+from tindermate.ui.app import TinderMate
+
+class FirstPaint(TinderMate):
+    async def on_mount(self):
+        self.push_screen("loading")
+        self.call_after_refresh(self.exit, time.perf_counter() - start)
+
+print(FirstPaint().run(headless=True))
+"""
+
+
+def measure_imports() -> tuple[float, dict[str, int]]:
+    """Return the cumulative import time of the entry module in ms and the self time of every imported module in us"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {ENTRY_MODULE}"],
+        cwd=BASE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    self_times: dict[str, int] = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if (match := _IMPORTTIME_RE.match(line)) is None:
+            continue
+        self_us, cumulative_us, _, module = match.groups()
+        self_times[module] = int(self_us)
+        if module == ENTRY_MODULE:
+            total_us = int(cumulative_us)
+    return total_us / 1000, self_times
+
+
+def measure_first_paint() -> float:
+    """Return the time from the process start to the first painted screen in ms"""
+    proc = subprocess.run(
+        [sys.executable, "-c", FIRST_PAINT_SCRIPT], cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    return float(proc.stdout.strip().splitlines()[-1]) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=1000)
+    parser.add_argument("--paint-budget-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=10, help="Number of the slowest modules to display")
+    args = parser.parse_args()
+
+    import_times, paint_times = [], []
+    self_times: dict[str, int] = {}
+    for _ in range(args.runs):
+        total_ms, self_times = measure_imports()
+        import_times.append(total_ms)
+        paint_times.append(measure_first_paint())
+
+    import_ms, paint_ms = statistics.median(import_times), statistics.median(paint_times)
+    print(f"Import of {ENTRY_MODULE}: {import_ms:.1f} ms (median of {args.runs} runs)")
+    print(f"First paint: {paint_ms:.1f} ms (median of {args.runs} runs)")
+    print(f"Slowest {args.top} modules by self time:")
+    for module, self_us in sorted(self_times.items(), key=lambda item: item[1], reverse=True)[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {module}")
+
+    errors = []
+    if eager := [module for module in LAZY_MODULES if module in self_times]:
+        errors.append(f"Modules expected to be loaded lazily were imported at startup: {', '.join(eager)}")
+    if import_ms > args.import_budget_ms:
+        errors.append(f"Import time {import_ms:.1f} ms exceeds the budget of {args.import_budget_ms} ms")
+    if paint_ms > args.paint_budget_ms:
+        errors.append(f"First paint {paint_ms:.1f} ms exceeds the budget of {args.paint_budget_ms} ms")
+
+    for error in errors:
+        print(f"ERROR: {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
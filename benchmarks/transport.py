@@ -0,0 +1,171 @@
+"""
+Transport benchmark of the Tinder client.
+
+Fetches the details of many users concurrently from a local stub of the Tinder API and compares the aiohttp
+transport, which opens a connection per concurrent request up to the connection limit, with the httpx transport,
+which multiplexes the requests over a single HTTP/2 connection. The stub delays every response by the given latency
+and counts the TCP connections it accepted. HTTP/2 is spoken in cleartext with prior knowledge, so the stub needs
+no certificates; it requires the `h2` package (`pip install httpx[http2]`).
+
+Usage: python -m benchmarks.transport [--requests 200] [--latency-ms 50] [--connection-limit 4] [--runs 3]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections.abc import Callable
+
+from tindermate.ratelimit import RateLimiter
+from tindermate.tinder.client import TinderClient
+from tindermate.transport import AiohttpTransport, HttpxTransport, Transport
+
+HOST = "127.0.0.1"
+
+
+def user_body(path: str) -> bytes:
+    user_id = path.split("?")[0].rsplit("/", 1)[-1]
+    user = {
+        "_id": user_id,
+        "bio": "I like hiking and coffee",
+        "birth_date": "1995-01-01T00:00:00Z",
+        "gender": 1,
+        "name": f"Name {user_id}",
+        "photos": [{"id": "photo", "url": "https://images.gotinder.com/photo.jpg"}],
+        "jobs": [],
+        "schools": [],
+        "user_interests": {"selected_interests": []},
+    }
+    return json.dumps({"status": 200, "results": user}).encode()
+
+
+class Stub:
+    """Server delaying every response by the latency and counting the accepted connections"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self.port = 0
+        self._server: asyncio.AbstractServer | None = None
+
+    async def __aenter__(self) -> "Stub":
+        self._server = await asyncio.start_server(self._accept, HOST, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        assert self._server is not None
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await self.serve(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        raise NotImplementedError
+
+
+class Http1Stub(Stub):
+    """HTTP/1.1 server with keep-alive, serving one request at a time per connection"""
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while request := await reader.readuntil(b"\r\n\r\n"):
+            path = request.split(b" ", 2)[1].decode()
+            await asyncio.sleep(self.latency)
+            body = user_body(path)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                + f"content-length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+
+
+class Http2Stub(Stub):
+    """HTTP/2 server answering the streams of a connection concurrently"""
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        responses: set[asyncio.Task] = set()
+
+        async def respond(stream_id: int, path: str) -> None:
+            await asyncio.sleep(self.latency)
+            body = user_body(path)
+            conn.send_headers(
+                stream_id,
+                [(":status", "200"), ("content-type", "application/json"), ("content-length", str(len(body)))],
+            )
+            conn.send_data(stream_id, body, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        while data := await reader.read(65536):
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    path = dict(event.headers)[b":path"].decode()
+                    task = asyncio.create_task(respond(event.stream_id, path))
+                    responses.add(task)
+                    task.add_done_callback(responses.discard)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            writer.write(conn.data_to_send())
+            await writer.drain()
+
+
+async def fetch_all(transport: Transport, port: int, requests: int) -> float:
+    """Fetch the details of the users concurrently, return the wall time in seconds"""
+    client = TinderClient("token", account="benchmark", rate_limiter=RateLimiter(0), transport=transport)
+    client._BASE_URL = f"http://{HOST}:{port}"
+    async with client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client._user_detail(f"user{i}") for i in range(requests)))
+        return time.perf_counter() - start
+
+
+async def run(
+    name: str, stub_cls: type[Stub], transport_factory: Callable[[], Transport], args: argparse.Namespace
+) -> None:
+    times, connections = [], []
+    for _ in range(args.runs):
+        async with stub_cls(args.latency_ms / 1000) as stub:
+            times.append(await fetch_all(transport_factory(), stub.port, args.requests))
+            connections.append(stub.connections)
+    wall_ms = statistics.median(times) * 1000
+    print(
+        f"{name:<16} {wall_ms:8.1f} ms  {args.requests / wall_ms * 1000:8.1f} req/s  "
+        f"{max(connections)} connection(s)  (median of {args.runs} runs)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--connection-limit", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    limit = args.connection_limit
+    benchmarks: list[tuple[str, type[Stub], Callable[[], Transport]]] = [
+        ("aiohttp HTTP/1.1", Http1Stub, lambda: AiohttpTransport(limit)),
+        ("httpx HTTP/1.1", Http1Stub, lambda: HttpxTransport(limit, http2=False)),
+        ("httpx HTTP/2", Http2Stub, lambda: HttpxTransport(limit, http2=True, prior_knowledge=True)),
+    ]
+    print(f"{args.requests} concurrent requests, {args.latency_ms} ms latency, connection limit {limit}")
+    for name, stub_cls, factory in benchmarks:
+        asyncio.run(run(name, stub_cls, factory, args))
+
+
+if __name__ == "__main__":
+    main()
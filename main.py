@@ -1,10 +1,4 @@
-from tindermate.ui.app import TinderMate
-
-
-def main() -> None:
-    app = TinderMate()
-    app.run()
-
+from tindermate.cli import main
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from tindermate.tinder.schemas import CurrentUser, Match, UserDetail
+from tindermate.type_aliases import AnyDict
+
+
+def user_payload(user_id: str, gender: int = 1, **overrides) -> AnyDict:
+    return {
+        "_id": user_id,
+        "bio": "I like hiking\nand coffee",
+        "birth_date": "1995-01-01T00:00:00Z",
+        "gender": gender,
+        "name": f"Name {user_id}",
+        "photos": [{"id": "photo", "url": "https://images.gotinder.com/photo.jpg"}],
+        "jobs": [{"title": {"name": "Designer"}}],
+        "schools": [{"name": "Charles University"}],
+        "city": {"name": "Prague"},
+        "user_interests": {
+            "selected_interests": [
+                {"id": "1", "name": "Hiking", "is_common": True},
+                {"id": "2", "name": "Art", "is_common": False},
+            ]
+        },
+    } | overrides
+
+
+def message_payload(match_id: str, sender: str, recipient: str, text: str, timestamp: int) -> AnyDict:
+    return {
+        "match_id": match_id,
+        "sent_date": datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).isoformat(),
+        "message": text,
+        "to": recipient,
+        "from": sender,
+        "timestamp": timestamp,
+    }
+
+
+def match_payload(match_id: str, user_id: str, messages: list[AnyDict] | None = None, **overrides) -> AnyDict:
+    flags = [
+        "closed",
+        "dead",
+        "pending",
+        "is_super_like",
+        "is_boost_match",
+        "is_super_boost_match",
+        "is_primetime_boost_match",
+        "is_experiences_match",
+        "is_fast_match",
+        "is_preferences_match",
+        "is_matchmaker_match",
+        "is_opener",
+        "has_shown_initial_interest",
+        "is_archived",
+    ]
+    return (
+        {flag: False for flag in flags}
+        | {
+            "seen": {},
+            "id": match_id,
+            "created_date": "2023-01-01T00:00:00Z",
+            "last_activity_date": "2023-01-02T00:00:00Z",
+            "message_count": len(messages or []),
+            "messages": messages or [],
+            "participants": [user_id],
+            "person": user_payload(user_id),
+        }
+        | overrides
+    )
+
+
+@pytest.fixture
+def make_match():
+    def factory(match_id: str, user_id: str | None = None, **overrides) -> Match:
+        return Match.parse_obj(match_payload(match_id, user_id or f"user-{match_id}", **overrides))
+
+    return factory
+
+
+@pytest.fixture
+def make_user_detail():
+    def factory(user_id: str, **overrides) -> UserDetail:
+        return UserDetail.parse_obj(user_payload(user_id, **overrides))
+
+    return factory
+
+
+@pytest.fixture
+def current_user() -> CurrentUser:
+    return CurrentUser.parse_obj(
+        user_payload("me", gender=0)
+        | {
+            "age_filter_min": 20,
+            "age_filter_max": 30,
+            "gender_filter": 1,
+            "distance_filter": 10,
+            "create_date": "2020-01-01T00:00:00Z",
+            "pos_info": {"country": {"name": "Czechia"}, "timezone": "Europe/Prague"},
+            "discoverable": True,
+        }
+    )
+
+
+class FakeTinder:
+    def __init__(self, current_user, matches, details):
+        self._current_user = current_user
+        self._matches = matches
+        self._details = details
+
+    async def current_user_info(self):
+        return self._current_user
+
+    async def iter_matches(self, messaged: bool):
+        for match in self._matches:
+            if bool(match.message_log) == messaged:
+                yield match
+
+    async def fetch_messages_for(self, match):
+        pass
+
+    async def fetch_detail_for(self, match):
+        if match.id not in self._details:
+            raise KeyError(match.id)
+        return SimpleNamespace(person=self._details[match.id], message_log=match.message_log)
+
+
+class FakeAgent:
+    ledger = SimpleNamespace(session_summary=lambda: "")
+
+    def __init__(self, failing: set[str] = frozenset()):
+        self._failing = failing
+        self.requests = 0
+
+    async def complete_text(self, prompt, match_id=None):
+        return await self.complete_rendered(prompt.render(), prompt.stop_words(), match_id=match_id)
+
+    async def complete_rendered(self, rendered, stop_words, match_id=None):
+        self.requests += 1
+        if match_id in self._failing:
+            raise RuntimeError(f"completion of {match_id} failed")
+        return [f"suggestion for {match_id}"]
@@ -0,0 +1,47 @@
+import pytest
+
+from tindermate import filecache
+from tindermate.configuration import Configuration
+from tindermate.tinder.client import CachingTinderClient
+from tindermate.ui.tokens import Tokens, list_accounts, token_file, validation_file
+
+
+@pytest.fixture
+def token_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Configuration, "TOKEN_FILE", tmp_path / ".tokens")
+    monkeypatch.setattr(Configuration, "TOKEN_VALIDATION_FILE", tmp_path / ".tokens.validation")
+    return tmp_path
+
+
+def test_tokens_are_stored_per_account(token_dir):
+    Tokens(openai_token="sk-default", tinder_token="tinder-default").save()
+    Tokens(openai_token="sk-work", tinder_token="tinder-work", account="work").save()
+
+    assert token_file("work") == token_dir / ".tokens-work"
+    assert validation_file("work") == token_dir / ".tokens-work.validation"
+    assert Tokens.load().tinder_token == "tinder-default"
+    assert Tokens.load("work") == Tokens(openai_token="sk-work", tinder_token="tinder-work", account="work")
+
+    validation_file("work").write_text("{}")
+    assert list_accounts() == [Configuration.DEFAULT_ACCOUNT, "work"]
+
+
+def test_invalid_account_name(token_dir):
+    with pytest.raises(ValueError):
+        token_file("../work")
+
+
+@pytest.mark.asyncio
+async def test_caching_client_uses_account_namespace(tmp_path, monkeypatch):
+    monkeypatch.setattr(filecache, "CACHE_DIR", tmp_path)
+
+    async def fake_get(self, path, params=None, conditional=False, endpoint=None):
+        return {"data": {"matches": []}}
+
+    monkeypatch.setattr(CachingTinderClient, "_get", fake_get)
+    for account in ["first", "second"]:
+        async with CachingTinderClient("token", account=account) as client:
+            assert await client.matches(messaged=False) == []
+
+    assert len(list((tmp_path / "tinder" / "first").iterdir())) == 1
+    assert len(list((tmp_path / "tinder" / "second").iterdir())) == 1
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from tindermate.configuration import Configuration, OpenAIConfiguration
+from tindermate.conversation import adaptive
+from tindermate.conversation.adaptive import AdaptiveController, GenerationLevel, degradation_levels
+from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.gpt import Completion, GPTClient, Usage
+from tindermate.conversation.usage import UsageLedger
+from tindermate.tracing import Tracer
+
+LEVELS = [GenerationLevel(3, 100, "big"), GenerationLevel(1, 50, "big"), GenerationLevel(1, 50, "fast")]
+
+
+class RecordingGPT(GPTClient):
+    """Records the generation parameters of the requests"""
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        self.requests: list[tuple[int, int]] = []
+
+    async def complete_text(self, prompt, num_choices, max_tokens, temperature, stop_words=None) -> Completion:
+        self.requests.append((num_choices, max_tokens))
+        return Completion([self.model] * num_choices, self.model, Usage(10, 20))
+
+
+@pytest.fixture
+def events(monkeypatch, tmp_path):
+    monkeypatch.setattr(adaptive, "tracer", tracer := Tracer(tmp_path / "traces.jsonl"))
+    return tracer
+
+
+def test_degradation_levels():
+    class Config(OpenAIConfiguration):
+        NUM_CHOICES, MAX_TOKENS, MODEL, FAST_MODEL = 3, 100, "big", "fast"
+
+    assert degradation_levels(Config) == [
+        GenerationLevel(3, 100, "big"),
+        GenerationLevel(2, 100, "big"),
+        GenerationLevel(1, 100, "big"),
+        GenerationLevel(1, 50, "big"),
+        GenerationLevel(1, 50, "fast"),
+    ]
+    Config.FAST_MODEL = "big"
+    assert degradation_levels(Config)[-1] == GenerationLevel(1, 50, "big")
+    Config.FAST_MODEL = None
+    assert {level.model for level in degradation_levels(Config)} == {"big"}
+
+
+def test_degrades_on_latency_and_restores_with_headroom(events, tmp_path):
+    controller = AdaptiveController(LEVELS, target_p95=1.0, min_samples=10)
+    for _ in range(9):
+        controller.observe(0, 2.0)
+    assert controller.level == 0
+    controller.observe(0, 2.0)
+    assert controller.current == GenerationLevel(1, 50, "big")
+
+    # the completions started before the change do not count
+    for _ in range(20):
+        controller.observe(0, 2.0)
+    assert controller.level == 1
+
+    for _ in range(10):
+        controller.observe(1, 0.8)
+    assert controller.level == 1
+    for _ in range(10):
+        controller.observe(1, 0.1)
+    assert controller.level == 0
+
+    assert events.counters["adaptive.degrade"] == events.counters["adaptive.restore"] == 1
+    assert events.counters["adaptive.level0.requests"] == 30
+    degrade, restore = map(json.loads, (tmp_path / "traces.jsonl").read_text().splitlines())
+    assert degrade["event"] == "adaptive.degrade" and degrade["current"]["num_choices"] == 1
+    assert restore["event"] == "adaptive.restore" and restore["level"] == 0
+
+
+def test_degrades_on_errors_down_to_last_level(events):
+    controller = AdaptiveController(LEVELS, target_p95=1.0, min_samples=10, max_error_rate=0.1)
+    for level in range(len(LEVELS)):
+        for idx in range(10):
+            controller.observe(level, 0.1, failed=idx < 2)
+    assert controller.current == GenerationLevel(1, 50, "fast")
+    assert events.counters["adaptive.degrade"] == 2
+
+
+@pytest.mark.asyncio
+async def test_agent_follows_controller(events):
+    big, fast = RecordingGPT(Configuration.OPENAI_CONFIG.MODEL), RecordingGPT("fast")
+    levels = [GenerationLevel(3, 100, big.model), GenerationLevel(1, 50, fast.model)]
+    controller = AdaptiveController(levels, target_p95=10.0, min_samples=1)
+    agent = ConversationAgent("sk-test", big, UsageLedger(), controller=controller)
+    agent._clients[fast.model] = fast
+
+    assert len(await agent.complete_rendered("prompt", [])) == 3
+    controller.level = 1
+    assert await agent.complete_rendered("prompt", []) == ["fast"]
+
+    assert big.requests == [(3, 100)]
+    assert fast.requests == [(1, 50)]
+    assert events.counters["adaptive.level0.requests"] == events.counters["adaptive.level1.requests"] == 1
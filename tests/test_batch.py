@@ -0,0 +1,124 @@
+import io
+import json
+
+import pytest
+
+from tindermate.batch import BatchRunner, MatchKind, load_completed
+from tindermate.conversation.usage import BudgetExceededError
+
+from .conftest import FakeAgent, FakeTinder, message_payload
+
+
+class BudgetLimitedAgent(FakeAgent):
+    def __init__(self, retry_after: float):
+        super().__init__()
+        self._retry_after = retry_after
+
+    async def complete_rendered(self, rendered, stop_words, match_id=None):
+        if self.requests == 0:
+            self.requests += 1
+            raise BudgetExceededError("The budget is exhausted", self._retry_after)
+        return await super().complete_rendered(rendered, stop_words, match_id=match_id)
+
+
+def make_runner(tinder, agent, output, **kwargs) -> BatchRunner:
+    return BatchRunner(tinder, agent, output, kinds=list(MatchKind), progress_stream=io.StringIO(), **kwargs)
+
+
+def read_results(output) -> list[dict]:
+    return [json.loads(line) for line in output.read_text().splitlines()]
+
+
+@pytest.fixture
+def details(make_user_detail):
+    return {match_id: make_user_detail(f"user-{match_id}") for match_id in ("m0", "m1", "m2")}
+
+
+@pytest.mark.asyncio
+async def test_results_are_written(tmp_path, current_user, make_match, details):
+    output = tmp_path / "results.jsonl"
+    matches = [make_match("m0"), make_match("m1")]
+
+    stats = await make_runner(FakeTinder(current_user, matches, details), FakeAgent({"m1"}), output).run()
+
+    results = {record["match_id"]: record for record in read_results(output)}
+    assert (stats.succeeded, stats.failed, stats.skipped) == (1, 1, 0)
+    assert results["m0"]["kind"] == "new" and results["m0"]["name"] == "Name user-m0"
+    assert results["m0"]["suggestions"] == ["suggestion for m0"] and results["m0"]["error"] is None
+    assert results["m1"]["error"] == "RuntimeError: completion of m1 failed"
+    assert load_completed(output) == {("m0", "new")}
+
+
+@pytest.mark.asyncio
+async def test_resumed_run_retries_only_failed_matches(tmp_path, current_user, make_match, details):
+    output = tmp_path / "results.jsonl"
+    tinder = FakeTinder(current_user, [make_match("m0"), make_match("m1")], details)
+    await make_runner(tinder, FakeAgent({"m1"}), output).run()
+
+    agent = FakeAgent()
+    stats = await make_runner(tinder, agent, output).run()
+
+    assert (stats.succeeded, stats.failed, stats.skipped) == (1, 0, 1)
+    assert agent.requests == 1
+    assert load_completed(output) == {("m0", "new"), ("m1", "new")}
+
+
+@pytest.mark.asyncio
+async def test_pending_only_skips_answered_conversations(tmp_path, current_user, make_match, details):
+    output = tmp_path / "results.jsonl"
+    matches = [
+        make_match("m0"),
+        make_match("m1", messages=[message_payload("m1", "user-m1", "me", "hello", 1000)]),
+        make_match("m2", messages=[message_payload("m2", "me", "user-m2", "hi there", 1000)]),
+    ]
+
+    stats = await make_runner(FakeTinder(current_user, matches, details), FakeAgent(), output, pending_only=True).run()
+
+    assert [record["match_id"] for record in read_results(output)] == ["m0", "m1"]
+    assert (stats.succeeded, stats.skipped) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_match_listed_twice_is_processed_once(tmp_path, current_user, make_match, details):
+    output = tmp_path / "results.jsonl"
+    matches = [make_match("m0"), make_match("m1"), make_match("m0")]
+    agent = FakeAgent()
+
+    stats = await make_runner(FakeTinder(current_user, matches, details), agent, output).run()
+
+    assert sorted(record["match_id"] for record in read_results(output)) == ["m0", "m1"]
+    assert (stats.succeeded, stats.skipped) == (2, 1)
+    assert agent.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_limit_caps_the_processed_matches(tmp_path, current_user, make_match, details):
+    output = tmp_path / "results.jsonl"
+    matches = [make_match("m0"), make_match("m0"), make_match("m1"), make_match("m2")]
+
+    stats = await make_runner(FakeTinder(current_user, matches, details), FakeAgent(), output, limit=2).run()
+
+    assert sorted(record["match_id"] for record in read_results(output)) == ["m0", "m1"]
+    assert stats.succeeded == 2
+
+
+@pytest.mark.asyncio
+async def test_exceeded_budget_is_waited_for(tmp_path, current_user, make_match, details):
+    output = tmp_path / "results.jsonl"
+    tinder = FakeTinder(current_user, [make_match("m0")], details)
+
+    stats = await make_runner(tinder, BudgetLimitedAgent(retry_after=0), output).run()
+
+    assert stats.succeeded == 1
+    assert read_results(output)[0]["suggestions"] == ["suggestion for m0"]
+
+
+@pytest.mark.asyncio
+async def test_exceeded_budget_fails_the_match_when_the_wait_is_too_long(tmp_path, current_user, make_match, details):
+    output = tmp_path / "results.jsonl"
+    tinder = FakeTinder(current_user, [make_match("m0")], details)
+
+    stats = await make_runner(tinder, BudgetLimitedAgent(retry_after=3600), output).run()
+
+    assert stats.failed == 1
+    assert read_results(output)[0]["error"] == "BudgetExceededError: The budget is exhausted"
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+from textual.app import App
+
+from tindermate.configuration import Configuration
+from tindermate.ui.components.body import Body
+from tindermate.ui.components.tinder_match import TinderMatch
+from tindermate.ui.context import AppContext
+
+from .test_ranking import DAY_MS, NOW_MS, conversation
+
+
+class PollingTinder:
+    """Serves the matches of both tabs, a conditional request returns the current ones"""
+
+    def __init__(self, current_user, new, messaged):
+        self.current_user = current_user
+        self.listed = {False: new, True: messaged}
+        self.requests: list[tuple[bool, bool]] = []
+        self.responding = asyncio.Event()
+        self.responding.set()
+
+    async def current_user_info(self):
+        return self.current_user
+
+    async def matches(self, messaged, conditional=False):
+        self.requests.append((messaged, conditional))
+        await self.responding.wait()
+        return list(self.listed[messaged])
+
+    async def fetch_detail_for(self, match):
+        await asyncio.Event().wait()
+
+
+class BodyApp(App):
+    def __init__(self, tinder):
+        super().__init__()
+        self.tinder = tinder
+
+    def compose(self):
+        yield Body(AppContext(self.tinder, agent=None, current_user=self.tinder.current_user))
+
+
+async def settle(pilot, body):
+    """Wait until the loading of the tabs finishes and the widgets are mounted"""
+    await pilot.pause()
+    await asyncio.gather(*body._loading_tasks.values())
+    await pilot.pause()
+
+
+def displayed(body, key):
+    return [widget.match.id for widget in body.tab_content(key).query(TinderMatch)]
+
+
+@pytest.fixture(autouse=True)
+def no_background_refresh(monkeypatch):
+    monkeypatch.setattr(Configuration, "MATCH_REFRESH", False)
+
+
+@pytest.mark.asyncio
+async def test_switching_tabs_keeps_the_content_mounted(current_user, make_match):
+    tinder = PollingTinder(current_user, [make_match("a")], [make_match("b")])
+    async with BodyApp(tinder).run_test() as pilot:
+        body = pilot.app.query_one(Body)
+        await settle(pilot, body)
+        widget = body.tab_content("new").query_one(TinderMatch)
+        body.active_tab = "messaged"
+        await settle(pilot, body)
+        body.active_tab = "new"
+        await settle(pilot, body)
+
+        assert body.tab_content("new").query_one(TinderMatch) is widget
+        assert body.tab_content("messaged").has_class("hidden")
+        assert not body.tab_content("new").has_class("hidden")
+        assert displayed(body, "messaged") == ["b"]
+        assert tinder.requests == [(False, False), (True, False)]
+
+
+@pytest.mark.asyncio
+async def test_loading_tab_is_not_fetched_again(current_user, make_match):
+    tinder = PollingTinder(current_user, [make_match("a")], [])
+    tinder.responding.clear()
+    async with BodyApp(tinder).run_test() as pilot:
+        body = pilot.app.query_one(Body)
+        await pilot.pause(0.05)
+        body.active_tab = "messaged"
+        await pilot.pause(0.05)
+        body.active_tab = "new"
+        tinder.responding.set()
+        await settle(pilot, body)
+
+        assert displayed(body, "new") == ["a"]
+        assert tinder.requests == [(False, False), (True, False)]
+
+
+@pytest.mark.asyncio
+async def test_outdated_tab_is_refreshed_in_place(monkeypatch, current_user, make_match):
+    monkeypatch.setattr(Configuration, "TAB_CONTENT_TTL", 0)
+    tinder = PollingTinder(current_user, [make_match("a"), make_match("b")], [])
+    async with BodyApp(tinder).run_test() as pilot:
+        body = pilot.app.query_one(Body)
+        await settle(pilot, body)
+        kept = body.tab_content("new").query_one(f"#{TinderMatch.widget_id('a')}", TinderMatch)
+        tinder.listed[False] = [make_match("a"), make_match("c")]
+        body.active_tab = "messaged"
+        await settle(pilot, body)
+        body.active_tab = "new"
+        await settle(pilot, body)
+
+        assert sorted(displayed(body, "new")) == ["a", "c"]
+        assert body.tab_content("new").query_one(f"#{TinderMatch.widget_id('a')}", TinderMatch) is kept
+        assert tinder.requests == [(False, False), (True, False), (False, True)]
+
+
+@pytest.mark.asyncio
+async def test_refreshed_tab_follows_the_ranking(monkeypatch, current_user, make_match):
+    monkeypatch.setattr(Body, "_TAB_CONTENT_MAX_ITEMS", 2)
+
+    def match(match_id, *senders, days_ago, **overrides):
+        messages = conversation(match_id, *senders, start=NOW_MS - days_ago * DAY_MS)
+        return make_match(match_id, messages=messages, **overrides)
+
+    tinder = PollingTinder(
+        current_user, [match("a", "me", days_ago=1), match("b", "me", days_ago=2), match("c", "me", days_ago=3)], []
+    )
+    async with BodyApp(tinder).run_test() as pilot:
+        body = pilot.app.query_one(Body)
+        await settle(pilot, body)
+        assert displayed(body, "new") == ["a", "b"]
+        kept = body.tab_content("new").query_one(f"#{TinderMatch.widget_id('a')}", TinderMatch)
+
+        replied = match("c", "me", "user-c", days_ago=3, last_activity_date="2023-01-03T00:00:00Z")
+        tinder.listed[False] = [match("a", "me", days_ago=1), match("b", "me", days_ago=2), replied]
+        await body.refresh_tab_content("new")
+        await settle(pilot, body)
+
+        assert displayed(body, "new") == ["c", "a"]
+        assert body.tab_content("new").query_one(f"#{TinderMatch.widget_id('a')}", TinderMatch) is kept
+        assert body.tab_content("new").children[-1].id == "more-new"
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from benchmarks.fake_openai import FakeOpenAI, Latency
+from tindermate.cancellation import CancellationToken
+from tindermate.conversation import agent as agent_module
+from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.gpt import GPTClient, OpenAITimeoutError
+from tindermate.conversation.usage import UsageLedger
+from tindermate.ratelimit import RateLimiter
+from tindermate.tinder.client import EndpointClass, TinderClient, default_timeouts
+from tindermate.tracing import tracer
+from tindermate.transport import Cassette, CassettePlayer, Interaction, ReplayTransport, Timeouts
+
+from .test_transport import FakeTransport, json_response
+
+
+@pytest.mark.asyncio
+async def test_token_cancels_outstanding_tasks():
+    tracer.reset()
+    token = CancellationToken("match-1")
+    done = token.track(asyncio.create_task(asyncio.sleep(0)), "fetch")
+    pending = [token.track(asyncio.create_task(asyncio.sleep(10)), kind) for kind in ("fetch", "generation")]
+    await done
+    assert token.pending == 2
+
+    assert token.cancel() == 2
+    await asyncio.gather(*pending, return_exceptions=True)
+    assert all(task.cancelled() for task in pending)
+    late = token.track(asyncio.create_task(asyncio.sleep(10)), "generation")
+    await asyncio.gather(late, return_exceptions=True)
+    assert late.cancelled()
+    assert tracer.counters["cancelled.fetch"] == 1
+    assert tracer.counters["cancelled.generation"] == 2
+
+
+class TimeoutsRecordingTransport(FakeTransport):
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.timeouts = []
+
+    async def request(self, method, url, params=None, headers=None, timeouts=None):
+        self.timeouts.append(timeouts)
+        return await super().request(method, url, params, headers)
+
+
+@pytest.mark.asyncio
+async def test_tinder_requests_use_timeouts_of_endpoint_class(current_user):
+    profile = {"data": {"user": json.loads(current_user.json(by_alias=True))}}
+    transport = TimeoutsRecordingTransport([json_response({"data": {"matches": []}}), json_response(profile)])
+    timeouts = default_timeouts() | {EndpointClass.LIST: Timeouts(1, 2, 3)}
+    client = TinderClient("token", rate_limiter=RateLimiter(rate=0), transport=transport, timeouts=timeouts)
+    assert await client.matches(messaged=False) == []
+    assert (await client.current_user_info()).id == current_user.id
+    assert transport.timeouts == [Timeouts(1, 2, 3), timeouts[EndpointClass.PROFILE]]
+
+
+@pytest.mark.asyncio
+async def test_slow_tinder_response_times_out(tmp_path):
+    tracer.reset()
+    url, params = "https://api.gotinder.com/v2/profile", {"locale": "en", "include": "user"}
+    cassette = Cassette(
+        tmp_path / "cassette.jsonl", [Interaction("tinder:default", "GET", url, params, duration_ms=1000)]
+    )
+    client = TinderClient(
+        "token",
+        rate_limiter=RateLimiter(rate=0),
+        transport=ReplayTransport(CassettePlayer(cassette), "tinder:default"),
+        timeouts={endpoint: Timeouts(total=0.05) for endpoint in EndpointClass},
+    )
+    with pytest.raises(asyncio.TimeoutError):
+        await client.current_user_info()
+    assert tracer.counters["tinder.timeouts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_completion_times_out():
+    tracer.reset()
+    async with FakeOpenAI(Latency("fixed", (1.0,))) as server:
+        client = GPTClient("text-davinci-003", server.api_base, Timeouts(connect=1, total=0.1), "sk-test")
+        with pytest.raises(OpenAITimeoutError):
+            await client.complete_text("Say hi", 1, 10, 0.8)
+    assert tracer.counters["openai.timeouts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_completion_waiting_for_slot_is_not_sent(monkeypatch):
+    slots = asyncio.Semaphore(0)
+    monkeypatch.setattr(agent_module, "completion_slots", lambda: slots)
+    tracer.reset()
+    agent = ConversationAgent("sk-test", GPTClient("text-davinci-003"), UsageLedger())
+    task = asyncio.create_task(agent.complete_rendered("prompt", []))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert tracer.counters["openai.cancelled"] == 1
+    assert tracer.counters["openai.cancelled_unsent_tokens"] > 0
@@ -0,0 +1,96 @@
+import json
+
+import openai
+import pytest
+
+from benchmarks.fake_openai import FakeOpenAI, Latency, generate
+from tindermate.configuration import Configuration
+from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.gpt import ChatGPTClient, GPTClient, OpenAIAuthError
+from tindermate.conversation.prompts import FirstMessagePrompt
+from tindermate.conversation.usage import UsageLedger
+
+
+@pytest.fixture
+def api_key():
+    return "sk-test"
+
+
+def test_generate_is_deterministic():
+    tokens, reason = generate("prompt", 0, 10, [], seed=0)
+    assert (tokens, reason) == generate("prompt", 0, 10, [], seed=0)
+    assert len(tokens) <= 10 and reason in {"stop", "length"}
+    assert generate("prompt", 1, 10, [], seed=0) != (tokens, reason)
+
+    [text], reason = generate("prompt", 0, 10, [tokens[1]], seed=0)
+    assert (text, reason) == (tokens[0], "stop")
+
+
+@pytest.mark.asyncio
+async def test_completions_with_usage(api_key):
+    async with FakeOpenAI(api_keys={api_key}) as server:
+        client = GPTClient("text-davinci-003", server.api_base, api_key=api_key)
+        completion = await client.complete_text("Say hi", 3, 20, 0.8, stop_words=["\nName:"])
+        assert completion == await client.complete_text("Say hi", 3, 20, 0.8, stop_words=["\nName:"])
+        chat = await ChatGPTClient(server.api_base, api_key).complete_text("Say hi", 2, 20, 0.8)
+
+    assert len(completion.choices) == 3 and all(completion.choices)
+    assert completion.usage.completion_tokens == sum(len(choice.split()) for choice in completion.choices)
+    assert completion.usage.prompt_tokens > 0
+    assert chat.model == "text-chat-davinci-002-20221122" and len(chat.choices) == 2
+    assert server.stats == {200: 3}
+
+
+@pytest.mark.asyncio
+async def test_auth_errors_and_rate_limits(api_key):
+    async with FakeOpenAI(api_keys={"sk-other"}) as server:
+        client = GPTClient("text-davinci-003", server.api_base, api_key=api_key)
+        with pytest.raises(OpenAIAuthError):
+            await client.complete_text("Say hi", 1, 20, 0.8)
+        with pytest.raises(OpenAIAuthError):
+            await client.check_credentials(timeout=5)
+
+        # the key is kept per client, the other client is authenticated
+        client = GPTClient("text-davinci-003", server.api_base, api_key="sk-other")
+        server.rate_limit_rate = 1
+        with pytest.raises(openai.error.RateLimitError):
+            await client.complete_text("Say hi", 1, 20, 0.8)
+
+    assert server.stats == {401: 2, 429: 1}
+
+
+@pytest.mark.asyncio
+async def test_streamed_completion(api_key):
+    async with FakeOpenAI(Latency("fixed", (0.01,))) as server:
+        response = await openai.Completion.acreate(
+            model="text-davinci-003",
+            prompt="Say hi",
+            n=2,
+            max_tokens=10,
+            stream=True,
+            api_key=api_key,
+            api_base=server.api_base,
+        )
+        texts, reasons = ["", ""], [None, None]
+        async for chunk in response:
+            [choice] = chunk["choices"]
+            texts[choice["index"]] += choice["text"]
+            reasons[choice["index"]] = reasons[choice["index"]] or choice["finish_reason"]
+
+    for idx in range(2):
+        tokens, reason = generate("Say hi", idx, 10, [], seed=0)
+        assert (texts[idx], reasons[idx]) == ("".join(tokens), reason)
+
+
+@pytest.mark.asyncio
+async def test_agent_against_fake_server(api_key, tmp_path, current_user, make_user_detail):
+    async with FakeOpenAI() as server:
+        ledger = UsageLedger(tmp_path / "usage.jsonl")
+        agent = ConversationAgent(api_key, GPTClient("text-davinci-003", server.api_base, api_key=api_key), ledger)
+        prompt = FirstMessagePrompt(current_user=current_user, matched_user=make_user_detail("user"))
+        suggestions = await agent.complete_text(prompt, match_id="m0")
+
+    assert len(suggestions) == Configuration.OPENAI_CONFIG.NUM_CHOICES
+    assert ledger.match_totals["m0"].requests == 1
+    [record] = map(json.loads, (tmp_path / "usage.jsonl").read_text().splitlines())
+    assert record["match_id"] == "m0"
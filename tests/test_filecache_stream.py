@@ -0,0 +1,91 @@
+import pickle
+from collections.abc import AsyncIterator, Iterator
+
+import pytest
+
+from tindermate.filecache import STREAM_CHUNK_SIZE, file_cache, file_cache_custom_key
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    path = tmp_path / "cache"
+    path.mkdir()
+    return path
+
+
+def test_generator_is_written_incrementally_and_replayed_lazily(cache_dir):
+    produced = []
+
+    @file_cache_custom_key(key="numbers", cache_dir=cache_dir)
+    def numbers(n: int) -> Iterator[int]:
+        for i in range(n):
+            produced.append(i)
+            yield i
+
+    n = STREAM_CHUNK_SIZE * 3 + 5
+    assert list(numbers(n)) == list(range(n))
+    assert len(produced) == n
+    assert [path.name for path in cache_dir.iterdir()] == ["numbers.txt"]
+
+    # the cached items are read chunk by chunk, the source generator is not called again
+    gen = numbers(n)
+    assert next(gen) == 0
+    assert list(gen) == list(range(1, n))
+    assert len(produced) == n
+
+
+def test_abandoned_generator_is_not_cached(cache_dir):
+    @file_cache_custom_key(key="numbers", cache_dir=cache_dir)
+    def numbers(n: int) -> Iterator[int]:
+        yield from range(n)
+
+    gen = numbers(STREAM_CHUNK_SIZE * 2)
+    assert [next(gen) for _ in range(STREAM_CHUNK_SIZE + 1)] == list(range(STREAM_CHUNK_SIZE + 1))
+    gen.close()
+
+    assert list(cache_dir.iterdir()) == []
+    assert list(numbers(3)) == [0, 1, 2]
+
+
+def test_failing_generator_is_not_cached(cache_dir):
+    @file_cache_custom_key(key="failing", cache_dir=cache_dir)
+    def failing() -> Iterator[int]:
+        yield 1
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        list(failing())
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_legacy_list_cache_is_replayed(cache_dir):
+    with (cache_dir / "legacy.txt").open("wb") as f:
+        pickle.dump(["a", "b"], f)
+
+    @file_cache_custom_key(key="legacy", cache_dir=cache_dir)
+    def legacy() -> Iterator[str]:
+        raise AssertionError("should be served from the cache")
+        yield
+
+    assert list(legacy()) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_async_generator_cache(cache_dir):
+    calls = []
+
+    @file_cache(cache_dir=cache_dir)
+    async def pages(n: int) -> AsyncIterator[int]:
+        calls.append(n)
+        for i in range(n):
+            yield i
+
+    assert [item async for item in pages(100)] == list(range(100))
+    assert [item async for item in pages(100)] == list(range(100))
+    assert calls == [100]
+
+    gen = pages(10)
+    assert await gen.__anext__() == 0
+    await gen.aclose()
+    assert [item async for item in pages(10)] == list(range(10))
+    assert calls == [100, 10, 10]
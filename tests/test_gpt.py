@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from tindermate.configuration import Configuration
+from tindermate.conversation import gpt
+from tindermate.conversation.gpt import Completion, GPTClient, HedgedGPTClient, OpenAITimeoutError, Usage
+
+
+class DelayedGPT(GPTClient):
+    """Answers the requests after the given delays, one by one"""
+
+    def __init__(self, model: str, *delays: float, error: Exception | None = None):
+        super().__init__(model)
+        self.delays = list(delays)
+        self.error = error
+        self.cancelled = 0
+
+    async def complete_text(self, prompt, num_choices, max_tokens, temperature, stop_words=None) -> Completion:
+        try:
+            await asyncio.sleep(self.delays.pop(0))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return Completion([self.model], self.model, Usage(10, 20))
+
+
+@pytest.mark.asyncio
+async def test_slow_request_is_hedged():
+    primary, hedge = DelayedGPT("primary", 0.01, 1), DelayedGPT("hedge", 0.01)
+    client = HedgedGPTClient(primary, hedge, hedge_after=0.05)
+
+    assert (await client.complete_text("hi", 1, 10, 0.8)).model == "primary"
+    assert (await client.complete_text("hi", 1, 10, 0.8)).model == "hedge"
+    assert primary.cancelled == 1
+
+
+@pytest.mark.asyncio
+async def test_hedge_delay_follows_latency_percentile():
+    primary = DelayedGPT("primary", *[0.001] * 4, 1)
+    client = HedgedGPTClient(primary, DelayedGPT("hedge", 0), percentile=50, min_samples=4)
+    for _ in range(4):
+        assert client.hedge_delay() is None
+        await client.complete_text("hi", 1, 10, 0.8)
+
+    assert 0 < client.hedge_delay() < 0.1
+    assert (await client.complete_text("hi", 1, 10, 0.8)).model == "hedge"
+
+
+@pytest.mark.asyncio
+async def test_failed_attempt_waits_for_other():
+    primary = DelayedGPT("primary", 0.05, error=RuntimeError("boom"))
+    client = HedgedGPTClient(primary, DelayedGPT("hedge", 0.1), hedge_after=0.01)
+    assert (await client.complete_text("hi", 1, 10, 0.8)).model == "hedge"
+
+    both_failing = HedgedGPTClient(primary, DelayedGPT("hedge", 0, error=ValueError()), hedge_after=0.01)
+    primary.delays = [0.05]
+    with pytest.raises(ValueError):
+        await both_failing.complete_text("hi", 1, 10, 0.8)
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancels_requests():
+    primary, hedge = DelayedGPT("primary", 1), DelayedGPT("hedge", 1)
+    client = HedgedGPTClient(primary, hedge, deadline=0.05, hedge_after=0.01)
+    with pytest.raises(OpenAITimeoutError):
+        await client.complete_text("hi", 1, 10, 0.8)
+    assert (primary.cancelled, hedge.cancelled) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_usage_of_cancelled_request_is_included():
+    primary, hedge = DelayedGPT("primary", 1), DelayedGPT("hedge", 0.01)
+    completion = await HedgedGPTClient(primary, hedge, hedge_after=0.01).complete_text("hi", 1, 10, 0.8)
+    assert completion.model == "hedge"
+    assert completion.usage == Usage(20, 40)
+
+    # a failed request is not billed
+    primary = DelayedGPT("primary", 0.02, error=RuntimeError("boom"))
+    completion = await HedgedGPTClient(primary, DelayedGPT("hedge", 0.05), hedge_after=0.01).complete_text(
+        "hi", 1, 10, 0.8
+    )
+    assert completion.usage == Usage(10, 20)
+
+
+@pytest.mark.asyncio
+async def test_hedge_waits_for_completion_slot(monkeypatch):
+    slots = asyncio.Semaphore(0)
+    monkeypatch.setattr(gpt, "completion_slots", lambda: slots)
+    primary, hedge = DelayedGPT("primary", 0.1), DelayedGPT("hedge", 0)
+    completion = await HedgedGPTClient(primary, hedge, hedge_after=0.01).complete_text("hi", 1, 10, 0.8)
+    assert completion.model == "primary"
+    assert hedge.delays == [0]
+
+
+def test_completion_slots_are_per_event_loop(monkeypatch):
+    monkeypatch.setattr(Configuration.OPENAI_CONFIG, "MAX_CONCURRENT_REQUESTS", 1)
+
+    async def contend() -> asyncio.Semaphore:
+        async def complete() -> None:
+            async with gpt.completion_slots():
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(complete(), complete())
+        return gpt.completion_slots()
+
+    # every run waits on the slots, which would fail if the semaphore was bound to the first loop
+    assert asyncio.run(contend()) is not asyncio.run(contend())
+
+
+@pytest.mark.asyncio
+async def test_credentials_check_times_out(monkeypatch):
+    import openai
+
+    async def hanging_alist(**kwargs):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(openai.Model, "alist", hanging_alist)
+    with pytest.raises(OpenAITimeoutError):
+        await GPTClient("text-davinci-003", api_key="sk-test").check_credentials(timeout=0.01)
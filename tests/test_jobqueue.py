@@ -0,0 +1,127 @@
+import io
+import json
+
+import pytest
+
+from tindermate.batch import MatchKind
+from tindermate.conversation.usage import BudgetExceededError
+from tindermate.jobqueue import JobQueue, JobStatus
+from tindermate.worker import QueueWorker, enqueue_matches
+
+from .conftest import FakeAgent, FakeTinder, message_payload
+
+
+def test_enqueue_skips_queued_jobs():
+    queue = JobQueue()
+    assert queue.enqueue("me", [("a", "new", "{}"), ("b", "new", "{}")]) == 2
+    assert queue.enqueue("me", [("a", "new", "{}"), ("a", "messaged", "{}")]) == 1
+    assert queue.enqueue("other", [("a", "new", "{}")]) == 1
+
+    job = queue.lease("me", "worker", 60)
+    assert (job.match_id, job.kind, job.attempts) == ("a", "new", 1)
+    assert queue.ack(job, "worker")
+    assert queue.enqueue("me", [("a", "new", "{}")]) == 0
+    assert queue.enqueue("me", [("a", "new", "{}")], again=True) == 1
+    assert queue.counts("me") == {JobStatus.QUEUED: 3, JobStatus.LEASED: 0, JobStatus.DONE: 0, JobStatus.DEAD: 0}
+
+
+def test_failed_jobs_are_retried_until_dead():
+    queue = JobQueue(max_attempts=2, backoff=0)
+    queue.enqueue("me", [("a", "new", "{}")])
+
+    job = queue.lease("me", "worker", 60)
+    assert queue.fail(job, "worker", "RuntimeError: boom") == JobStatus.QUEUED
+    job = queue.lease("me", "worker", 60)
+    assert job.attempts == 2
+    assert queue.fail(job, "worker", "RuntimeError: boom again") == JobStatus.DEAD
+    assert queue.lease("me", "worker", 60) is None
+    assert queue.next_available_in("me") is None
+
+    [dead] = queue.dead_letters("me")
+    assert (dead.match_id, dead.attempts, dead.last_error) == ("a", 2, "RuntimeError: boom again")
+    assert queue.retry_dead("me") == 1
+    assert queue.lease("me", "worker", 60).attempts == 1
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    # every worker process has its own connection to the queue
+    crashed, alive = JobQueue(tmp_path / "jobs.sqlite3", max_attempts=2), JobQueue(tmp_path / "jobs.sqlite3")
+    crashed.enqueue("me", [("a", "new", "{}"), ("b", "new", "{}")])
+
+    job = crashed.lease("me", "crashed", 0)
+    assert alive.lease("me", "alive", 60).match_id == "b"
+    taken_over = alive.lease("me", "alive", 0)
+    assert (taken_over.match_id, taken_over.attempts) == ("a", 2)
+    assert not crashed.ack(job, "crashed")
+
+    # the lease expired again after the last attempt
+    assert crashed.lease("me", "crashed", 60) is None
+    assert [job.match_id for job in crashed.dead_letters("me")] == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_worker_drains_queue(tmp_path, current_user, make_match, make_user_detail):
+    messages = [message_payload("m1", "user-m1", "me", "hello", 1000)]
+    matches = [make_match("m0"), make_match("m1", messages=messages), make_match("m2")]
+    details = {match.id: make_user_detail(match.person.id) for match in matches}
+    tinder = FakeTinder(current_user, matches, details)
+    queue = JobQueue(max_attempts=2, backoff=0)
+    assert await enqueue_matches(tinder, queue, "me", list(MatchKind)) == 3
+
+    output = tmp_path / "results.jsonl"
+    worker = QueueWorker(
+        tinder, FakeAgent(failing={"m2"}), queue, "me", output, concurrency=2, progress_stream=io.StringIO()
+    )
+    stats = await worker.run()
+
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted((result["match_id"], result["kind"]) for result in results) == [("m0", "new"), ("m1", "messaged")]
+    assert (stats.succeeded, stats.failed) == (2, 2)
+    assert queue.counts("me")[JobStatus.DONE] == 2
+    assert [job.match_id for job in queue.dead_letters("me")] == ["m2"]
+
+
+class BudgetExhaustedAgent(FakeAgent):
+    async def complete_rendered(self, rendered, stop_words, match_id=None):
+        raise BudgetExceededError("budget exceeded", retry_after=0)
+
+
+@pytest.mark.asyncio
+async def test_postponed_jobs_die_when_budget_keeps_running_out(
+    tmp_path, monkeypatch, current_user, make_match, make_user_detail
+):
+    monkeypatch.setattr(QueueWorker, "_MAX_POSTPONES", 2)
+    match = make_match("m0")
+    tinder = FakeTinder(current_user, [match], {match.id: make_user_detail(match.person.id)})
+    queue = JobQueue(max_attempts=2, backoff=0)
+    await enqueue_matches(tinder, queue, "me", [MatchKind.NEW])
+
+    progress = io.StringIO()
+    worker = QueueWorker(
+        tinder,
+        BudgetExhaustedAgent(),
+        queue,
+        "me",
+        tmp_path / "out.jsonl",
+        poll_interval=0.01,
+        progress_stream=progress,
+    )
+    stats = await worker.run()
+
+    assert stats.failed == 2
+    assert progress.getvalue().count("postponing m0 by 0s") == 4
+    assert [job.match_id for job in queue.dead_letters("me")] == ["m0"]
+
+
+@pytest.mark.asyncio
+async def test_job_with_broken_payload_fails(tmp_path, current_user):
+    tinder = FakeTinder(current_user, [], {})
+    queue = JobQueue(max_attempts=1, backoff=0)
+    queue.enqueue("me", [("a", "new", '{"id": "a"}')])
+    worker = QueueWorker(tinder, FakeAgent(), queue, "me", tmp_path / "out.jsonl", progress_stream=io.StringIO())
+
+    stats = await worker.run()
+
+    assert stats.failed == 1
+    [dead] = queue.dead_letters("me")
+    assert dead.last_error.startswith("ValidationError")
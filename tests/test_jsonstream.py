@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import json
+import random
+
+import pytest
+
+from tindermate.ratelimit import RateLimiter
+from tindermate.tinder import jsonstream
+from tindermate.tinder.client import TinderClient
+from tindermate.tinder.jsonstream import JsonArrayParser
+from tindermate.transport import StreamedResponse, Transport
+
+from .conftest import match_payload, message_payload
+
+DOCUMENT = {
+    "meta": {"status": 200, "matches": ["not this one"]},
+    "data": {
+        "other": [1, {"key": "]"}],
+        "matches": [{"id": i, "text": 'é"\\},]ü' * (i % 3), "nested": [1, [2, {}]]} for i in range(20)]
+        + [None, 3, "text", 12.5e3, True],
+        "next_page_token": "token",
+    },
+}
+
+
+def test_parse_array_split_into_random_chunks():
+    raw = json.dumps(DOCUMENT, ensure_ascii=False).encode()
+    rng = random.Random(0)
+    for _ in range(100):
+        parser = JsonArrayParser("data", "matches")
+        elements, pos = [], 0
+        while pos < len(raw):
+            size = rng.randint(1, 50)
+            elements += parser.feed(raw[pos : pos + size])
+            pos += size
+
+        assert elements == DOCUMENT["data"]["matches"]
+        assert parser.elements == len(elements)
+        assert parser.document == {**DOCUMENT, "data": {**DOCUMENT["data"], "matches": []}}
+
+
+def test_elements_returned_as_soon_as_complete():
+    parser = JsonArrayParser("data", "messages")
+    assert parser.feed(b'{"data": {"messages": [{"id": 1}, {"id"') == [{"id": 1}]
+    assert parser.feed(b": 2}, 12") == [{"id": 2}]
+    assert parser.feed(b"3]}}") == [123]
+    assert parser.document == {"data": {"messages": []}}
+
+
+def test_incomplete_document():
+    parser = JsonArrayParser("data", "matches")
+    parser.feed(b'{"data": {"matches": [{"id": 1}, {"id": 2')
+    with pytest.raises(ValueError):
+        _ = parser.document
+
+
+@pytest.mark.parametrize("chunk", [b'{"id": x}, {"id": 3}', b"2 3]}", b'{"id": 2}}]}'])
+def test_malformed_element_fails_right_away(chunk):
+    parser = JsonArrayParser("data")
+    assert parser.feed(b'{"data": [1, ') == [1]
+    with pytest.raises(ValueError, match="Malformed"):
+        parser.feed(chunk)
+
+
+def test_element_is_decoded_once(monkeypatch):
+    decoded = []
+
+    class CountingDecoder(json.JSONDecoder):
+        def raw_decode(self, s, idx=0):
+            decoded.append(idx)
+            return super().raw_decode(s, idx)
+
+    monkeypatch.setattr(jsonstream, "_decoder", CountingDecoder())
+    element = {"messages": [{"text": "x" * 10, "nested": [[]]} for _ in range(100)]}
+    raw = json.dumps({"data": [element, element]}).encode()
+    parser = JsonArrayParser("data")
+    elements = []
+    for pos in range(0, len(raw), 7):
+        elements += parser.feed(raw[pos : pos + 7])
+
+    assert elements == [element, element]
+    assert len(decoded) == 2
+
+
+class ChunkedTransport(Transport):
+    """Sends the pages in chunks of a few bytes, pausing between the chunks"""
+
+    def __init__(self, pages):
+        self.pages = [json.dumps(page).encode() for page in pages]
+        self.sent = 0
+        self.timeouts = []
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, params=None, headers=None, timeouts=None):
+        self.timeouts.append(timeouts)
+        body = self.pages.pop(0)
+
+        async def chunks():
+            for pos in range(0, len(body), 100):
+                await asyncio.sleep(0)
+                self.sent += 1
+                yield body[pos : pos + 100]
+
+        yield StreamedResponse(200, {}, chunks())
+
+
+@pytest.mark.asyncio
+async def test_iter_matches_parses_while_receiving():
+    messages = [message_payload("m0", "u0", "me", "hi " * 50, 1000 + i) for i in range(5)]
+    pages = [
+        {"data": {"matches": [match_payload(f"m{i}", f"u{i}", messages) for i in range(3)], "next_page_token": "p2"}},
+        {"data": {"matches": [match_payload("m3", "u3")]}},
+    ]
+    transport = ChunkedTransport(pages)
+    tinder = TinderClient("token", rate_limiter=RateLimiter(0), transport=transport)
+
+    received = []
+    async for match in tinder.iter_matches(messaged=True):
+        received.append((match.id, transport.sent))
+
+    assert [match_id for match_id, _ in received] == ["m0", "m1", "m2", "m3"]
+    # the first match is built long before the rest of the page arrives
+    assert received[0][1] < received[2][1]
+    # the consumer may block between the elements, only the connect and read timeouts apply
+    assert {timeouts.total for timeouts in transport.timeouts} == {None}
@@ -0,0 +1,100 @@
+import pickle
+from datetime import datetime, timezone
+
+import pytest
+
+from tindermate.tinder.message_log import LogEntry, MessageLog
+from tindermate.tinder.schemas import Message
+
+
+def make_message(sender: str, text: str, timestamp: int, message_id: str | None = None) -> Message:
+    return Message.parse_obj(
+        {
+            "_id": message_id,
+            "match_id": "match",
+            "sent_date": datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc),
+            "message": text,
+            "to": "me" if sender == "them" else "them",
+            "from": sender,
+            "timestamp": timestamp,
+        }
+    )
+
+
+@pytest.fixture
+def log():
+    return MessageLog.from_messages(
+        [make_message("them", "hi", 1000), make_message("me", "hello", 2000), make_message("them", "how are you", 3000)]
+    )
+
+
+def test_entries_are_chronological(log):
+    assert len(log) == 3
+    assert log[0] == LogEntry("them", "hi", 1000)
+    assert log[-1].text == "how are you"
+    assert log.last_entry.sent_date == datetime.fromtimestamp(3, tz=timezone.utc)
+    assert [entry.text for entry in log] == ["hi", "hello", "how are you"]
+
+
+def test_last_n(log):
+    assert [entry.text for entry in log.last(2)] == ["hello", "how are you"]
+    assert len(log.last(10)) == 3
+    assert log.last(0) == []
+
+
+def test_extend_skips_known_messages(log):
+    appended = log.extend([make_message("them", "hi", 1000), make_message("me", "fine", 4000)])
+    assert appended == 1
+    assert [entry.text for entry in log] == ["hi", "hello", "how are you", "fine"]
+    assert log.extend([make_message("me", "fine", 4000)]) == 0
+
+
+def test_extend_merges_older_messages():
+    # the log of a match is seeded with the last message embedded in the list of matches
+    log = MessageLog.from_messages([make_message("them", "how are you", 3000)])
+    history = [
+        make_message("them", "hi", 1000),
+        make_message("me", "hello", 2000),
+        make_message("them", "how are you", 3000),
+    ]
+    assert log.extend(history) == 2
+    assert [entry.text for entry in log] == ["hi", "hello", "how are you"]
+    assert log.last_timestamp == 3000
+
+
+def test_extend_keeps_messages_of_same_millisecond(log):
+    assert log.extend([make_message("them", "I'm good", 3000), make_message("them", "and you?", 3000)]) == 2
+    assert [entry.text for entry in log.last(3)] == ["how are you", "I'm good", "and you?"]
+    assert not log.append("them", "and you?", 3000)
+
+
+def test_identical_messages_of_one_batch_are_kept(log):
+    batch = [make_message("them", "?", 4000), make_message("them", "?", 4000)]
+    assert log.extend(batch) == 2
+    # fetched again together with an older message
+    assert log.extend([make_message("them", "how are you", 3000)] + batch) == 0
+    assert log.extend([make_message("them", "?", 3500)] + batch + [make_message("them", "?", 4000)]) == 2
+    assert [entry.timestamp for entry in log.last(5)] == [3000, 3500, 4000, 4000, 4000]
+
+
+def test_messages_with_ids_are_identified_by_them():
+    log = MessageLog.from_messages([make_message("them", "hi", 1000, "m1"), make_message("them", "hi", 1000, "m2")])
+    assert log.extend([make_message("them", "hi", 1000, "m2"), make_message("them", "hi", 1000, "m3")]) == 1
+    assert [entry.message_id for entry in log] == ["m1", "m2", "m3"]
+
+
+def test_senders_are_interned(log):
+    assert log[0].sender_id is log[2].sender_id
+
+
+def test_empty_log():
+    log = MessageLog()
+    assert log.last_entry is None
+    assert log.last_timestamp is None
+    with pytest.raises(IndexError):
+        _ = log[0]
+
+
+def test_pickle_roundtrip(log):
+    restored = pickle.loads(pickle.dumps(log))
+    assert list(restored) == list(log)
@@ -0,0 +1,54 @@
+import asyncio
+import contextlib
+import threading
+import time
+
+import pytest
+
+from tindermate.offload import ExecutorKind, Offloader
+from tindermate.tinder.client import parse_matches
+from tindermate.tracing import monitor_loop_lag, tracer
+
+from .conftest import match_payload
+
+
+def thread_name(_: object) -> str:
+    return threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_small_payloads_run_inline():
+    offloader = Offloader(ExecutorKind.THREAD, threshold=10)
+    assert await offloader.run(9, thread_name, None) == threading.current_thread().name
+    assert (await offloader.run(10, thread_name, None)).startswith("offload")
+    offloader.shutdown()
+
+    inline = Offloader(ExecutorKind.INLINE, threshold=0)
+    assert await inline.run(100, thread_name, None) == threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_parse_matches_in_process_pool():
+    payloads = [match_payload(f"m{i}", f"u{i}") for i in range(3)]
+    offloader = Offloader(ExecutorKind.PROCESS, workers=1, threshold=1)
+    try:
+        matches = await offloader.run(len(payloads), parse_matches, payloads)
+    finally:
+        offloader.shutdown()
+
+    assert matches == parse_matches(payloads)
+    assert matches[0].message_log.last_entry is None
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_of_blocking_call():
+    tracer.reset()
+    monitor = asyncio.create_task(monitor_loop_lag(0.001))
+    await asyncio.sleep(0.01)
+    time.sleep(0.05)
+    await asyncio.sleep(0.01)
+    monitor.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await monitor
+
+    assert tracer.histograms["loop.lag"].max >= 40
@@ -0,0 +1,96 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from tindermate.batch import BatchRunner, MatchKind
+from tindermate.conversation.pipeline import PromptJob, PromptPipeline, render_shard
+from tindermate.conversation.prompts import FirstMessagePrompt, MessageReplyPrompt
+from tindermate.tinder.message_log import MessageLog
+from tindermate.tracing import tracer
+
+from .conftest import FakeAgent, FakeTinder, message_payload
+
+
+def conversation(length: int) -> MessageLog:
+    log = MessageLog()
+    for i in range(length):
+        sender = "me" if i % 2 else "user"
+        log.append(sender, f"message {i}", 1000 + i)
+    return log
+
+
+def test_render_shard_matches_prompts(current_user, make_user_detail):
+    matched = make_user_detail("user")
+    log = conversation(15)
+    jobs = [
+        PromptJob.first_message("m0", current_user, matched),
+        PromptJob.reply("m1", current_user, matched, log, history_limit=10),
+    ]
+    first = FirstMessagePrompt(current_user=current_user, matched_user=matched)
+    reply = MessageReplyPrompt(current_user=current_user, matched_user=matched, message_history=log)
+
+    rendered = render_shard(jobs)
+
+    assert [r.text for r in rendered] == [first.render(), reply.render()]
+    assert [r.stop_words for r in rendered] == [first.stop_words(), reply.stop_words()]
+    assert "(5 hidden)" in rendered[1].text
+
+
+async def slow_jobs(jobs: list[PromptJob], delay: float):
+    for job in jobs:
+        await asyncio.sleep(delay)
+        yield job
+
+
+@pytest.mark.asyncio
+async def test_pipeline_flushes_partial_shards(current_user, make_user_detail):
+    matched = make_user_detail("user")
+    jobs = [PromptJob.first_message(f"m{i}", current_user, matched) for i in range(5)]
+    pipeline = PromptPipeline(workers=0, shard_size=100, flush_after=0.01)
+    tracer.reset()
+
+    received = [rendered.match_id async for rendered in pipeline.render(slow_jobs(jobs, 0.05))]
+
+    assert received == [job.match_id for job in jobs]
+    # the jobs arrive slower than the flush timeout, so every job is rendered on its own
+    assert tracer.histograms["pipeline.shard"].count == len(jobs)
+
+
+@pytest.mark.asyncio
+async def test_pipeline_in_process_pool(current_user, make_user_detail):
+    matched = make_user_detail("user")
+    jobs = [PromptJob.reply(f"m{i}", current_user, matched, conversation(i + 1)) for i in range(6)]
+    pipeline = PromptPipeline(workers=1, shard_size=4)
+    try:
+        received = [rendered async for rendered in pipeline.render(slow_jobs(jobs, 0))]
+    finally:
+        pipeline.close()
+
+    assert sorted(received) == sorted(render_shard(jobs))
+    assert all(rendered.error is None for rendered in received)
+
+
+@pytest.mark.asyncio
+async def test_batch_runner_renders_through_pipeline(tmp_path, current_user, make_match, make_user_detail):
+    messages = [message_payload("m1", "user-m1", "me", "hello", 1000)]
+    matches = [make_match("m0"), make_match("m1", messages=messages), make_match("m2")]
+    details = {"m0": make_user_detail("user-m0"), "m1": make_user_detail("user-m1")}
+    output = tmp_path / "results.jsonl"
+    runner = BatchRunner(
+        FakeTinder(current_user, matches, details),
+        FakeAgent(),
+        output,
+        kinds=list(MatchKind),
+        concurrency=2,
+        progress_stream=io.StringIO(),
+    )
+
+    stats = await runner.run()
+
+    results = {record["match_id"]: record for record in map(json.loads, output.read_text().splitlines())}
+    assert (stats.succeeded, stats.failed) == (2, 1)
+    assert results["m0"]["suggestions"] == ["suggestion for m0"]
+    assert results["m1"]["kind"] == "messaged" and "hello" in results["m1"]["prompt"]
+    assert results["m2"]["error"] == "KeyError: 'm2'"
@@ -0,0 +1,62 @@
+from tindermate.tinder.ranking import MatchRanker, message_velocity
+from tindermate.tinder.schemas import MatchDetail
+from tindermate.tinder.sync import MatchDiff
+
+from .conftest import match_payload, message_payload
+
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
+NOW_MS = 1_700_000_000_000
+
+
+def conversation(match_id: str, *senders: str, start: int = NOW_MS, step: int = HOUR_MS):
+    return [
+        message_payload(match_id, sender, "other", f"message {idx}", start + idx * step)
+        for idx, sender in enumerate(senders)
+    ]
+
+
+def test_message_velocity(make_match):
+    assert message_velocity(make_match("a"), window=10) == 0.0
+    # 4 messages one hour apart -> 3 messages in 3 hours
+    match = make_match("b", messages=conversation("b", "me", "user-b", "me", "user-b"))
+    assert message_velocity(match, window=10) == 24.0
+    assert message_velocity(match, window=2) == 24.0
+
+
+def test_ranking_prefers_pending_replies_and_recent_activity(make_match):
+    ranker = MatchRanker()
+    pending = make_match("pending", messages=conversation("pending", "me", "user-pending", start=NOW_MS - DAY_MS))
+    answered = make_match("answered", messages=conversation("answered", "user-answered", "me"))
+    stale = make_match("stale", messages=conversation("stale", "me", start=NOW_MS - 30 * DAY_MS))
+    ranker.update([stale, answered, pending])
+
+    assert [match.id for match in ranker.top(2)] == ["pending", "answered"]
+    assert [match.id for match in ranker.top(10)] == ["pending", "answered", "stale"]
+    assert len(ranker) == 3
+
+
+def test_ranking_is_updated_incrementally(make_match):
+    ranker = MatchRanker()
+    first = make_match("a", messages=conversation("a", "me", start=NOW_MS))
+    second = make_match("b", messages=conversation("b", "me", start=NOW_MS - HOUR_MS))
+    ranker.update([first, second])
+    assert ranker.top(1)[0].id == "a"
+
+    replied = make_match("b", messages=conversation("b", "me", "user-b", start=NOW_MS - HOUR_MS))
+    ranker.apply_diff(MatchDiff(added=[make_match("c")], updated=[replied], removed=["a"]))
+
+    assert [match.id for match in ranker.top(10)] == ["b", "c"]
+    assert "a" not in ranker.scores
+
+
+def test_common_interests_raise_the_score(make_match):
+    ranker = MatchRanker()
+    ranker.update([make_match("a"), make_match("b")])
+    before = ranker.scores["b"]
+
+    detail = MatchDetail.parse_obj(match_payload("b", "user-b"))
+    ranker.update_detail(detail)
+
+    assert ranker.scores["b"] == before + ranker.weights.common_interest
+    assert ranker.top(1)[0].id == "b"
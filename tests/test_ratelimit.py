@@ -0,0 +1,24 @@
+import asyncio
+import time
+
+import pytest
+
+from tindermate.ratelimit import RateLimiter
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_allows_burst_then_spaces_requests():
+    limiter = RateLimiter(rate=50, burst=2)
+    start = time.monotonic()
+    waits = await asyncio.gather(*(limiter.acquire() for _ in range(4)))
+
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.02, abs=0.005)
+    assert waits[3] == pytest.approx(0.04, abs=0.005)
+    assert time.monotonic() - start >= 0.035
+
+
+@pytest.mark.asyncio
+async def test_disabled_rate_limiter_never_waits():
+    limiter = RateLimiter(rate=0)
+    assert await asyncio.gather(*(limiter.acquire() for _ in range(10))) == [0.0] * 10
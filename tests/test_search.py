@@ -0,0 +1,43 @@
+from tindermate.tinder.schemas import MatchDetail
+from tindermate.tinder.search import HIGHLIGHT_END, HIGHLIGHT_START, SearchIndex, fts_query
+
+from .conftest import match_payload, message_payload
+
+
+def test_fts_query_escapes_user_input():
+    assert fts_query("  ") is None
+    assert fts_query('hik "OR" café-') == '"hik"* "OR"* "café"*'
+
+
+def test_search_profiles_and_messages(make_match):
+    index = SearchIndex()
+    hiker = make_match("a", messages=[message_payload("a", "user-a", "me", "Shall we go climbing?", 1000)])
+    painter = make_match("b", person={"_id": "user-b", "name": "Eva", "gender": 1, "photos": [], "bio": "I paint"})
+    assert index.index_matches([hiker, painter]) == 1
+
+    [hit] = index.search("climb")
+    assert (hit.match_id, hit.source, hit.timestamp) == ("a", "message", 1000)
+    assert f"{HIGHLIGHT_START}climbing{HIGHLIGHT_END}" in hit.snippet
+    assert hit.open_messages_link.endswith("/a")
+
+    [hit] = index.search("paint")
+    assert (hit.match_id, hit.name, hit.source) == ("b", "Eva", "profile")
+    assert index.search("") == []
+
+
+def test_index_is_updated_incrementally(make_match):
+    index = SearchIndex()
+    match = make_match("a", messages=[message_payload("a", "user-a", "me", "hello there", 1000)])
+    index.index_matches([match])
+    assert index.search("Charles") == []
+
+    # the detail adds the interests, jobs and schools to the profile
+    index.index_matches([MatchDetail.parse_obj(match_payload("a", "user-a"))])
+    assert [hit.source for hit in index.search("Charles")] == ["profile"]
+
+    # only the new messages are indexed again
+    match.message_log.append("me", "see you tomorrow", 2000)
+    assert index.index_matches([match]) == 1
+    assert index.index_matches([match]) == 0
+    assert [hit.timestamp for hit in index.search("tomorrow")] == [2000]
+    assert len(index.search("hello")) == 1
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from tindermate.conversation.speculation import SpeculativeGenerator
+from tindermate.conversation.usage import BudgetExceededError
+from tindermate.tracing import tracer
+
+from .conftest import FakeAgent, FakeTinder, message_payload
+
+
+class BlockingAgent(FakeAgent):
+    """Holds the completions until they are released"""
+
+    def __init__(self):
+        super().__init__()
+        self.released = asyncio.Event()
+
+    async def complete_rendered(self, rendered, stop_words, match_id=None):
+        await self.released.wait()
+        return await super().complete_rendered(rendered, stop_words, match_id)
+
+
+class BudgetExhaustedAgent(FakeAgent):
+    async def complete_rendered(self, rendered, stop_words, match_id=None):
+        self.requests += 1
+        raise BudgetExceededError("budget exceeded", retry_after=60)
+
+
+@pytest.fixture
+def pending_match(make_match):
+    def factory(match_id: str):
+        user_id = f"user-{match_id}"
+        return make_match(match_id, messages=[message_payload(match_id, user_id, "me", "hi", 1000)])
+
+    return factory
+
+
+def make_speculator(current_user, matches, agent, max_requests=10):
+    return SpeculativeGenerator(FakeTinder(current_user, matches, {}), agent, max_requests)
+
+
+@pytest.mark.asyncio
+async def test_suggestion_is_used_once(current_user, make_user_detail, pending_match, make_match):
+    tracer.reset()
+    match, answered = pending_match("a"), make_match("b", messages=[message_payload("b", "me", "user-b", "hi", 1000)])
+    agent = FakeAgent()
+    speculator = make_speculator(current_user, [match, answered], agent)
+
+    await speculator.pregenerate(match, make_user_detail(match.person.id), current_user)
+    await speculator.pregenerate(answered, make_user_detail(answered.person.id), current_user)
+
+    assert speculator.pop(match) == ["suggestion for a"]
+    assert speculator.pop(match) is None
+    assert speculator.pop(answered) is None
+    assert agent.requests == 1
+    assert tracer.counters["speculation.hit"] == 1
+
+
+@pytest.mark.asyncio
+async def test_new_message_makes_suggestion_stale(current_user, make_user_detail, pending_match):
+    tracer.reset()
+    match = pending_match("a")
+    speculator = make_speculator(current_user, [match], FakeAgent())
+    await speculator.pregenerate(match, make_user_detail(match.person.id), current_user)
+
+    match.message_log.append(match.person.id, "are you there?", 2000)
+    assert speculator.pop(match) is None
+    assert tracer.counters["speculation.stale"] == 1
+    assert tracer.counters["speculation.hit"] == 0
+
+
+@pytest.mark.asyncio
+async def test_message_during_generation_discards_result(current_user, make_user_detail, pending_match):
+    match, agent = pending_match("a"), BlockingAgent()
+    speculator = make_speculator(current_user, [match], agent)
+    task = asyncio.create_task(speculator.pregenerate(match, make_user_detail(match.person.id), current_user))
+    await asyncio.sleep(0)
+
+    match.message_log.append(match.person.id, "are you there?", 2000)
+    agent.released.set()
+    await task
+    assert speculator.pop(match) is None
+
+
+@pytest.mark.asyncio
+async def test_requests_are_capped(current_user, make_user_detail, pending_match):
+    matches = [pending_match(match_id) for match_id in ("a", "b", "c")]
+    agent = FakeAgent()
+    speculator = make_speculator(current_user, matches, agent, max_requests=2)
+    for match in matches:
+        await speculator.pregenerate(match, make_user_detail(match.person.id), current_user)
+
+    assert agent.requests == 2
+    assert [speculator.pop(match) is not None for match in matches] == [True, True, False]
+
+
+@pytest.mark.asyncio
+async def test_budget_exceeded_is_ignored(current_user, make_user_detail, pending_match):
+    match, agent = pending_match("a"), BudgetExhaustedAgent()
+    speculator = make_speculator(current_user, [match], agent)
+    await speculator.pregenerate(match, make_user_detail(match.person.id), current_user)
+
+    assert agent.requests == 1
+    assert speculator.pop(match) is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_pregeneration_is_deduplicated(current_user, make_user_detail, pending_match):
+    match, agent = pending_match("a"), BlockingAgent()
+    speculator = make_speculator(current_user, [match], agent)
+    detail = make_user_detail(match.person.id)
+    tasks = [asyncio.create_task(speculator.pregenerate(match, detail, current_user)) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    agent.released.set()
+    await asyncio.gather(*tasks)
+    assert agent.requests == 1
+    assert speculator.pop(match) == ["suggestion for a"]
@@ -0,0 +1,24 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks.startup import LAZY_MODULES
+
+BASE_DIR = Path(__file__).parent.parent
+
+
+@pytest.mark.parametrize("module", ["tindermate.ui.app", "tindermate.cli"])
+def test_heavy_modules_are_loaded_lazily(module):
+    script = f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))"
+    proc = subprocess.run([sys.executable, "-c", script], cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    loaded = set(json.loads(proc.stdout.splitlines()[-1]))
+    assert loaded.isdisjoint(LAZY_MODULES)
+
+
+def test_cli_does_not_import_textual():
+    script = "import sys, tindermate.cli, tindermate.batch; print('textual' in sys.modules)"
+    proc = subprocess.run([sys.executable, "-c", script], cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    assert proc.stdout.strip() == "False"
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from tindermate.tinder.exception import TinderAuthError
+from tindermate.tinder.sync import MatchRefresher, diff_matches
+from tindermate.tracing import tracer
+
+from .conftest import message_payload
+
+
+class FakeTinderClient:
+    def __init__(self, matches, errors=()):
+        self.matches_payload = matches
+        self.errors = list(errors)
+
+    async def matches(self, messaged: bool, conditional: bool = False):
+        if self.errors:
+            raise self.errors.pop(0)
+        return list(self.matches_payload)
+
+
+def test_diff_matches(make_match):
+    previous = {match.id: match for match in [make_match("a"), make_match("b"), make_match("c")]}
+    current = [
+        make_match("a"),
+        make_match("b", last_activity_date="2023-02-01T00:00:00Z"),
+        make_match("d"),
+    ]
+
+    diff = diff_matches(previous, current)
+
+    assert [match.id for match in diff.added] == ["d"]
+    assert [match.id for match in diff.updated] == ["b"]
+    assert diff.removed == ["c"]
+    assert not diff_matches({match.id: match for match in current}, current)
+
+
+@pytest.mark.asyncio
+async def test_refresher_keeps_message_history_and_adapts_interval(make_match):
+    old = make_match("a", messages=[message_payload("a", "user-a", "me", "hi", 1000)])
+    old.message_log.append("me", "hello", 2000)
+    new = make_match(
+        "a",
+        last_activity_date="2023-02-01T00:00:00Z",
+        messages=[message_payload("a", "user-a", "me", "how are you", 3000)],
+    )
+    tinder = FakeTinderClient([old])
+    refresher = MatchRefresher(tinder, messaged=True, min_interval=1, max_interval=4)
+    refresher.seed([old])
+
+    assert not await refresher.poll()
+    assert refresher.interval == 2
+    assert not await refresher.poll()
+    assert not await refresher.poll()
+    assert refresher.interval == 4
+
+    tinder.matches_payload = [new]
+    diff = await refresher.poll()
+
+    assert diff.updated == [new]
+    assert refresher.interval == 1
+    assert [entry.text for entry in refresher.matches["a"].message_log] == ["hi", "hello", "how are you"]
+
+
+@pytest.mark.asyncio
+async def test_refresher_survives_errors_until_auth_error(make_match):
+    tracer.reset()
+    tinder = FakeTinderClient([make_match("a")], errors=[asyncio.TimeoutError(), RuntimeError("boom")])
+    refresher = MatchRefresher(tinder, messaged=False, min_interval=0.001, max_interval=0.004)
+    diffs = []
+
+    async def on_change(diff):
+        diffs.append(diff)
+        tinder.errors.append(TinderAuthError())
+
+    with pytest.raises(TinderAuthError):
+        await refresher.run(on_change)
+    assert [match.id for diff in diffs for match in diff.added] == ["a"]
+    assert tracer.counters["sync.error"] == 2
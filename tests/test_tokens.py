@@ -0,0 +1,101 @@
+import json
+import time
+
+import pytest
+
+from tindermate.configuration import Configuration
+from tindermate.conversation.gpt import OpenAITimeoutError
+from tindermate.ui import tokens as tokens_module
+from tindermate.ui.tokens import Tokens, ValidationRecord, validate_tokens, validation_file
+
+
+class FakeTinderClient:
+    def __init__(self, current_user):
+        self._current_user = current_user
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def current_user_info(self):
+        return self._current_user
+
+
+class FakeAgent:
+    def __init__(self, api_key: str, timeout: bool = False):
+        self._timeout = timeout
+
+    async def test_connection(self) -> None:
+        if self._timeout:
+            raise OpenAITimeoutError("Open AI did not answer in time")
+
+
+@pytest.fixture
+def token_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Configuration, "TOKEN_FILE", tmp_path / ".tokens")
+    monkeypatch.setattr(Configuration, "TOKEN_VALIDATION_FILE", tmp_path / ".tokens.validation")
+    monkeypatch.setattr(Configuration, "TOKEN_VALIDATION_TTL", 60)
+    return tmp_path
+
+
+@pytest.fixture
+def tokens() -> Tokens:
+    return Tokens(openai_token="sk-test", tinder_token="tinder-test")
+
+
+def validate(tokens: Tokens, seconds_ago: float) -> None:
+    ValidationRecord(
+        fingerprint=tokens.fingerprint, validated_at=time.time() - seconds_ago, account=tokens.account
+    ).save()
+
+
+def test_fresh_validation_is_trusted(token_dir, tokens):
+    validate(tokens, seconds_ago=30)
+
+    record = ValidationRecord.load_for(tokens)
+
+    assert record is not None and record.fingerprint == tokens.fingerprint
+
+
+def test_stale_validation_is_not_trusted(token_dir, tokens):
+    validate(tokens, seconds_ago=90)
+
+    assert ValidationRecord.load_for(tokens) is None
+
+
+def test_validation_of_other_tokens_is_not_trusted(token_dir, tokens):
+    validate(tokens, seconds_ago=0)
+
+    assert ValidationRecord.load_for(Tokens(openai_token="sk-test", tinder_token="tinder-renewed")) is None
+
+
+def test_cleared_or_malformed_validation_is_not_trusted(token_dir, tokens):
+    validate(tokens, seconds_ago=0)
+    ValidationRecord.clear()
+    assert ValidationRecord.load_for(tokens) is None
+
+    validation_file(tokens.account).write_text(json.dumps({"fingerprint": tokens.fingerprint, "validated_at": None}))
+    assert ValidationRecord.load_for(tokens) is None
+
+
+@pytest.mark.asyncio
+async def test_validation_stores_no_user_data(token_dir, tokens, current_user, monkeypatch):
+    monkeypatch.setattr(tokens_module, "create_tinder_client", lambda **_: FakeTinderClient(current_user))
+    monkeypatch.setattr(tokens_module, "ConversationAgent", FakeAgent)
+
+    assert await validate_tokens(tokens) == current_user
+
+    assert json.loads(validation_file(tokens.account).read_text()).keys() == {"fingerprint", "validated_at"}
+    assert ValidationRecord.load_for(tokens) is not None
+
+
+@pytest.mark.asyncio
+async def test_unverified_validation_is_not_remembered(token_dir, tokens, current_user, monkeypatch):
+    monkeypatch.setattr(tokens_module, "create_tinder_client", lambda **_: FakeTinderClient(current_user))
+    monkeypatch.setattr(tokens_module, "ConversationAgent", lambda api_key: FakeAgent(api_key, timeout=True))
+
+    assert await validate_tokens(tokens) == current_user
+
+    assert ValidationRecord.load_for(tokens) is None
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from tindermate.tracing import Histogram, Tracer
+
+
+def test_histogram_percentiles():
+    hist = Histogram()
+    for value in range(1, 101):
+        hist.observe(value)
+    assert hist.count == 100
+    assert hist.percentile(50) == 50
+    assert hist.percentile(95) == 95
+    assert hist.max == 100
+    assert sum(hist.buckets) == 100
+
+
+def test_span_records_latency_and_exports(tmp_path):
+    export_file = tmp_path / "traces.jsonl"
+    tracer = Tracer(export_file)
+
+    with tracer.span("tinder.get", path="/profile") as span:
+        span["bytes"] = 42
+    tracer.count("cache.hit")
+
+    snapshot = tracer.snapshot()
+    assert snapshot["histograms"]["tinder.get"]["count"] == 1
+    assert snapshot["counters"] == {"cache.hit": 1}
+    record = json.loads(export_file.read_text().splitlines()[0])
+    assert record["span"] == "tinder.get"
+    assert record["path"] == "/profile"
+    assert record["bytes"] == 42
+    assert record["error"] is None
+
+
+def test_span_counts_errors():
+    tracer = Tracer()
+    with pytest.raises(ValueError), tracer.span("openai.complete"):
+        raise ValueError()
+    assert tracer.counters["openai.complete.errors"] == 1
+    assert tracer.histograms["openai.complete"].count == 1
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from benchmarks.transport import Http1Stub, Http2Stub
+from tindermate.conversation.gpt import (
+    Completion,
+    GPTClient,
+    OpenAIAuthError,
+    RecordingGPTClient,
+    ReplayGPTClient,
+    Usage,
+)
+from tindermate.ratelimit import RateLimiter
+from tindermate.tinder.client import TinderClient
+from tindermate.tinder.exception import TinderAuthError
+from tindermate.tracing import tracer
+from tindermate.transport import (
+    AiohttpTransport,
+    CachingTransport,
+    Cassette,
+    CassetteMissError,
+    CassettePlayer,
+    HttpResponse,
+    HttpxTransport,
+    RecordingTransport,
+    ReplayLatency,
+    ReplayTransport,
+    Transport,
+    TransportBackend,
+    create_transport,
+    parse_cache_control,
+)
+
+from .conftest import match_payload
+
+
+class FakeTransport(Transport):
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    async def request(self, method, url, params=None, headers=None, timeouts=None):
+        await asyncio.sleep(0.01)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def json_response(content, status=200, headers=None):
+    headers = {"content-type": "application/json"} | (headers or {})
+    return HttpResponse(status=status, headers=headers, body=json.dumps(content).encode())
+
+
+def make_client(transport):
+    return TinderClient("secret-token", transport=transport, rate_limiter=RateLimiter(rate=0))
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay_tinder_traffic(tmp_path):
+    matches = {"data": {"matches": [match_payload("a", "user-a")]}}
+    delegate = FakeTransport([json_response(matches), json_response({}, status=401), asyncio.TimeoutError()])
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    recorder = make_client(RecordingTransport(delegate, cassette, scope="tinder:default"))
+
+    assert [match.id for match in await recorder.matches(messaged=False)] == ["a"]
+    with pytest.raises(TinderAuthError):
+        await recorder.matches(messaged=True)
+    with pytest.raises(asyncio.TimeoutError):
+        await recorder.current_user_info()
+
+    recorded = Cassette.load(tmp_path / "cassette.jsonl")
+    assert [interaction.status for interaction in recorded.interactions] == [200, 401, None]
+    assert recorded.interactions[2].error == "TimeoutError"
+    assert all(interaction.duration_ms >= 10 for interaction in recorded.interactions)
+    assert "secret-token" not in (tmp_path / "cassette.jsonl").read_text()
+
+    player = CassettePlayer(recorded, latency=ReplayLatency.NONE)
+    replay = make_client(ReplayTransport(player, scope="tinder:default"))
+    start = time.perf_counter()
+    # the last recorded response is repeated once the recorded ones run out
+    for _ in range(3):
+        assert [match.id for match in await replay.matches(messaged=False)] == ["a"]
+    with pytest.raises(TinderAuthError):
+        await replay.matches(messaged=True)
+    with pytest.raises(asyncio.TimeoutError):
+        await replay.current_user_info()
+    assert time.perf_counter() - start < 0.01
+
+    with pytest.raises(CassetteMissError):
+        await make_client(ReplayTransport(player, scope="tinder:other")).matches(messaged=False)
+
+
+@pytest.mark.asyncio
+async def test_replay_recorded_latency(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    recorder = RecordingTransport(FakeTransport([json_response({})]), cassette, scope="test")
+    await recorder.request("GET", "https://example.com")
+
+    replay = ReplayTransport(CassettePlayer(Cassette.load(cassette.path)), scope="test")
+    start = time.perf_counter()
+    assert (await replay.request("GET", "https://example.com")).status == 200
+    assert time.perf_counter() - start >= 0.01
+
+
+class FakeGPT(GPTClient):
+    def __init__(self, error=None):
+        super().__init__("fake-model")
+        self.error = error
+
+    async def complete_text(self, prompt, num_choices, max_tokens, temperature, stop_words=None):
+        if self.error is not None:
+            raise self.error
+        return Completion([f"{prompt} {idx}" for idx in range(num_choices)], self.model, Usage(10, 20))
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay_completions(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    completion = await RecordingGPTClient(FakeGPT(), cassette).complete_text("hi", 2, 50, 0.8)
+    with pytest.raises(OpenAIAuthError):
+        await RecordingGPTClient(FakeGPT(OpenAIAuthError()), cassette).complete_text("bye", 2, 50, 0.8)
+
+    replay = ReplayGPTClient(CassettePlayer(Cassette.load(cassette.path), ReplayLatency.NONE), "fake-model")
+    assert await replay.complete_text("hi", 2, 50, 0.8) == completion
+    with pytest.raises(OpenAIAuthError):
+        await replay.complete_text("bye", 2, 50, 0.8)
+    with pytest.raises(CassetteMissError):
+        await replay.complete_text("hi", 3, 50, 0.8)
+    await replay.check_credentials(timeout=1)
+
+
+def test_create_transport_selects_backend():
+    assert isinstance(create_transport("tinder:default"), AiohttpTransport)
+    assert isinstance(create_transport("tinder:default", backend=TransportBackend.HTTPX), HttpxTransport)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("stub_cls", "http2", "connections"),
+    [(Http1Stub, False, 2), (Http2Stub, True, 1)],
+)
+async def test_httpx_transport_multiplexes_over_http2(stub_cls, http2, connections):
+    if http2:
+        pytest.importorskip("h2")
+    async with stub_cls(latency=0.05) as stub:
+        transport = HttpxTransport(connection_limit=2, http2=http2, prior_knowledge=True)
+        client = TinderClient("token", rate_limiter=RateLimiter(0), transport=transport)
+        client._BASE_URL = f"http://127.0.0.1:{stub.port}"
+        async with client:
+            users = await asyncio.gather(*(client._user_detail(f"user{i}") for i in range(6)))
+
+    assert [user.id for user in users] == [f"user{i}" for i in range(6)]
+    assert stub.connections == connections
+
+
+class ConditionalTransport(Transport):
+    """Serves the responses in order and records the validators of the requests"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.validators = []
+        self.headers = []
+
+    async def request(self, method, url, params=None, headers=None, timeouts=None):
+        self.headers.append(headers or {})
+        self.validators.append({name: value for name, value in (headers or {}).items() if name.startswith("if-")})
+        return self.responses.pop(0)
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('private, max-age="60", no-cache') == {
+        "private": None,
+        "max-age": "60",
+        "no-cache": None,
+    }
+    assert parse_cache_control(None) == {}
+
+
+@pytest.mark.asyncio
+async def test_cache_serves_fresh_and_revalidates_stale_responses():
+    tracer.reset()
+    body = {"profile": "x" * 100}
+    delegate = ConditionalTransport(
+        [
+            json_response(body, headers={"etag": '"v1"', "cache-control": "max-age=0.05", "content-length": "115"}),
+            HttpResponse(304, {"cache-control": "max-age=60", "content-length": "0"}),
+        ]
+    )
+    transport = CachingTransport(delegate)
+    first = await transport.request("GET", "https://example.com/profile", params={"a": 1})
+    assert not first.cached
+    assert transport.is_fresh("GET", "https://example.com/profile", params={"a": 1})
+    assert (await transport.request("GET", "https://example.com/profile", params={"a": 1})).cached
+    assert len(delegate.validators) == 1
+
+    await asyncio.sleep(0.06)
+    revalidated = await transport.request("GET", "https://example.com/profile", params={"a": 1})
+    assert revalidated.cached and revalidated.status == 200 and json.loads(revalidated.body) == body
+    assert revalidated.headers["content-length"] == "115"
+    assert delegate.validators[1] == {"if-none-match": '"v1"'}
+    # the 304 response extended the freshness
+    assert transport.is_fresh("GET", "https://example.com/profile", params={"a": 1})
+    assert not transport.is_fresh("GET", "https://example.com/profile", params={"a": 2})
+
+    assert tracer.counters["http_cache.hits"] == 1
+    assert tracer.counters["http_cache.revalidated"] == 1
+    assert tracer.counters["http_cache.misses"] == 1
+    assert tracer.counters["http_cache.bytes_saved"] == 2 * len(first.body)
+
+
+@pytest.mark.asyncio
+async def test_cache_heuristics_and_directives():
+    responses = [
+        HttpResponse(200, {}, b"{}"),
+        HttpResponse(200, {"cache-control": "no-store"}, b"{}"),
+        HttpResponse(200, {"last-modified": "Wed, 01 Feb 2023 00:00:00 GMT"}, b"{}"),
+        HttpResponse(200, {"expires": "Wed, 01 Feb 2023 00:01:00 GMT", "date": "Wed, 01 Feb 2023 00:00:00 GMT"}, b"{}"),
+    ]
+    transport = CachingTransport(ConditionalTransport(responses), heuristic_freshness={"/user/": 60}, max_entries=2)
+    for url in ["/user/1", "/user/2", "/matches", "/expires"]:
+        await transport.request("GET", f"https://example.com{url}")
+
+    # the heuristic applies only to the responses without explicit freshness
+    assert not transport.is_fresh("GET", "https://example.com/user/2")
+    assert not transport.is_fresh("GET", "https://example.com/matches")
+    assert transport.is_fresh("GET", "https://example.com/expires")
+    assert not transport.is_fresh("GET", "https://example.com/expires", headers={"cache-control": "no-cache"})
+    # evicted above the limit
+    assert not transport.is_fresh("GET", "https://example.com/user/1")
+
+
+@pytest.mark.asyncio
+async def test_cache_skips_malformed_headers_and_keeps_its_directives():
+    responses = [
+        HttpResponse(200, {"cache-control": "max-age=abc", "etag": '"v1"'}, b"{}"),
+        HttpResponse(200, {"cache-control": "max-age=60", "age": "soon", "etag": '"v1"'}, b"{}"),
+        HttpResponse(200, {"cache-control": 'max-age="60"', "etag": '"v1"'}, b"{}"),
+    ]
+    delegate = ConditionalTransport(responses)
+    transport = CachingTransport(delegate)
+    for _ in range(2):
+        await transport.request("GET", "https://example.com/profile", headers={"cache-control": "no-cache"})
+    assert delegate.validators == [{}, {}]
+    await transport.request("GET", "https://example.com/profile")
+
+    assert transport.is_fresh("GET", "https://example.com/profile")
+    assert all("cache-control" not in headers for headers in delegate.headers)
+
+
+@pytest.mark.asyncio
+async def test_tinder_client_reuses_profiles(make_user_detail):
+    user = json.loads(make_user_detail("u1").json(by_alias=True))
+    matches = json_response({"data": {"matches": []}}, headers={"cache-control": "max-age=60"})
+    delegate = FakeTransport([json_response({"results": user}), matches, matches])
+    client = make_client(delegate)
+    for _ in range(2):
+        assert (await client._user_detail("u1")).id == "u1"
+    assert len(delegate.responses) == 2
+
+    # the polled matches are revalidated even when the response is fresh
+    await client.matches(messaged=False, conditional=True)
+    await client.matches(messaged=False, conditional=True)
+    assert delegate.responses == []
+
+
+@pytest.mark.asyncio
+async def test_tinder_client_polls_conditionally_without_cache(make_user_detail):
+    user = json.loads(make_user_detail("u1").json(by_alias=True))
+    matches = {"data": {"matches": [match_payload("m1", "u1")]}}
+    delegate = ConditionalTransport(
+        [
+            json_response({"results": user}, headers={"etag": '"u1"'}),
+            json_response({"results": user}, headers={"etag": '"u1"'}),
+            json_response(matches, headers={"etag": '"v1"'}),
+            HttpResponse(304, {}, b""),
+        ]
+    )
+    client = TinderClient("secret-token", transport=delegate, rate_limiter=RateLimiter(rate=0), http_cache=False)
+    for _ in range(2):
+        await client._user_detail("u1")
+    first = await client.matches(messaged=False, conditional=True)
+    assert [match.id for match in await client.matches(messaged=False, conditional=True)] == [first[0].id]
+    assert delegate.validators == [{}, {}, {}, {"if-none-match": '"v1"'}]
@@ -0,0 +1,104 @@
+import math
+
+import pytest
+
+from tindermate.conversation import usage
+from tindermate.conversation.gpt import Completion, Usage
+from tindermate.conversation.usage import BudgetExceededError, UsageLedger, estimate_cost, session_report
+
+
+def make_completion(prompt_tokens: int, completion_tokens: int) -> Completion:
+    return Completion(choices=["hi"], model="text-davinci-003", usage=Usage(prompt_tokens, completion_tokens))
+
+
+def test_record_accounts_per_match_and_session():
+    ledger = UsageLedger()
+    ledger.record(make_completion(100, 50), match_id="a")
+    ledger.record(make_completion(200, 100), match_id="a")
+    ledger.record(make_completion(10, 10), match_id="b")
+
+    assert ledger.session_totals.requests == 3
+    assert ledger.session_totals.total_tokens == 470
+    assert ledger.match_totals["a"].completion_tokens == 150
+    assert ledger.session_totals.cost == pytest.approx(estimate_cost("text-davinci-003", 470))
+
+
+def test_budget_is_enforced_before_request():
+    # 1000 tokens of davinci cost $0.02
+    ledger = UsageLedger(budget_per_minute=0.03)
+    ledger.check_budget("text-davinci-003", 1000)
+    ledger.record(make_completion(500, 500))
+
+    with pytest.raises(BudgetExceededError) as exc_info:
+        ledger.check_budget("text-davinci-003", 1000)
+    assert 0 < exc_info.value.retry_after <= 60
+    ledger.check_budget("text-davinci-003", 400)
+
+
+def test_request_larger_than_budget_never_fits():
+    ledger = UsageLedger(budget_per_minute=0.01)
+    with pytest.raises(BudgetExceededError) as exc_info:
+        ledger.check_budget("text-davinci-003", 1000)
+    assert exc_info.value.retry_after == math.inf
+
+
+def test_reservations_count_until_settled():
+    ledger = UsageLedger(budget_per_minute=0.03)
+    first = ledger.reserve("text-davinci-003", 1000)
+    # a concurrent request does not fit while the first one is outstanding
+    with pytest.raises(BudgetExceededError):
+        ledger.reserve("text-davinci-003", 1000)
+
+    ledger.settle(first, make_completion(100, 100))
+    second = ledger.reserve("text-davinci-003", 1000)
+    ledger.release(second)
+    ledger.reserve("text-davinci-003", 1000)
+    assert ledger.session_totals.requests == 1
+    assert ledger.session_totals.total_tokens == 200
+
+
+def test_spend_leaves_the_windows_separately(monkeypatch):
+    now = 1_700_000_000.0
+    monkeypatch.setattr(usage.time, "time", lambda: now)
+    ledger = UsageLedger(budget_per_minute=0.03, budget_per_day=0.05)
+    ledger.record(make_completion(500, 500))
+    ledger.release(ledger.reserve("text-davinci-003", 400))
+    with pytest.raises(BudgetExceededError) as exc_info:
+        ledger.check_budget("text-davinci-003", 1000)
+    assert exc_info.value.retry_after == 60
+
+    now += 61
+    ledger.check_budget("text-davinci-003", 1000)
+    ledger.record(make_completion(500, 500))
+    now += 61
+    with pytest.raises(BudgetExceededError) as exc_info:
+        ledger.check_budget("text-davinci-003", 1000)
+    # the day budget frees up once the first record is a day old
+    assert exc_info.value.retry_after == 24 * 60 * 60 - 122
+    ledger.check_budget("text-davinci-003", 400)
+
+
+def test_ledger_persists_across_runs(tmp_path):
+    ledger_file = tmp_path / "usage.jsonl"
+    first_run = UsageLedger(ledger_file)
+    first_run.record(make_completion(500, 500))
+
+    second_run = UsageLedger(ledger_file, budget_per_day=0.03)
+    with pytest.raises(BudgetExceededError):
+        second_run.check_budget("text-davinci-003", 1000)
+    second_run.record(make_completion(10, 10))
+
+    sessions = session_report(ledger_file)
+    assert [totals.total_tokens for *_, totals in sessions] == [1000, 20]
+
+
+def test_processes_spend_their_share_of_budgets(tmp_path):
+    ledger_file = tmp_path / "usage.jsonl"
+    UsageLedger(ledger_file).record(make_completion(500, 500))
+
+    # the previous spend of $0.02 counts towards both halves of the $0.08 budget
+    workers = [UsageLedger(ledger_file, budget_per_day=0.08, share=0.5) for _ in range(2)]
+    for worker in workers:
+        worker.reserve("text-davinci-003", 1500)
+        with pytest.raises(BudgetExceededError):
+            worker.reserve("text-davinci-003", 100)
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import sys
+import time
+from collections.abc import AsyncIterator
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from enum import Enum
+from pathlib import Path
+from typing import TextIO
+
+from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.gpt import OpenAIAuthError
+from tindermate.conversation.pipeline import PromptJob, PromptPipeline, RenderedPrompt
+from tindermate.conversation.usage import BudgetExceededError
+from tindermate.tinder.client import TinderClient
+from tindermate.tinder.exception import TinderAuthError
+from tindermate.tinder.schemas import CurrentUser, Match, is_reply_pending
+
+
+class MatchKind(str, Enum):
+    NEW = "new"
+    MESSAGED = "messaged"
+
+
+@dataclass
+class BatchResult:
+    match_id: str
+    kind: MatchKind
+    name: str
+    suggestions: list[str] = field(default_factory=list)
+    prompt: str | None = None
+    error: str | None = None
+    generated_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self) | {"kind": self.kind.value}, ensure_ascii=False)
+
+
+@dataclass
+class BatchStats:
+    started_at: float = field(default_factory=time.monotonic)
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+    @property
+    def processed(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Number of processed matches per second"""
+        return self.processed / elapsed if (elapsed := self.elapsed) > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Processed {self.processed} matches in {self.elapsed:.1f}s ({self.throughput:.2f} matches/s): "
+            f"{self.succeeded} succeeded, {self.failed} failed, {self.skipped} skipped"
+        )
+
+
+def load_completed(output: Path) -> set[tuple[str, str]]:
+    """Return the (match id, kind) pairs that were already successfully generated in a previous run"""
+    if not output.exists():
+        return set()
+    completed = set()
+    with output.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line might be truncated if the previous run was killed mid-write
+                continue
+            if record.get("error") is None:
+                completed.add((record["match_id"], record["kind"]))
+    return completed
+
+
+def should_process(kind: MatchKind, match: Match, pending_only: bool) -> bool:
+    if kind == MatchKind.NEW or not pending_only:
+        return True
+    # only reply to the conversations where the match sent the last message
+    return is_reply_pending(match)
+
+
+async def build_prompt_job(tinder: TinderClient, kind: MatchKind, match: Match, current_user: CurrentUser) -> PromptJob:
+    """Fetch the messages and the detail of the match the prompt is built from"""
+    if kind == MatchKind.MESSAGED:
+        await tinder.fetch_messages_for(match)
+    detail = await tinder.fetch_detail_for(match)
+    if kind == MatchKind.NEW:
+        return PromptJob.first_message(match.id, current_user, detail.person)
+    return PromptJob.reply(match.id, current_user, detail.person, detail.message_log)
+
+
+class BatchRunner:
+    """
+    Generate the message suggestions for all the matches of the current user and write them as JSON lines.
+
+    The matches flow through three stages connected by bounded queues: the workers fetching the detail and the
+    messages of the matches, the prompt pipeline rendering the prompts, possibly on multiple cores, and the workers
+    generating the suggestions.
+    """
+
+    _MAX_BUDGET_WAIT = 60
+    """Maximum number of seconds to wait for the OpenAI budget to free up before giving up on a match"""
+
+    def __init__(
+        self,
+        tinder: TinderClient,
+        agent: ConversationAgent,
+        output: Path,
+        kinds: list[MatchKind],
+        concurrency: int = 4,
+        limit: int | None = None,
+        pending_only: bool = False,
+        progress_every: int = 10,
+        progress_stream: TextIO = sys.stderr,
+        name: str | None = None,
+        pipeline: PromptPipeline | None = None,
+    ):
+        self._tinder = tinder
+        self._agent = agent
+        self._output = output
+        self._kinds = kinds
+        self._concurrency = concurrency
+        self._limit = limit
+        self._pending_only = pending_only
+        self._progress_every = progress_every
+        self._progress_stream = progress_stream
+        self._name = name
+        """Prefix of the progress reports, to tell apart the runners of multiple accounts"""
+        self._pipeline = pipeline or PromptPipeline()
+        self._stats = BatchStats()
+        self._pending: dict[str, tuple[MatchKind, str]] = {}
+        """Kind and name of the matches whose prompts are being rendered"""
+
+    async def run(self) -> BatchStats:
+        completed = load_completed(self._output)
+        current_user = await self._tinder.current_user_info()
+        # bounded queues, so the matches are streamed instead of being loaded all at once
+        queue: asyncio.Queue[tuple[MatchKind, Match] | None] = asyncio.Queue(maxsize=self._concurrency * 2)
+        jobs: asyncio.Queue[PromptJob | None] = asyncio.Queue(maxsize=self._concurrency * 2)
+        prompts: asyncio.Queue[RenderedPrompt | None] = asyncio.Queue(maxsize=self._concurrency * 2)
+
+        self._output.parent.mkdir(parents=True, exist_ok=True)
+        with self._output.open("a", encoding="utf-8") as out:
+            tasks = [
+                asyncio.create_task(self._produce(queue, completed)),
+                asyncio.create_task(self._prepare_all(queue, jobs, current_user, out)),
+                asyncio.create_task(self._render(jobs, prompts)),
+            ]
+            tasks += [asyncio.create_task(self._worker(prompts, out)) for _ in range(self._concurrency)]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        self._report(self._stats.summary())
+        self._report(f"OpenAI usage: {self._agent.ledger.session_summary()}")
+        return self._stats
+
+    async def _produce(self, queue: asyncio.Queue[tuple[MatchKind, Match] | None], completed: set) -> None:
+        await self._enqueue_matches(queue, completed)
+        # signal the workers there is nothing more to process
+        for _ in range(self._concurrency):
+            await queue.put(None)
+
+    async def _enqueue_matches(self, queue: asyncio.Queue[tuple[MatchKind, Match] | None], completed: set) -> None:
+        # a match listed twice, e.g. when it moves between the pages of the list, is processed once
+        enqueued: set[str] = set()
+        for kind in self._kinds:
+            async for match in self._tinder.iter_matches(messaged=kind == MatchKind.MESSAGED):
+                if self._limit is not None and len(enqueued) >= self._limit:
+                    return
+                if (
+                    match.id in enqueued
+                    or (match.id, kind.value) in completed
+                    or not should_process(kind, match, self._pending_only)
+                ):
+                    self._stats.skipped += 1
+                    continue
+                await queue.put((kind, match))
+                enqueued.add(match.id)
+
+    async def _prepare_all(
+        self,
+        queue: asyncio.Queue[tuple[MatchKind, Match] | None],
+        jobs: asyncio.Queue[PromptJob | None],
+        current_user: CurrentUser,
+        out: TextIO,
+    ) -> None:
+        await asyncio.gather(*(self._prepare(queue, jobs, current_user, out) for _ in range(self._concurrency)))
+        await jobs.put(None)
+
+    async def _prepare(
+        self,
+        queue: asyncio.Queue[tuple[MatchKind, Match] | None],
+        jobs: asyncio.Queue[PromptJob | None],
+        current_user: CurrentUser,
+        out: TextIO,
+    ) -> None:
+        while (item := await queue.get()) is not None:
+            kind, match = item
+            try:
+                job = await build_prompt_job(self._tinder, kind, match, current_user)
+            except TinderAuthError:
+                raise
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {exc}"
+                self._write(out, BatchResult(match_id=match.id, kind=kind, name=match.person.name, error=error))
+                continue
+            self._pending[match.id] = (kind, match.person.name)
+            await jobs.put(job)
+
+    async def _render(
+        self, jobs: asyncio.Queue[PromptJob | None], prompts: asyncio.Queue[RenderedPrompt | None]
+    ) -> None:
+        async def iter_jobs() -> AsyncIterator[PromptJob]:
+            while (job := await jobs.get()) is not None:
+                yield job
+
+        async for rendered in self._pipeline.render(iter_jobs()):
+            await prompts.put(rendered)
+        # signal the workers there is nothing more to generate
+        for _ in range(self._concurrency):
+            await prompts.put(None)
+
+    async def _worker(self, prompts: asyncio.Queue[RenderedPrompt | None], out: TextIO) -> None:
+        while (rendered := await prompts.get()) is not None:
+            self._write(out, await self._process(rendered))
+
+    def _write(self, out: TextIO, result: BatchResult) -> None:
+        out.write(result.to_json() + "\n")
+        out.flush()
+
+        if result.error is None:
+            self._stats.succeeded += 1
+        else:
+            self._stats.failed += 1
+        if self._stats.processed % self._progress_every == 0:
+            self._report(
+                f"[{self._stats.processed}] {self._stats.throughput:.2f} matches/s, "
+                f"{self._stats.failed} failed, {self._stats.skipped} skipped"
+            )
+
+    async def _process(self, rendered: RenderedPrompt) -> BatchResult:
+        kind, name = self._pending.pop(rendered.match_id)
+        result = BatchResult(match_id=rendered.match_id, kind=kind, name=name, prompt=rendered.text)
+        if rendered.text is None:
+            result.error = rendered.error
+            return result
+        try:
+            result.suggestions = await self._complete(rendered)
+        except (TinderAuthError, OpenAIAuthError):
+            # there is no point in continuing with invalid credentials
+            raise
+        except Exception as exc:
+            result.error = f"{type(exc).__name__}: {exc}"
+        return result
+
+    async def _complete(self, rendered: RenderedPrompt) -> list[str]:
+        assert rendered.text is not None
+        while True:
+            try:
+                return await self._agent.complete_rendered(
+                    rendered.text, rendered.stop_words, match_id=rendered.match_id
+                )
+            except BudgetExceededError as exc:
+                # wait for the spending window to move on, unless it would take too long
+                if exc.retry_after > self._MAX_BUDGET_WAIT:
+                    raise
+                self._report(f"{exc}, waiting {exc.retry_after:.0f}s")
+                await asyncio.sleep(exc.retry_after)
+
+    def _report(self, message: str) -> None:
+        prefix = f"[{self._name}] " if self._name is not None else ""
+        print(prefix + message, file=self._progress_stream, flush=True)
@@ -0,0 +1,49 @@
+import asyncio
+
+from tindermate.tracing import tracer
+
+
+class CancellationToken:
+    """
+    Cancels the tasks started on behalf of an owner, such as a widget, once their results are no longer wanted.
+
+    The tasks are tracked together with their kind, e.g. "fetch" or "generation", and the cancelled ones are counted
+    by it. A token is cancelled once, the tasks tracked after that are cancelled right away.
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.cancelled = False
+        self._tasks: dict[asyncio.Task, str] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def track(self, task: asyncio.Task, kind: str) -> asyncio.Task:
+        if self.cancelled:
+            self._cancel(task, kind)
+            return task
+        self._tasks[task] = kind
+        task.add_done_callback(self._forget)
+        return task
+
+    def cancel(self) -> int:
+        """Cancel the outstanding tasks, return how many of them were still running"""
+        self.cancelled = True
+        tasks, self._tasks = self._tasks, {}
+        cancelled = sum(self._cancel(task, kind) for task, kind in tasks.items())
+        if cancelled:
+            print(f"Cancelled {cancelled} tasks of {self.name}")
+        return cancelled
+
+    def _forget(self, task: asyncio.Task) -> None:
+        self._tasks.pop(task, None)
+
+    @staticmethod
+    def _cancel(task: asyncio.Task, kind: str) -> bool:
+        if not task.cancel():
+            # already finished, nothing was saved
+            return False
+        tracer.count(f"cancelled.{kind}")
+        return True
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import contextlib
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from tindermate.batch import BatchRunner, MatchKind
+from tindermate.configuration import Configuration
+
+if TYPE_CHECKING:
+    from tindermate.jobqueue import JobQueue
+    from tindermate.ui.tokens import Tokens
+
+
+def run_ui(args: argparse.Namespace) -> None:
+    # imported lazily, so the headless commands do not depend on the TUI framework
+    from tindermate.ui.app import TinderMate
+
+    app = TinderMate(account=args.account)
+    app.run()
+
+
+def run_batch(args: argparse.Namespace) -> None:
+    from tindermate.ui.tokens import list_accounts
+
+    accounts = list_accounts() if args.all_accounts else args.accounts or [Configuration.DEFAULT_ACCOUNT]
+    if not accounts:
+        sys.exit("No account with stored tokens was found")
+    asyncio.run(run_batch_accounts(args, [load_tokens(account) for account in accounts]))
+
+
+async def run_batch_accounts(args: argparse.Namespace, tokens: list["Tokens"]) -> None:
+    """Run the batch generation of all the accounts side by side, each account writes to its own output file"""
+    from tindermate.conversation.agent import ConversationAgent
+    from tindermate.conversation.pipeline import PromptPipeline
+    from tindermate.tinder.client import create_tinder_client
+
+    multiple = len(tokens) > 1
+    async with contextlib.AsyncExitStack() as stack:
+        # the accounts share the rendering processes
+        pipeline = PromptPipeline(workers=args.render_workers)
+        stack.callback(pipeline.close)
+        runners = []
+        for account_tokens in tokens:
+            account = account_tokens.account
+            tinder = create_tinder_client(auth_token=account_tokens.tinder_token, account=account)
+            await stack.enter_async_context(tinder)
+            output = args.output.with_stem(f"{args.output.stem}.{account}") if multiple else args.output
+            runners.append(
+                BatchRunner(
+                    tinder=tinder,
+                    agent=ConversationAgent(api_key=account_tokens.openai_token),
+                    output=output,
+                    kinds=args.kind or list(MatchKind),
+                    concurrency=args.concurrency,
+                    limit=args.limit,
+                    pending_only=args.pending_only,
+                    progress_every=args.progress_every,
+                    name=account if multiple else None,
+                    pipeline=pipeline,
+                )
+            )
+        # an account failing, e.g. on expired credentials, does not stop the other accounts
+        results = await asyncio.gather(*(runner.run() for runner in runners), return_exceptions=True)
+
+    failed = [
+        (runner_tokens.account, result)
+        for runner_tokens, result in zip(tokens, results)
+        if isinstance(result, Exception)
+    ]
+    for account, exc in failed:
+        print(f"[{account}] Batch generation failed: {type(exc).__name__}: {exc}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def load_tokens(account: str) -> "Tokens":
+    from tindermate.ui.tokens import Tokens
+
+    tokens = Tokens.load(account)
+    if tokens.tinder_token is None or tokens.openai_token is None:
+        sys.exit(f"Both the Tinder and the OpenAI tokens of the account {account!r} must be configured")
+    return tokens
+
+
+def enqueue(args: argparse.Namespace) -> None:
+    from tindermate.jobqueue import JobQueue
+
+    queue = JobQueue(args.queue)
+    if args.retry_dead:
+        print(f"Moved {queue.retry_dead(args.account)} dead jobs back to the queue")
+    else:
+        print(f"Queued {asyncio.run(enqueue_account(args, queue))} jobs")
+    counts = queue.counts(args.account)
+    print(", ".join(f"{count} {status.value}" for status, count in counts.items()))
+    for job in queue.dead_letters(args.account)[: args.show_dead]:
+        print(f"dead: {job.match_id} ({job.kind}) after {job.attempts} attempts: {job.last_error}")
+    queue.close()
+
+
+async def enqueue_account(args: argparse.Namespace, queue: "JobQueue") -> int:
+    from tindermate.tinder.client import create_tinder_client
+    from tindermate.worker import enqueue_matches
+
+    tokens = load_tokens(args.account)
+    async with create_tinder_client(auth_token=tokens.tinder_token, account=args.account) as tinder:
+        return await enqueue_matches(
+            tinder,
+            queue,
+            args.account,
+            kinds=args.kind or list(MatchKind),
+            pending_only=args.pending_only,
+            limit=args.limit,
+            again=args.again,
+        )
+
+
+def run_worker(args: argparse.Namespace) -> None:
+    from tindermate.worker import run_workers
+
+    load_tokens(args.account)
+    stats, errors = asyncio.run(
+        run_workers(
+            args.processes,
+            args.account,
+            args.queue,
+            args.output,
+            concurrency=args.concurrency,
+            lease_duration=Configuration.JOB_LEASE_DURATION,
+            progress_interval=args.progress_interval,
+        )
+    )
+    print(f"{stats.summary()} by {args.processes} processes", file=sys.stderr)
+    for exc in errors:
+        print(f"Worker process failed: {type(exc).__name__}: {exc}", file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+def show_usage(_: argparse.Namespace) -> None:
+    from datetime import datetime
+
+    from tindermate.conversation.usage import session_report
+
+    print(f"{'session':<14}{'started':<21}{'duration':>10}{'requests':>10}{'tokens':>10}{'tokens/s':>10}{'cost':>10}")
+    for session_id, start, end, totals in session_report(Configuration.USAGE_LEDGER_FILE):
+        duration = end - start
+        throughput = totals.total_tokens / duration if duration > 0 else 0.0
+        print(
+            f"{session_id:<14}{datetime.fromtimestamp(start):%Y-%m-%d %H:%M:%S}  {duration:>9.0f}s{totals.requests:>10}"
+            f"{totals.total_tokens:>10}{throughput:>10.1f}{'$' + format(totals.cost, '.4f'):>10}"
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="tindermate", description="GPT-powered message generator for Tinder matches")
+    parser.set_defaults(handler=run_ui, account=Configuration.DEFAULT_ACCOUNT)
+    subparsers = parser.add_subparsers(title="commands")
+
+    ui = subparsers.add_parser("ui", help="Launch the interactive terminal application (default)")
+    ui.set_defaults(handler=run_ui)
+    ui.add_argument("--account", default=Configuration.DEFAULT_ACCOUNT, help="Name of the account to use")
+
+    batch = subparsers.add_parser("batch", help="Generate the message suggestions for all matches without the UI")
+    batch.set_defaults(handler=run_batch)
+    batch.add_argument(
+        "--kind",
+        type=MatchKind,
+        action="append",
+        metavar="{new,messaged}",
+        help="Which matches to generate for, can be repeated (default: all)",
+    )
+    batch.add_argument(
+        "-o", "--output", type=Path, default=Path("batch_results.jsonl"), help="JSON lines file to append results to"
+    )
+    batch.add_argument("-c", "--concurrency", type=int, default=4, help="Maximum number of matches processed at once")
+    batch.add_argument(
+        "--render-workers",
+        type=int,
+        default=0,
+        help="Number of the processes rendering the prompts, 0 renders them on the event loop",
+    )
+    batch.add_argument("--limit", type=int, default=None, help="Maximum number of matches to process")
+    batch.add_argument(
+        "--pending-only", action="store_true", help="Only reply to the conversations where the match wrote last"
+    )
+    batch.add_argument("--progress-every", type=int, default=10, help="Report progress after every N matches")
+    accounts = batch.add_mutually_exclusive_group()
+    accounts.add_argument(
+        "--account",
+        dest="accounts",
+        metavar="ACCOUNT",
+        action="append",
+        help="Name of the account to generate for, can be repeated to run the accounts side by side (default: default)",
+    )
+    accounts.add_argument(
+        "--all-accounts", action="store_true", help="Generate for all the accounts with stored tokens"
+    )
+
+    queue_args = argparse.ArgumentParser(add_help=False)
+    queue_args.add_argument("--account", default=Configuration.DEFAULT_ACCOUNT, help="Name of the account to use")
+    queue_args.add_argument(
+        "--queue", type=Path, default=Configuration.JOB_QUEUE_FILE, help="SQLite file of the durable job queue"
+    )
+
+    enqueue_parser = subparsers.add_parser(
+        "enqueue", parents=[queue_args], help="Add the matches to the durable queue processed by the workers"
+    )
+    enqueue_parser.set_defaults(handler=enqueue)
+    enqueue_parser.add_argument(
+        "--kind",
+        type=MatchKind,
+        action="append",
+        metavar="{new,messaged}",
+        help="Which matches to enqueue, can be repeated (default: all)",
+    )
+    enqueue_parser.add_argument("--limit", type=int, default=None, help="Maximum number of matches to enqueue")
+    enqueue_parser.add_argument(
+        "--pending-only", action="store_true", help="Only reply to the conversations where the match wrote last"
+    )
+    enqueue_parser.add_argument(
+        "--again", action="store_true", help="Enqueue also the matches which were already processed or gave up on"
+    )
+    enqueue_parser.add_argument(
+        "--retry-dead", action="store_true", help="Move the dead jobs back to the queue, without listing the matches"
+    )
+    enqueue_parser.add_argument("--show-dead", type=int, default=10, help="Number of the dead jobs to list")
+
+    worker = subparsers.add_parser(
+        "worker", parents=[queue_args], help="Process the queued matches by multiple worker processes"
+    )
+    worker.set_defaults(handler=run_worker)
+    worker.add_argument("-p", "--processes", type=int, default=2, help="Number of the worker processes")
+    worker.add_argument(
+        "-c", "--concurrency", type=int, default=4, help="Maximum number of matches processed at once by a process"
+    )
+    worker.add_argument(
+        "-o", "--output", type=Path, default=Path("batch_results.jsonl"), help="JSON lines file to append results to"
+    )
+    worker.add_argument("--progress-interval", type=float, default=10, help="Report progress every N seconds")
+
+    usage = subparsers.add_parser("usage", help="Show the OpenAI token usage and cost of the recorded sessions")
+    usage.set_defaults(handler=show_usage)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.handler(args)
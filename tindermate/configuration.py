@@ -9,11 +9,19 @@ load_dotenv(BASE_DIR / ".env")
 
 
 def path_to(*parts: str) -> Path:
-    path = Path(BASE_DIR).joinpath(*parts)
+    """Resolve a path relative to the project root, the directories are created by their users when needed"""
+    return Path(BASE_DIR).joinpath(*parts)
+
+
+def ensure_dir(path: Path) -> Path:
     path.mkdir(parents=True, exist_ok=True)
     return path
 
 
+def env2float(value: str | None) -> float | None:
+    return float(value) if value else None
+
+
 def env2bool(value: str | None, default: bool | None = None) -> bool:
     if not value and default is not None:
         return default
@@ -26,11 +34,37 @@ def env2bool(value: str | None, default: bool | None = None) -> bool:
 
 class OpenAIConfiguration:
     MODEL = os.getenv("OPENAI_MODEL", "text-davinci-003")
+    # URL of the API, e.g. of the local fake server (python -m benchmarks.fake_openai), the default endpoint if not set
+    API_BASE = os.getenv("OPENAI_API_BASE")
     MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", 100))
     TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", 0.8))
     NUM_CHOICES = int(os.getenv("OPENAI_NUM_CHOICES", 3))
     PRESENCE_PENALTY = float(os.getenv("OPENAI_PRESENCE_PENALTY", 0.6))
     FREQUENCY_PENALTY = float(os.getenv("OPENAI_FREQUENCY_PENALTY", 0.1))
+    # spending limits in USD enforced before a request is sent, unlimited if not set
+    BUDGET_PER_MINUTE = env2float(os.getenv("OPENAI_BUDGET_PER_MINUTE"))
+    BUDGET_PER_DAY = env2float(os.getenv("OPENAI_BUDGET_PER_DAY"))
+    CREDENTIALS_CHECK_TIMEOUT = float(os.getenv("OPENAI_CREDENTIALS_CHECK_TIMEOUT", 5))
+    # for how long a verified api key is not checked again within the same process
+    CREDENTIALS_CHECK_TTL = int(os.getenv("OPENAI_CREDENTIALS_CHECK_TTL", 60 * 60))
+    # a completion running longer than DEADLINE seconds fails, with HEDGE a second request is sent to HEDGE_MODEL
+    # (the same model if not set) when the first one takes longer than HEDGE_AFTER seconds, or than the given
+    # percentile of the recent requests if not set, and the first completion wins
+    DEADLINE = env2float(os.getenv("OPENAI_DEADLINE"))
+    HEDGE: bool = env2bool(os.getenv("OPENAI_HEDGE"), default=False)
+    HEDGE_MODEL = os.getenv("OPENAI_HEDGE_MODEL")
+    HEDGE_AFTER = env2float(os.getenv("OPENAI_HEDGE_AFTER"))
+    HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", 95))
+    # with the target p95 latency of the completions (in seconds) set, fewer choices, fewer tokens and eventually
+    # FAST_MODEL, if set, are used while the target is missed, the configured parameters are restored when it is met
+    # again, the model is never switched unless FAST_MODEL is set explicitly
+    TARGET_P95 = env2float(os.getenv("OPENAI_TARGET_P95"))
+    FAST_MODEL = os.getenv("OPENAI_FAST_MODEL")
+    # connect and total timeouts in seconds of a single completion request, the client default is 10 minutes
+    CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+    REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", 60))
+    # shared by all the accounts running in the process
+    MAX_CONCURRENT_REQUESTS = int(os.getenv("OPENAI_MAX_CONCURRENT_REQUESTS", 4))
 
 
 class Configuration:
@@ -41,15 +75,80 @@ class Configuration:
     CACHE_DIR = path_to("data", "cache")
     LOG_DIR = path_to("data", "cache")
     APP_VERSION = "0.0.1"
-    CSS_PATH = path_to("tindermate/ui/static/") / "styles.css"
-
+    CSS_PATH = path_to("tindermate", "ui", "static", "styles.css")
+
+    # JSON lines file the performance spans are exported to, the export is disabled if not set
+    TRACE_FILE: Path | None = Path(trace_file) if (trace_file := os.getenv("TRACE_FILE")) else None
+
+    USAGE_LEDGER_FILE = path_to("data", "usage.jsonl")
+    # record the Tinder and OpenAI traffic to a cassette file, or answer the requests from a recorded cassette
+    # with the recorded latencies, latencies sampled per endpoint or at maximum speed (recorded, sampled, none)
+    RECORD_CASSETTE: Path | None = Path(record) if (record := os.getenv("RECORD_CASSETTE")) else None
+    REPLAY_CASSETTE: Path | None = Path(replay) if (replay := os.getenv("REPLAY_CASSETTE")) else None
+    REPLAY_LATENCY = os.getenv("REPLAY_LATENCY", "recorded")
+
+    # SQLite full-text index of the profiles and messages of the matches
+    SEARCH_INDEX_FILE = path_to("data", "search.sqlite3")
+
+    # pre-generate the replies for the conversations waiting for an answer, at most LIMIT completions per session
+    SPECULATIVE_GENERATION: bool = env2bool(os.getenv("SPECULATIVE_GENERATION"), default=False)
+    SPECULATIVE_GENERATION_LIMIT = int(os.getenv("SPECULATIVE_GENERATION_LIMIT", 10))
+
+    # poll the matches of the displayed tab in the background, the interval (in seconds) adapts to the activity
+    MATCH_REFRESH: bool = env2bool(os.getenv("MATCH_REFRESH"), default=True)
+    MATCH_REFRESH_MIN_INTERVAL = float(os.getenv("MATCH_REFRESH_MIN_INTERVAL", 30))
+    MATCH_REFRESH_MAX_INTERVAL = float(os.getenv("MATCH_REFRESH_MAX_INTERVAL", 300))
+
+    # limits of the requests made to the Tinder API per account, the rate is in requests per second
+    TINDER_RATE_LIMIT = float(os.getenv("TINDER_RATE_LIMIT", 2))
+    TINDER_RATE_BURST = int(os.getenv("TINDER_RATE_BURST", 5))
+    TINDER_CONNECTION_LIMIT = int(os.getenv("TINDER_CONNECTION_LIMIT", 4))
+    # "connect,read,total" timeouts in seconds of the Tinder requests by the endpoint class, the read timeout bounds
+    # the wait for the next chunk of the response, the profiles are small, the pages of matches and messages are not
+    TINDER_TIMEOUTS = {
+        endpoint: tuple(map(float, os.getenv(f"TINDER_{endpoint.upper()}_TIMEOUTS", default).split(",")))
+        for endpoint, default in {"profile": "5,10,15", "list": "5,15,30", "messages": "5,15,30"}.items()
+    }
+    # private HTTP cache of the Tinder responses honoring their Cache-Control, Expires and validators, the responses
+    # without explicit freshness are reused for the seconds below (the user profiles of the matches and the profile of
+    # the current user), the other responses are revalidated with every request
+    TINDER_HTTP_CACHE: bool = env2bool(os.getenv("TINDER_HTTP_CACHE"), default=True)
+    TINDER_HTTP_CACHE_SIZE = int(os.getenv("TINDER_HTTP_CACHE_SIZE", 1000))
+    TINDER_USER_FRESHNESS = float(os.getenv("TINDER_USER_FRESHNESS", 600))
+    TINDER_PROFILE_FRESHNESS = float(os.getenv("TINDER_PROFILE_FRESHNESS", 300))
+    # HTTP client of the Tinder API: aiohttp (HTTP/1.1) or httpx, which multiplexes the requests over HTTP/2 if enabled
+    TINDER_TRANSPORT = os.getenv("TINDER_TRANSPORT", "aiohttp")
+    TINDER_HTTP2: bool = env2bool(os.getenv("TINDER_HTTP2"), default=True)
+
+    # CPU-bound steps (validation of the payloads, rendering) processing at least OFFLOAD_THRESHOLD characters, weighted
+    # by the cost of the step, run in a pool of workers instead of blocking the event loop, the pool consists of threads
+    # or processes (or inline)
+    OFFLOAD_EXECUTOR = os.getenv("OFFLOAD_EXECUTOR", "thread")
+    OFFLOAD_WORKERS = int(os.getenv("OFFLOAD_WORKERS", 2))
+    OFFLOAD_THRESHOLD = int(os.getenv("OFFLOAD_THRESHOLD", 5000))
+    # interval in seconds at which the lag of the event loop is measured, disabled if 0
+    LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))
+
+    # durable queue of the matches processed by the worker processes, a failed job is retried after the backoff
+    # (in seconds, doubled with every attempt) until it has been attempted MAX_ATTEMPTS times
+    JOB_QUEUE_FILE = path_to("data", "jobs.sqlite3")
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", 30))
+    # seconds after which the job of a crashed worker is leased again
+    JOB_LEASE_DURATION = float(os.getenv("JOB_LEASE_DURATION", 300))
+
+    # after how many seconds the content of a tab is considered stale and is refreshed when the tab is selected
+    TAB_CONTENT_TTL = float(os.getenv("TAB_CONTENT_TTL", 300))
+
+    # the tokens of the default account are kept in TOKEN_FILE, the other accounts use ".tokens-<account>" files
+    DEFAULT_ACCOUNT = "default"
     TOKEN_FILE = BASE_DIR / ".tokens"
+    TOKEN_VALIDATION_FILE = BASE_DIR / ".tokens.validation"
+    # for how long a successful token validation is trusted before the tokens are validated again at startup
+    TOKEN_VALIDATION_TTL = int(os.getenv("TOKEN_VALIDATION_TTL", 12 * 60 * 60))
 
     OPENAI_CONFIG = OpenAIConfiguration()
 
     # PROMPTS
     MESSAGE_REPLY_PROMPT_TEMPLATE = os.getenv("MESSAGE_REPLY_PROMPT_TEMPLATE", "message_reply.txt")
     FIRST_MESSAGE_PROMPT_TEMPLATE = os.getenv("FIRST_MESSAGE_PROMPT_TEMPLATE", "first_message.txt")
-
-
-Configuration.TOKEN_FILE.touch()
@@ -0,0 +1,98 @@
+from collections import deque
+from typing import NamedTuple
+
+from tindermate.configuration import Configuration, OpenAIConfiguration
+from tindermate.tracing import Histogram, tracer
+
+
+class GenerationLevel(NamedTuple):
+    num_choices: int
+    max_tokens: int
+    model: str
+
+
+def degradation_levels(config: OpenAIConfiguration) -> list[GenerationLevel]:
+    """Return the generation parameters from the configured ones to the cheapest, fewer choices go first"""
+    levels = [GenerationLevel(choices, config.MAX_TOKENS, config.MODEL) for choices in range(config.NUM_CHOICES, 0, -1)]
+    levels.append(GenerationLevel(1, max(1, config.MAX_TOKENS // 2), config.MODEL))
+    if config.FAST_MODEL and config.FAST_MODEL != config.MODEL:
+        levels.append(GenerationLevel(1, max(1, config.MAX_TOKENS // 2), config.FAST_MODEL))
+    return levels
+
+
+class AdaptiveController:
+    """
+    Picks the generation parameters meeting the latency target of the completions.
+
+    The latency (including the wait for a free request slot) and the errors of the completions generated at the
+    current level are observed. Once enough of them are measured, the controller moves one level down, to fewer
+    choices, fewer tokens and finally a faster model, when the 95th percentile exceeds the target or too many requests
+    fail, and one level up when the percentile falls well below the target again. The samples are discarded on every
+    change, as they describe the previous level, which also keeps the controller from oscillating.
+    """
+
+    def __init__(
+        self,
+        levels: list[GenerationLevel],
+        target_p95: float,
+        min_samples: int = 20,
+        max_error_rate: float = 0.1,
+        headroom: float = 0.6,
+    ):
+        self.levels = levels
+        self.target_p95 = target_p95
+        """Target of the 95th percentile of the latency in seconds"""
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.headroom = headroom
+        """Share of the target the percentile must fall below to restore the previous level"""
+        self.level = 0
+        self._latency = Histogram(window=min_samples)
+        self._errors: deque[bool] = deque(maxlen=min_samples)
+
+    @property
+    def current(self) -> GenerationLevel:
+        return self.levels[self.level]
+
+    def observe(self, level: int, latency: float, failed: bool = False) -> None:
+        """Record the latency in seconds of a completion generated at the given level"""
+        tracer.count(f"adaptive.level{level}.requests")
+        if level != self.level:
+            # the completion started before the last change
+            return
+        self._latency.observe(latency * 1000)
+        self._errors.append(failed)
+        if len(self._errors) < self.min_samples:
+            return
+
+        p95 = self._latency.percentile(95) / 1000
+        error_rate = sum(self._errors) / len(self._errors)
+        if (p95 > self.target_p95 or error_rate > self.max_error_rate) and self.level < len(self.levels) - 1:
+            self._change(self.level + 1, "adaptive.degrade", p95, error_rate)
+        elif p95 < self.target_p95 * self.headroom and error_rate == 0 and self.level > 0:
+            self._change(self.level - 1, "adaptive.restore", p95, error_rate)
+
+    def _change(self, level: int, event: str, p95: float, error_rate: float) -> None:
+        previous = self.current
+        self.level = level
+        tracer.event(
+            event,
+            level=level,
+            p95=round(p95, 3),
+            error_rate=round(error_rate, 3),
+            previous=previous._asdict(),
+            current=self.current._asdict(),
+        )
+        print(f"Generation parameters changed to {self.current} at p95 {p95:.2f}s and {error_rate:.0%} errors")
+        self._latency = Histogram(window=self.min_samples)
+        self._errors.clear()
+
+
+def create_controller(config: OpenAIConfiguration) -> AdaptiveController | None:
+    if config.TARGET_P95 is None:
+        return None
+    return AdaptiveController(degradation_levels(config), config.TARGET_P95)
+
+
+# shared by all the agents, the accounts running side by side wait for the same request slots
+adaptive_controller = create_controller(Configuration.OPENAI_CONFIG)
@@ -1,30 +1,107 @@
+import asyncio
+import hashlib
+import time
+
 from tindermate.configuration import Configuration
-from tindermate.conversation.gpt import GPTClient, create_gpt_client
+from tindermate.conversation.adaptive import AdaptiveController, GenerationLevel, adaptive_controller
+from tindermate.conversation.gpt import GPTClient, OpenAIAuthError, completion_slots, create_gpt_client
 from tindermate.conversation.prompts import Prompt
+from tindermate.conversation.usage import UsageLedger, estimate_prompt_tokens, usage_ledger
+from tindermate.offload import offloader
+from tindermate.tracing import tracer
+
+# fingerprints of the api keys that passed the connection test mapped to the time of the test
+_verified_keys: dict[str, float] = {}
 
 
 class ConversationAgent:
-    def __init__(self, api_key: str, ai_client: GPTClient | None = None):
+    def __init__(
+        self,
+        api_key: str,
+        ai_client: GPTClient | None = None,
+        ledger: UsageLedger | None = None,
+        controller: AdaptiveController | None = None,
+    ):
         self._config = Configuration.OPENAI_CONFIG
+        self._api_key = api_key
         self._ai_client = ai_client or create_gpt_client(api_key, self._config.MODEL)
+        self._ledger = ledger or usage_ledger
+        self._controller = controller or adaptive_controller
+        """Adapts the generation parameters to the latency, the configured parameters are used if None"""
+        self._clients = {self._config.MODEL: self._ai_client}
+        """Clients of the models used by the generation levels, the configured model is served by the main client"""
+        self._key_fingerprint = hashlib.sha256(api_key.encode()).hexdigest()
+
+    @property
+    def ledger(self) -> UsageLedger:
+        return self._ledger
 
-    async def complete_text(self, prompt: Prompt) -> list[str]:
+    async def complete_text(self, prompt: Prompt, match_id: str | None = None) -> list[str]:
         """Return a list of generated completions for the given prompt"""
-        print("Calling GPT")
-        return await self._ai_client.complete_text(
-            prompt=prompt.render(),
-            num_choices=self._config.NUM_CHOICES,
-            max_tokens=self._config.MAX_TOKENS,
-            temperature=self._config.TEMPERATURE,
-            stop_words=prompt.stop_words(),
-        )
+        rendered = await offloader.run(prompt.size, prompt.render)
+        return await self.complete_rendered(rendered, prompt.stop_words(), match_id=match_id)
+
+    async def complete_rendered(self, rendered: str, stop_words: list[str], match_id: str | None = None) -> list[str]:
+        """Return a list of generated completions for the already rendered prompt"""
+        level_idx, level = self._generation_level()
+        client = self._client_for(level.model)
+        # the worst case, when all the choices use up the maximum number of tokens
+        max_tokens = estimate_prompt_tokens(rendered) + level.num_choices * level.max_tokens
+        # reserved before the request waits for a slot, so the concurrent requests don't pass the check together
+        reservation = self._ledger.reserve(client.model, max_tokens)
+
+        queued_at = time.perf_counter()
+        sent = False
+        try:
+            async with completion_slots():
+                sent = True
+                tracer.observe("openai.queue_wait", (time.perf_counter() - queued_at) * 1000)
+                completion = await client.complete_text(
+                    prompt=rendered,
+                    num_choices=level.num_choices,
+                    max_tokens=level.max_tokens,
+                    temperature=self._config.TEMPERATURE,
+                    stop_words=stop_words,
+                )
+        except asyncio.CancelledError:
+            # e.g. the user discarded the result, the completions still waiting for a slot are not paid for at all
+            self._ledger.release(reservation)
+            tracer.count("openai.cancelled")
+            if not sent:
+                tracer.count("openai.cancelled_unsent_tokens", max_tokens)
+            raise
+        except OpenAIAuthError:
+            self._ledger.release(reservation)
+            raise
+        except Exception:
+            # e.g. the rate limits or the deadline of the request
+            self._ledger.release(reservation)
+            self._observe(level_idx, queued_at, failed=True)
+            raise
+        self._observe(level_idx, queued_at)
+        self._ledger.settle(reservation, completion, match_id=match_id)
+        return completion.choices
+
+    def _generation_level(self) -> tuple[int, GenerationLevel]:
+        if self._controller is None:
+            return 0, GenerationLevel(self._config.NUM_CHOICES, self._config.MAX_TOKENS, self._config.MODEL)
+        return self._controller.level, self._controller.current
+
+    def _observe(self, level_idx: int, queued_at: float, failed: bool = False) -> None:
+        if self._controller is not None:
+            # the wait for a free slot is included, it grows under load
+            self._controller.observe(level_idx, time.perf_counter() - queued_at, failed)
+
+    def _client_for(self, model: str) -> GPTClient:
+        if model not in self._clients:
+            self._clients[model] = create_gpt_client(self._api_key, model, self._ai_client.api_base)
+        return self._clients[model]
 
     async def test_connection(self) -> None:
         """Raise an exception if the api key is not valid"""
-        print("Testing OpenAI connection")
-        await self._ai_client.complete_text(
-            prompt="This is a connection test",
-            num_choices=1,
-            max_tokens=10,
-            temperature=0.1,
-        )
+        verified_at = _verified_keys.get(self._key_fingerprint)
+        if verified_at is not None and time.monotonic() - verified_at < self._config.CREDENTIALS_CHECK_TTL:
+            return
+
+        await self._ai_client.check_credentials(timeout=self._config.CREDENTIALS_CHECK_TIMEOUT)
+        _verified_keys[self._key_fingerprint] = time.monotonic()
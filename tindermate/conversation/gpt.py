@@ -1,18 +1,77 @@
-import openai
-from openai.error import AuthenticationError
+import asyncio
+import json
+import math
+import time
+import weakref
+from dataclasses import asdict, dataclass, field, replace
 
 from tindermate.configuration import Configuration
-from tindermate.type_aliases import AnyDict
 from tindermate.filecache import file_cache
+from tindermate.tracing import Histogram, tracer
+from tindermate.transport import (
+    Cassette,
+    CassetteMissError,
+    CassettePlayer,
+    Interaction,
+    Timeouts,
+    recording_cassette,
+    replay_player,
+)
+from tindermate.type_aliases import AnyDict
+
+_completion_slots: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+
+def completion_slots() -> asyncio.Semaphore:
+    """
+    Semaphore shared by all the agents of the running event loop, so the accounts running side by side don't exceed
+    the OpenAI concurrency budget together. Every event loop gets its own, a semaphore can't be shared between loops.
+    """
+    loop = asyncio.get_running_loop()
+    if (slots := _completion_slots.get(loop)) is None:
+        slots = _completion_slots[loop] = asyncio.Semaphore(Configuration.OPENAI_CONFIG.MAX_CONCURRENT_REQUESTS)
+    return slots
 
 
 class OpenAIAuthError(Exception):
     pass
 
 
+class OpenAITimeoutError(Exception):
+    pass
+
+
+@dataclass
+class Usage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def __add__(self, other: "Usage") -> "Usage":
+        return Usage(self.prompt_tokens + other.prompt_tokens, self.completion_tokens + other.completion_tokens)
+
+
+@dataclass
+class Completion:
+    choices: list[str]
+    model: str
+    usage: Usage = field(default_factory=Usage)
+
+
 class GPTClient:
-    def __init__(self, model: str):
+    def __init__(
+        self, model: str, api_base: str | None = None, timeouts: Timeouts | None = None, api_key: str | None = None
+    ):
         self.model = model
+        self._api_key = api_key
+        """Key the requests are authenticated with, kept per client, so multiple accounts can be used side by side"""
+        self.api_base = api_base
+        """URL of the API, e.g. of a local fake server, the default OpenAI endpoint is used if None"""
+        self.timeouts = timeouts
+        """Connect and total timeouts of a request, the openai client does not support the read timeout"""
 
     async def complete_text(
         self,
@@ -21,59 +80,97 @@ class GPTClient:
         max_tokens: int,
         temperature: float,
         stop_words: list[str] | None = None,
-    ) -> list[str]:
+    ) -> Completion:
         if len(stop_words or []) > 4:
             raise ValueError("Provide maximum of 4 stopwords")
 
+        # openai is a heavy import, so it is postponed until the first request
+        import openai
+        from openai.error import AuthenticationError, Timeout
+
+        with tracer.span("openai.complete", model=self.model, n=num_choices, max_tokens=max_tokens) as span:
+            try:
+                resp = await openai.Completion.acreate(
+                    model=self.model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=1,
+                    # how much to penalize the new tokens based on their existing appearance in the text so far
+                    frequency_penalty=0.1,
+                    # higher values increase the model tendency to talk about new topics
+                    presence_penalty=0.6,
+                    # up to 4 sequences where the API will stop generating further tokens
+                    stop=stop_words,
+                    prompt=prompt,
+                    n=num_choices,
+                    api_key=self._api_key,
+                    api_base=self.api_base,
+                    request_timeout=(self.timeouts.connect, self.timeouts.total) if self.timeouts else None,
+                )
+            except AuthenticationError as exc:
+                raise OpenAIAuthError() from exc
+            except Timeout as exc:
+                tracer.count("openai.timeouts")
+                raise OpenAITimeoutError(f"No completion within {self.timeouts}") from exc
+
+            for key, tokens in (resp.get("usage") or {}).items():
+                span[key] = tokens
+                tracer.count(f"openai.{key}", tokens)
+
+        return self.parse_response(resp)
+
+    async def check_credentials(self, timeout: float) -> None:
+        """Raise an exception if the api key is not valid, using a free endpoint instead of a paid completion"""
+        import openai
+        from openai.error import AuthenticationError, Timeout
+
         try:
-            resp = await openai.Completion.acreate(
-                model=self.model,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=1,
-                # how much to penalize the new tokens based on their existing appearance in the text so far
-                frequency_penalty=0.1,
-                # higher values increase the model tendency to talk about new topics
-                presence_penalty=0.6,
-                # up to 4 sequences where the API will stop generating further tokens
-                stop=stop_words,
-                prompt=prompt,
-                n=num_choices,
-            )
+            await asyncio.wait_for(openai.Model.alist(api_key=self._api_key, api_base=self.api_base), timeout=timeout)
         except AuthenticationError as exc:
             raise OpenAIAuthError() from exc
+        except (asyncio.TimeoutError, Timeout) as exc:
+            tracer.count("openai.timeouts")
+            raise OpenAITimeoutError(f"Credentials not verified within {timeout}s") from exc
 
-        return self.parse_response(resp)
-
-    def parse_response(self, response: AnyDict) -> list[str]:
+    def parse_response(self, response: AnyDict) -> Completion:
         for choice in response["choices"]:
             if (reason := choice["finish_reason"]) != "stop":
                 print(f"Generation {choice['index']} finished before the end token was reached, {reason=}")
 
-        return [choice["text"].strip() for choice in response["choices"]]
+        return self.make_completion(response)
+
+    def make_completion(self, response: AnyDict) -> Completion:
+        usage = response.get("usage") or {}
+        return Completion(
+            choices=[choice["text"].strip() for choice in response["choices"]],
+            model=response.get("model", self.model),
+            usage=Usage(
+                prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0)
+            ),
+        )
 
 
 class ChatGPTClient(GPTClient):
-    def __init__(self):
-        super().__init__("text-chat-davinci-002-20221122")
+    def __init__(self, api_base: str | None = None, api_key: str | None = None):
+        super().__init__("text-chat-davinci-002-20221122", api_base, api_key=api_key)
 
-    def parse_response(self, response: AnyDict) -> list[str]:
+    def parse_response(self, response: AnyDict) -> Completion:
         for choice in response["choices"]:
             if (reason := choice["finish_details"]["type"]) != "stop":
                 print(f"Generation {choice['index']} finished before the end token was reached, {reason=}")
 
-        return [choice["text"].strip() for choice in response["choices"]]
+        return self.make_completion(response)
 
 
 class CachingGPTClient(GPTClient):
     """GPT client that caches the requests in order to avoid unnecessary charges"""
 
     def __init__(self, delegate: GPTClient):
-        super().__init__(delegate.model)
+        super().__init__(delegate.model, delegate.api_base)
         self._num_requests = 0
         self._delegate = delegate
 
-    @file_cache("gpt", is_method=True)
+    @file_cache(namespace="gpt", is_method=True)
     async def complete_text(
         self,
         prompt: str,
@@ -81,14 +178,237 @@ class CachingGPTClient(GPTClient):
         max_tokens: int,
         temperature: float,
         stop_words: list[str] | None = None,
-    ) -> list[str]:
+    ) -> Completion:
         if self._num_requests > 20:
             raise Exception("Too many requests, exiting to prevent accidental infinite loop")
         self._num_requests += 1
         return await self._delegate.complete_text(prompt, num_choices, max_tokens, temperature, stop_words)
 
 
-def create_gpt_client(api_key: str, model: str) -> GPTClient:
-    openai.api_key = api_key
-    client = GPTClient(model)
+class HedgedGPTClient(GPTClient):
+    """
+    GPT client bounding the latency of the completions of the wrapped client.
+
+    When the primary request takes longer than the usual latency (the given percentile of the recent primary requests,
+    or a fixed delay), a second request is sent to the hedge client, which can use another model, the first completion
+    wins and the other request is cancelled. Any client can be the primary or the hedge backend. Only the requests in
+    the tail are hedged. The hedge request takes a completion slot of its own, and as the cancelled request may still be
+    billed, its usage is added to the returned completion. A request running longer than the deadline fails.
+    """
+
+    def __init__(
+        self,
+        primary: GPTClient,
+        hedge: GPTClient | None = None,
+        deadline: float | None = None,
+        hedge_after: float | None = None,
+        percentile: float = 95,
+        min_samples: int = 20,
+    ):
+        super().__init__(primary.model, primary.api_base)
+        self._primary = primary
+        self._hedge = hedge or primary
+        self.deadline = deadline
+        """Seconds after which the completion fails, unbounded if None"""
+        self.hedge_after = hedge_after
+        """Fixed number of seconds after which the request is hedged, the percentile of the latency is used if None"""
+        self.percentile = percentile
+        self.min_samples = min_samples
+        """Number of the primary requests measured before they are hedged based on their latency"""
+        self._latency = Histogram(window=500)
+
+    def hedge_delay(self) -> float | None:
+        """Return the seconds after which the primary request is hedged, None if it isn't"""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if self._latency.count < self.min_samples:
+            return None
+        return self._latency.percentile(self.percentile) / 1000
+
+    async def complete_text(
+        self,
+        prompt: str,
+        num_choices: int,
+        max_tokens: int,
+        temperature: float,
+        stop_words: list[str] | None = None,
+    ) -> Completion:
+        args = (prompt, num_choices, max_tokens, temperature, stop_words)
+        with tracer.span("openai.hedged", model=self.model) as span:
+            try:
+                return await asyncio.wait_for(self._race(args, span), self.deadline)
+            except asyncio.TimeoutError as exc:
+                tracer.count("openai.deadline_exceeded")
+                raise OpenAITimeoutError(f"No completion within {self.deadline}s") from exc
+
+    async def _race(self, args: tuple, span: AnyDict) -> Completion:
+        start = time.perf_counter()
+        primary = asyncio.create_task(self._primary.complete_text(*args))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+            if not done:
+                span["hedged"] = True
+                tracer.count("openai.hedges")
+                tasks.add(asyncio.create_task(self._send_hedge(args)))
+            launched = set(tasks)
+            error: BaseException | None = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if (exc := task.exception()) is None:
+                        if task is not primary:
+                            span["hedge_won"] = True
+                            tracer.count("openai.hedges_won")
+                        return self._add_losers_usage(task.result(), launched - {task})
+                    error = error or exc
+            raise error  # type: ignore[misc]
+        finally:
+            # a cancelled primary request took at least this long, which keeps the percentile from drifting down
+            self._latency.observe((time.perf_counter() - start) * 1000)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send_hedge(self, args: tuple) -> Completion:
+        # the primary request holds a slot of the caller, the hedge is an additional concurrent request
+        async with completion_slots():
+            return await self._hedge.complete_text(*args)
+
+    @staticmethod
+    def _add_losers_usage(completion: Completion, losers: set[asyncio.Task]) -> Completion:
+        """Add the usage of the losing requests, the ones to be cancelled are estimated by the usage of the winner"""
+        usage = completion.usage
+        for task in losers:
+            if not task.done():
+                usage += completion.usage
+            elif task.exception() is None:
+                usage += task.result().usage
+        if usage is not completion.usage:
+            tracer.count("openai.hedge_tokens", usage.total_tokens - completion.usage.total_tokens)
+        return replace(completion, usage=usage)
+
+    async def check_credentials(self, timeout: float) -> None:
+        await self._primary.check_credentials(timeout)
+
+
+_OPENAI_SCOPE = "openai"
+
+
+def _completion_request(
+    model: str, prompt: str, num_choices: int, max_tokens: int, temperature: float, stop_words: list[str] | None
+) -> Interaction:
+    body = {
+        "model": model,
+        "prompt": prompt,
+        "n": num_choices,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stop": stop_words,
+    }
+    return Interaction(scope=_OPENAI_SCOPE, method="POST", url="completions", request_body=body)
+
+
+class RecordingGPTClient(GPTClient):
+    """GPT client recording the completions of the wrapped client together with their timing to a cassette"""
+
+    def __init__(self, delegate: GPTClient, cassette: Cassette):
+        super().__init__(delegate.model, delegate.api_base)
+        self._delegate = delegate
+        self._cassette = cassette
+
+    async def complete_text(
+        self,
+        prompt: str,
+        num_choices: int,
+        max_tokens: int,
+        temperature: float,
+        stop_words: list[str] | None = None,
+    ) -> Completion:
+        interaction = _completion_request(self.model, prompt, num_choices, max_tokens, temperature, stop_words)
+        start = time.perf_counter()
+        try:
+            completion = await self._delegate.complete_text(prompt, num_choices, max_tokens, temperature, stop_words)
+        except Exception as exc:
+            interaction.error = type(exc).__name__
+            interaction.duration_ms = (time.perf_counter() - start) * 1000
+            self._cassette.record(interaction)
+            raise
+
+        interaction.duration_ms = (time.perf_counter() - start) * 1000
+        interaction.status = 200
+        interaction.body = json.dumps(asdict(completion))
+        self._cassette.record(interaction)
+        return completion
+
+    async def check_credentials(self, timeout: float) -> None:
+        interaction = Interaction(scope=_OPENAI_SCOPE, method="GET", url="models")
+        start = time.perf_counter()
+        try:
+            await self._delegate.check_credentials(timeout)
+        except Exception as exc:
+            interaction.error = type(exc).__name__
+            raise
+        finally:
+            interaction.duration_ms = (time.perf_counter() - start) * 1000
+            self._cassette.record(interaction)
+
+
+class ReplayGPTClient(GPTClient):
+    """GPT client answering the completions from a cassette without any network access"""
+
+    def __init__(self, player: CassettePlayer, model: str):
+        super().__init__(model)
+        self._player = player
+
+    async def complete_text(
+        self,
+        prompt: str,
+        num_choices: int,
+        max_tokens: int,
+        temperature: float,
+        stop_words: list[str] | None = None,
+    ) -> Completion:
+        request = _completion_request(self.model, prompt, num_choices, max_tokens, temperature, stop_words)
+        interaction = await self._player.play(request)
+        self._raise_error(interaction)
+        content = json.loads(interaction.body or "{}")
+        return Completion(choices=content["choices"], model=content["model"], usage=Usage(**content["usage"]))
+
+    async def check_credentials(self, timeout: float) -> None:
+        try:
+            interaction = await self._player.play(Interaction(scope=_OPENAI_SCOPE, method="GET", url="models"))
+        except CassetteMissError:
+            # the credentials were not checked during the recording
+            return
+        self._raise_error(interaction)
+
+    @staticmethod
+    def _raise_error(interaction: Interaction) -> None:
+        if interaction.error == OpenAIAuthError.__name__:
+            raise OpenAIAuthError()
+        interaction.raise_error()
+
+
+def create_gpt_client(
+    api_key: str, model: str, api_base: str | None = Configuration.OPENAI_CONFIG.API_BASE
+) -> GPTClient:
+    if (player := replay_player()) is not None:
+        return ReplayGPTClient(player, model)
+
+    config = Configuration.OPENAI_CONFIG
+    timeouts = Timeouts(connect=config.CONNECT_TIMEOUT, total=config.REQUEST_TIMEOUT)
+    client = GPTClient(model, api_base, timeouts, api_key)
+    if config.HEDGE or config.DEADLINE is not None:
+        hedge = GPTClient(config.HEDGE_MODEL, api_base, timeouts, api_key) if config.HEDGE_MODEL else None
+        client = HedgedGPTClient(
+            client,
+            hedge,
+            deadline=config.DEADLINE,
+            # hedging is disabled with a delay longer than any request
+            hedge_after=config.HEDGE_AFTER if config.HEDGE else math.inf,
+            percentile=config.HEDGE_PERCENTILE,
+        )
+    if (cassette := recording_cassette()) is not None:
+        client = RecordingGPTClient(client, cassette)
     return client if not Configuration.DEBUG else CachingGPTClient(client)
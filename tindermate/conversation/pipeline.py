@@ -0,0 +1,184 @@
+import asyncio
+from collections.abc import AsyncIterable, AsyncIterator
+from concurrent.futures import Executor
+from typing import NamedTuple
+
+from tindermate.conversation.prompts import CompactProfile, FirstMessagePrompt, MessageReplyPrompt, Prompt
+from tindermate.tinder.message_log import LogEntry, MessageLog
+from tindermate.tinder.schemas import CurrentUser, UserDetail
+from tindermate.tracing import tracer
+
+
+class PromptJob(NamedTuple):
+    """Compact input of a prompt, only the tail of the conversation which fits into the prompt is included"""
+
+    match_id: str
+    current_user: CompactProfile
+    matched_user: CompactProfile
+    history: tuple[LogEntry, ...] | None = None
+    """Last messages of the conversation to reply to, None for the first message"""
+    earlier_messages: int = 0
+
+    @classmethod
+    def first_message(cls, match_id: str, current_user: CurrentUser, matched_user: UserDetail) -> "PromptJob":
+        return cls(match_id, CompactProfile.of(current_user), CompactProfile.of(matched_user))
+
+    @classmethod
+    def reply(
+        cls,
+        match_id: str,
+        current_user: CurrentUser,
+        matched_user: UserDetail,
+        message_log: MessageLog,
+        history_limit: int = 10,
+    ) -> "PromptJob":
+        history = tuple(message_log.last(history_limit))
+        return cls(
+            match_id,
+            CompactProfile.of(current_user),
+            CompactProfile.of(matched_user),
+            history,
+            earlier_messages=len(message_log) - len(history),
+        )
+
+    def build_prompt(self) -> Prompt:
+        if self.history is None:
+            return FirstMessagePrompt(current_user=self.current_user, matched_user=self.matched_user)
+        message_log = MessageLog()
+        message_log.merge(self.history)
+        return MessageReplyPrompt(
+            current_user=self.current_user,
+            matched_user=self.matched_user,
+            message_history=message_log,
+            history_limit=len(self.history),
+            earlier_messages=self.earlier_messages,
+        )
+
+
+class RenderedPrompt(NamedTuple):
+    match_id: str
+    text: str | None
+    stop_words: list[str]
+    error: str | None = None
+
+
+def render_shard(jobs: list[PromptJob]) -> list[RenderedPrompt]:
+    """Build and render the prompts of the jobs, the errors are reported per job"""
+    rendered = []
+    for job in jobs:
+        try:
+            prompt = job.build_prompt()
+            rendered.append(RenderedPrompt(job.match_id, prompt.render(), prompt.stop_words()))
+        except Exception as exc:
+            rendered.append(RenderedPrompt(job.match_id, None, [], f"{type(exc).__name__}: {exc}"))
+    return rendered
+
+
+class PromptPipeline:
+    """
+    Builds and renders the prompts of many matches on all the cores.
+
+    The jobs are grouped into shards, which are rendered by a pool of processes, so only the compact jobs and the
+    rendered texts are pickled. A shard is submitted once it is full, or earlier when no job arrives for a while,
+    so the rendered prompts keep streaming to the generation even if the jobs arrive slowly. The prompts are
+    yielded in the order their shards complete. Without workers, the shards are rendered on the event loop.
+    """
+
+    def __init__(self, workers: int = 0, shard_size: int = 256, flush_after: float = 0.05):
+        self.workers = workers
+        self.shard_size = shard_size
+        self.flush_after = flush_after
+        """Seconds without a new job after which an incomplete shard is submitted"""
+        self._executor: Executor | None = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def render(self, jobs: AsyncIterable[PromptJob]) -> AsyncIterator[RenderedPrompt]:
+        results: asyncio.Queue[list[RenderedPrompt] | None] = asyncio.Queue()
+        feeder = asyncio.create_task(self._feed(jobs, results))
+        try:
+            while (shard := await results.get()) is not None:
+                for rendered in shard:
+                    yield rendered
+            # propagate the errors of the jobs iterator
+            await feeder
+        finally:
+            if not feeder.done():
+                # the consumer stopped early
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+
+    async def _feed(self, jobs: AsyncIterable[PromptJob], results: asyncio.Queue[list[RenderedPrompt] | None]) -> None:
+        # the jobs are pumped through a queue, because waiting for the next job of an iterator can't time out safely
+        incoming: asyncio.Queue[PromptJob | None] = asyncio.Queue(maxsize=self.shard_size)
+        pump = asyncio.create_task(self._pump(jobs, incoming))
+        # at most two shards per worker are in flight, so a fast producer does not fill the memory with shards
+        in_flight = asyncio.Semaphore(max(1, self.workers) * 2)
+        shards: set[asyncio.Task] = set()
+        try:
+            finished = False
+            while not finished:
+                shard: list[PromptJob] = []
+                while len(shard) < self.shard_size:
+                    try:
+                        job = await asyncio.wait_for(incoming.get(), self.flush_after if shard else None)
+                    except asyncio.TimeoutError:
+                        break
+                    if job is None:
+                        finished = True
+                        break
+                    shard.append(job)
+                if shard:
+                    await in_flight.acquire()
+                    task = asyncio.create_task(self._render_shard(shard, results, in_flight))
+                    shards.add(task)
+                    task.add_done_callback(shards.discard)
+            await pump
+            if shards:
+                await asyncio.gather(*shards)
+        finally:
+            pump.cancel()
+            for task in shards:
+                task.cancel()
+            await asyncio.gather(pump, *shards, return_exceptions=True)
+            await results.put(None)
+
+    @staticmethod
+    async def _pump(jobs: AsyncIterable[PromptJob], incoming: asyncio.Queue[PromptJob | None]) -> None:
+        try:
+            async for job in jobs:
+                await incoming.put(job)
+        except Exception:
+            # wake up the feeder, which raises the error when it awaits the pump
+            await incoming.put(None)
+            raise
+        await incoming.put(None)
+
+    async def _render_shard(
+        self, shard: list[PromptJob], results: asyncio.Queue[list[RenderedPrompt] | None], in_flight: asyncio.Semaphore
+    ) -> None:
+        try:
+            with tracer.span("pipeline.shard", jobs=len(shard), workers=self.workers):
+                if self.workers > 0:
+                    rendered = await asyncio.get_running_loop().run_in_executor(
+                        self._get_executor(), render_shard, shard
+                    )
+                else:
+                    rendered = render_shard(shard)
+        except Exception as exc:
+            # e.g. a crashed worker process, the jobs of the shard are reported as failed
+            rendered = [RenderedPrompt(job.match_id, None, [], f"{type(exc).__name__}: {exc}") for job in shard]
+        finally:
+            in_flight.release()
+        await results.put(rendered)
@@ -1,12 +1,17 @@
+import functools
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-
-from jinja2 import Environment, PackageLoader, select_autoescape
+from typing import TYPE_CHECKING, NamedTuple
 
 from tindermate.configuration import Configuration
-from tindermate.tinder.schemas import CurrentUser, Message, UserDetail
+from tindermate.tinder.message_log import MessageLog
+from tindermate.tinder.schemas import CurrentUser, UserDetail
+from tindermate.tracing import tracer
 from tindermate.type_aliases import AnyDict
 
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
 
 @dataclass
 class Grammar:
@@ -30,13 +35,53 @@ class Grammar:
         return f"{self.pobj.upper()}: "
 
 
+class CompactProfile(NamedTuple):
+    """Fields of a user the prompts are built from, much cheaper to pickle than the pydantic models"""
+
+    id: str
+    name: str
+    gender: int
+    age: int | None = None
+    bio: str | None = None
+    city_name: str | None = None
+    school: str | None = None
+    job: str | None = None
+    interests: tuple[str, ...] = ()
+    gender_filter: int | None = None
+
+    @classmethod
+    def of(cls, user: UserDetail) -> "CompactProfile":
+        return cls(
+            id=user.id,
+            name=user.name,
+            gender=user.gender,
+            age=user.age,
+            bio=user.bio,
+            city_name=user.city_name,
+            school=user.school,
+            job=user.job,
+            interests=tuple(user.interests),
+            gender_filter=user.gender_filter if isinstance(user, CurrentUser) else None,
+        )
+
+
+Profile = UserDetail | CompactProfile
+
+
+@functools.cache
+def template_env() -> "Environment":
+    """Create the template environment on first use, it is shared by all the prompts"""
+    from jinja2 import Environment, PackageLoader, select_autoescape
+
+    return Environment(
+        loader=PackageLoader("tindermate.conversation", "templates"),
+        autoescape=select_autoescape(),
+    )
+
+
 class Prompt(ABC):
     def __init__(self, template: str):
         self._template = template
-        self._template_env = Environment(
-            loader=PackageLoader("tindermate.conversation", "templates"),
-            autoescape=select_autoescape(),
-        )
 
     @abstractmethod
     def get_template_vars(self) -> AnyDict:
@@ -46,25 +91,34 @@ class Prompt(ABC):
     def stop_words(self) -> list[str]:
         ...
 
+    @property
+    def size(self) -> int:
+        """Number of the characters interpolated into the template"""
+        return 0
+
     def render(self) -> str:
         """Interpolates the variables into the prompt template and renders it into a string"""
-        template = self._template_env.get_template(self._template)
-        return template.render(self.get_template_vars()).replace("\n\n", "\n")
+        with tracer.span("prompt.render", template=self._template):
+            template = template_env().get_template(self._template)
+            return template.render(self.get_template_vars()).replace("\n\n", "\n")
 
 
 class MessageReplyPrompt(Prompt):
     def __init__(
         self,
-        current_user: CurrentUser,
-        matched_user: UserDetail,
-        message_history: list[Message],
+        current_user: CurrentUser | CompactProfile,
+        matched_user: Profile,
+        message_history: MessageLog,
         history_limit: int = 10,
+        earlier_messages: int = 0,
     ):
         super().__init__(Configuration.MESSAGE_REPLY_PROMPT_TEMPLATE)
         self._current_user = current_user
         self._matched_user = matched_user
         self._message_history = message_history
         self._history_limit = history_limit
+        # number of the messages preceding the history, when only the tail of the conversation is passed
+        self._earlier_messages = earlier_messages
 
         self._grammar_1 = Grammar.for_gender(self._current_user.gender)
         other_gender = (
@@ -72,11 +126,15 @@ class MessageReplyPrompt(Prompt):
         )
         self._grammar_2 = Grammar.for_gender(other_gender)
 
+    @property
+    def size(self) -> int:
+        return sum(len(entry.text) for entry in self._message_history.last(self._history_limit))
+
     def get_template_vars(self) -> AnyDict:
-        message_history = self._message_history[-self._history_limit :]
-        num_hidden_messages = max(0, len(self._message_history) - self._history_limit)
+        message_history = self._message_history.last(self._history_limit)
+        num_hidden_messages = max(0, len(self._message_history) - self._history_limit) + self._earlier_messages
 
-        message_history_var = [(message.from_ == self._current_user.id, message.message) for message in message_history]
+        message_history_var = [(entry.sender_id == self._current_user.id, entry.text) for entry in message_history]
 
         return {
             "message_history": message_history_var,
@@ -91,7 +149,7 @@ class MessageReplyPrompt(Prompt):
 
 
 class FirstMessagePrompt(Prompt):
-    def __init__(self, current_user: CurrentUser, matched_user: UserDetail):
+    def __init__(self, current_user: CurrentUser | CompactProfile, matched_user: Profile):
         super().__init__(Configuration.FIRST_MESSAGE_PROMPT_TEMPLATE)
         self._current_user = current_user
         self._matched_user = matched_user
@@ -101,11 +159,15 @@ class FirstMessagePrompt(Prompt):
         )
         self._grammar_2 = Grammar.for_gender(other_gender)
 
+    @property
+    def size(self) -> int:
+        return len(self._matched_user.bio or "") + sum(map(len, self._matched_user.interests))
+
     def get_template_vars(self) -> AnyDict:
         return {
             "name": self._matched_user.name,
             "bio": None if not (bio := self._matched_user.bio) else bio.replace("\n", " "),
-            "city": None if (city := self._matched_user.city) is None else city.name,
+            "city": self._matched_user.city_name,
             "age": self._matched_user.age,
             "school": self._matched_user.school,
             "job": self._matched_user.job,
@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+
+from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.prompts import MessageReplyPrompt
+from tindermate.conversation.usage import BudgetExceededError
+from tindermate.tinder.client import TinderClient
+from tindermate.tinder.schemas import CurrentUser, Match, ThreadKey, UserDetail, is_reply_pending, thread_key
+from tindermate.tracing import tracer
+
+
+@dataclass
+class Suggestion:
+    thread_key: ThreadKey
+    """State of the conversation the suggestions were generated for"""
+    choices: list[str]
+
+
+class SpeculativeGenerator:
+    """
+    Pre-generates the replies for the conversations that wait for the user's answer.
+
+    The suggestions are stored together with the state of the conversation they were generated for,
+    so they are discarded once a new message arrives. At most `max_requests` completions are spent per session.
+    """
+
+    def __init__(self, tinder: TinderClient, agent: ConversationAgent, max_requests: int):
+        self._tinder = tinder
+        self._agent = agent
+        self._remaining_requests = max_requests
+        self._suggestions: dict[str, Suggestion] = {}
+        self._in_progress: set[str] = set()
+        """Matches whose replies are being pre-generated"""
+
+    async def pregenerate(self, match: Match, matched_user: UserDetail, current_user: CurrentUser) -> None:
+        if match.id in self._in_progress:
+            return
+        self._in_progress.add(match.id)
+        try:
+            await self._pregenerate(match, matched_user, current_user)
+        finally:
+            self._in_progress.discard(match.id)
+
+    def pop(self, match: Match) -> list[str] | None:
+        """Return the suggestions for the current state of the conversation, each suggestion is used only once"""
+        suggestion = self._suggestions.pop(match.id, None)
+        if suggestion is None:
+            return None
+        if suggestion.thread_key != thread_key(match):
+            tracer.count("speculation.stale")
+            return None
+        tracer.count("speculation.hit")
+        return suggestion.choices
+
+    def invalidate(self, match: Match) -> None:
+        if (suggestion := self._suggestions.get(match.id)) is not None and suggestion.thread_key != thread_key(match):
+            tracer.count("speculation.stale")
+            del self._suggestions[match.id]
+
+    async def _pregenerate(self, match: Match, matched_user: UserDetail, current_user: CurrentUser) -> None:
+        await self._tinder.fetch_messages_for(match)
+        self.invalidate(match)
+        if not is_reply_pending(match) or match.id in self._suggestions or self._remaining_requests <= 0:
+            return
+
+        key = thread_key(match)
+        prompt = MessageReplyPrompt(
+            current_user=current_user, matched_user=matched_user, message_history=match.message_log
+        )
+        self._remaining_requests -= 1
+        try:
+            with tracer.span("speculation.generate", match_id=match.id):
+                choices = await self._agent.complete_text(prompt, match_id=match.id)
+        except BudgetExceededError:
+            # speculation is best effort, it must not compete with the requests made by the user
+            return
+
+        # the conversation might have changed while the completion was running
+        if key == thread_key(match):
+            self._suggestions[match.id] = Suggestion(thread_key=key, choices=choices)
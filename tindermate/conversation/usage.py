@@ -0,0 +1,246 @@
+import json
+import math
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass
+from operator import attrgetter
+from pathlib import Path
+
+from tindermate.configuration import Configuration, ensure_dir
+from tindermate.conversation.gpt import Completion
+from tindermate.tracing import tracer
+
+# USD per 1000 tokens, prompt and completion tokens are priced equally by the completion models
+MODEL_PRICES = {
+    "text-davinci-003": 0.02,
+    "text-davinci-002": 0.02,
+    "text-curie-001": 0.002,
+    "text-babbage-001": 0.0005,
+    "text-ada-001": 0.0004,
+}
+DEFAULT_PRICE = MODEL_PRICES["text-davinci-003"]
+_MINUTE = 60
+_DAY = 24 * 60 * 60
+
+
+def estimate_cost(model: str, tokens: int) -> float:
+    return tokens / 1000 * MODEL_PRICES.get(model, DEFAULT_PRICE)
+
+
+def estimate_prompt_tokens(prompt: str) -> int:
+    """Rough token count of a prompt, one token corresponds to about 4 characters of English text"""
+    return len(prompt) // 4 + 1
+
+
+class BudgetExceededError(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+        """Number of seconds after which the request would fit into the budget again, infinite if it never fits"""
+
+
+@dataclass
+class UsageRecord:
+    timestamp: float
+    session_id: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    match_id: str | None = None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class UsageTotals:
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, record: UsageRecord) -> None:
+        self.requests += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cost += record.cost
+
+
+class _SpendingWindow:
+    """Records of the last seconds in the order they were made, with their running total cost"""
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        self.records: deque[UsageRecord] = deque()
+        self.spent = 0.0
+
+    def add(self, record: UsageRecord) -> None:
+        self.records.append(record)
+        self.spent += record.cost
+
+    def discard(self, record: UsageRecord) -> None:
+        # the records older than the oldest one kept have dropped out of the window already
+        if self.records and record.timestamp >= self.records[0].timestamp:
+            self.spent -= record.cost
+
+    def prune(self, now: float) -> None:
+        while self.records and self.records[0].timestamp <= now - self.seconds:
+            self.spent -= self.records.popleft().cost
+        if not self.records:
+            # do not accumulate the rounding errors
+            self.spent = 0.0
+
+    def retry_after(self, now: float) -> float:
+        """Number of seconds until the oldest record leaves the window"""
+        return self.records[0].timestamp + self.seconds - now
+
+
+class UsageLedger:
+    """
+    Accounts the tokens and the estimated cost of the completions per request, match and session.
+
+    The spend of the last minute and of the last day is kept in memory with its running totals to enforce the per-minute
+    and per-day budgets before a request is sent.
+    The worst-case cost of a request is reserved before it is sent and settled with the actual usage afterwards, so the
+    concurrent requests cannot overshoot a budget together.
+    The records are appended to a JSON lines file, so the day budget and the reports span multiple runs.
+    The processes spending the same budgets concurrently, such as the queue workers, each get a share of them.
+    """
+
+    def __init__(
+        self,
+        ledger_file: Path | None = None,
+        budget_per_minute: float | None = None,
+        budget_per_day: float | None = None,
+        share: float = 1.0,
+    ):
+        self.session_id = uuid.uuid4().hex[:12]
+        self.session_started_at = time.time()
+        self.session_totals = UsageTotals()
+        self.match_totals: defaultdict[str, UsageTotals] = defaultdict(UsageTotals)
+        self._ledger_file = ledger_file
+        self._share = share
+        """Part of the budgets this ledger may spend when several processes spend them at the same time"""
+        self._budget_per_minute = None if budget_per_minute is None else budget_per_minute * share
+        self._budget_per_day = None if budget_per_day is None else budget_per_day * share
+        self._windows: list[tuple[_SpendingWindow, float | None]] | None = None
+
+    def check_budget(self, model: str, tokens: int) -> None:
+        """Raise an exception if a request consuming up to the given number of tokens would exceed a budget"""
+        cost = estimate_cost(model, tokens)
+        now = time.time()
+        for window, budget in self._spending_windows(now):
+            if budget is None or window.spent + cost <= budget:
+                continue
+            tracer.count("openai.budget_rejections")
+            # a request costing more than the whole budget never fits
+            retry_after = math.inf if cost > budget else window.retry_after(now)
+            raise BudgetExceededError(
+                f"OpenAI budget of ${budget:.2f} per {window.seconds}s exceeded "
+                f"(spent ${window.spent:.4f}, request ${cost:.4f})",
+                retry_after=retry_after,
+            )
+
+    def reserve(self, model: str, tokens: int) -> UsageRecord:
+        """Check the budget and hold the cost of the tokens until the reservation is settled or released"""
+        self.check_budget(model, tokens)
+        reservation = UsageRecord(time.time(), self.session_id, model, tokens, 0, estimate_cost(model, tokens))
+        for window, _ in self._spending_windows(reservation.timestamp):
+            window.add(reservation)
+        return reservation
+
+    def release(self, reservation: UsageRecord) -> None:
+        for window, _ in self._spending_windows(time.time()):
+            window.discard(reservation)
+        # the released reservation keeps its place in the windows, but no longer costs anything
+        reservation.cost = 0.0
+
+    def settle(self, reservation: UsageRecord, completion: Completion, match_id: str | None = None) -> UsageRecord:
+        """Replace the reservation with the actual usage of the completion"""
+        self.release(reservation)
+        return self.record(completion, match_id)
+
+    def record(self, completion: Completion, match_id: str | None = None) -> UsageRecord:
+        record = UsageRecord(
+            timestamp=time.time(),
+            session_id=self.session_id,
+            model=completion.model,
+            prompt_tokens=completion.usage.prompt_tokens,
+            completion_tokens=completion.usage.completion_tokens,
+            cost=estimate_cost(completion.model, completion.usage.total_tokens),
+            match_id=match_id,
+        )
+        for window, _ in self._spending_windows(record.timestamp):
+            window.add(record)
+        self.session_totals.add(record)
+        if match_id is not None:
+            self.match_totals[match_id].add(record)
+        tracer.count("openai.cost", record.cost)
+        self._persist(record)
+        return record
+
+    def session_summary(self) -> str:
+        totals = self.session_totals
+        elapsed = max(time.time() - self.session_started_at, 1e-9)
+        return (
+            f"{totals.requests} requests, {totals.total_tokens} tokens "
+            f"({totals.total_tokens / elapsed:.1f} tokens/s), ${totals.cost:.4f}"
+        )
+
+    def _spending_windows(self, now: float) -> list[tuple[_SpendingWindow, float | None]]:
+        """Return the spending windows with their budgets, without the records that are too old"""
+        if self._windows is None:
+            minute, day = _SpendingWindow(_MINUTE), _SpendingWindow(_DAY)
+            # the records of the previous runs count towards the budgets as well, towards every share in proportion
+            for record in sorted(load_records(self._ledger_file), key=attrgetter("timestamp")):
+                record.cost *= self._share
+                minute.add(record)
+                day.add(record)
+            self._windows = [(minute, self._budget_per_minute), (day, self._budget_per_day)]
+        for window, _ in self._windows:
+            window.prune(now)
+        return self._windows
+
+    def _persist(self, record: UsageRecord) -> None:
+        if self._ledger_file is None:
+            return
+        ensure_dir(self._ledger_file.parent)
+        with self._ledger_file.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(record)) + "\n")
+
+
+def load_records(ledger_file: Path | None) -> list[UsageRecord]:
+    if ledger_file is None or not ledger_file.exists():
+        return []
+    records = []
+    with ledger_file.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(UsageRecord(**json.loads(line)))
+            except (ValueError, TypeError):
+                continue
+    return records
+
+
+def session_report(ledger_file: Path | None) -> list[tuple[str, float, float, UsageTotals]]:
+    """Return the (session id, start, end, totals) of every session recorded in the ledger"""
+    sessions: dict[str, tuple[float, float, UsageTotals]] = {}
+    for record in load_records(ledger_file):
+        start, end, totals = sessions.get(record.session_id, (record.timestamp, record.timestamp, UsageTotals()))
+        totals.add(record)
+        sessions[record.session_id] = (min(start, record.timestamp), max(end, record.timestamp), totals)
+    return [(session_id, start, end, totals) for session_id, (start, end, totals) in sessions.items()]
+
+
+usage_ledger = UsageLedger(
+    Configuration.USAGE_LEDGER_FILE,
+    budget_per_minute=Configuration.OPENAI_CONFIG.BUDGET_PER_MINUTE,
+    budget_per_day=Configuration.OPENAI_CONFIG.BUDGET_PER_DAY,
+)
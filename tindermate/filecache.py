@@ -3,12 +3,15 @@ import asyncio
 import functools
 import hashlib
 import inspect
+import os
 import pickle
-from collections.abc import Callable
+import uuid
+from collections.abc import Callable, Iterator
 from pathlib import Path
 from typing import Generic, ParamSpec, TypeVar
 
-from tindermate.configuration import Configuration
+from tindermate.configuration import Configuration, ensure_dir
+from tindermate.tracing import tracer
 
 
 P = ParamSpec("P")
@@ -17,6 +20,71 @@ FileCacheDecorator = Callable[P, R]
 
 CACHE_DIR: str | Path | None = Configuration.CACHE_DIR
 
+# first frame of the cached generators, the older cache files contain a single pickled list instead
+_STREAM_HEADER = ("tindermate.filecache.stream", 1)
+STREAM_CHUNK_SIZE = 64
+
+
+class _StreamWriter:
+    """
+    Writes the items of a generator in pickled chunks as they are produced.
+
+    The chunks go to a partial file that replaces the cache file only once the generator is exhausted, so an abandoned
+    or failed generator never leaves an incomplete cache entry behind. Writing errors only disable the caching.
+    """
+
+    def __init__(self, cache_file: Path, chunk_size: int = STREAM_CHUNK_SIZE):
+        self._cache_file = cache_file
+        self._partial_file = cache_file.with_name(f"{cache_file.name}.{uuid.uuid4().hex[:8]}.partial")
+        self._chunk_size = chunk_size
+        self._chunk: list = []
+        self._items = 0
+        self._stream = None
+        try:
+            self._partial_file.parent.mkdir(parents=True, exist_ok=True)
+            self._stream = self._partial_file.open("wb")
+            pickle.dump(_STREAM_HEADER, self._stream)
+        except Exception as exc:
+            self._fail(exc)
+
+    def append(self, item: object) -> None:
+        if self._stream is None:
+            return
+        self._chunk.append(item)
+        if len(self._chunk) >= self._chunk_size:
+            self._flush()
+
+    def commit(self) -> None:
+        if self._stream is None:
+            return
+        self._flush()
+        if self._stream is None:
+            return
+        self._stream.close()
+        tracer.count("cache.write_bytes", self._partial_file.stat().st_size)
+        os.replace(self._partial_file, self._cache_file)
+        print(f"Resource {self._cache_file.stem} saved to cache ({self._items} items)")
+
+    def abort(self) -> None:
+        """Discard the written items, e.g. when the generator is abandoned before it is exhausted"""
+        if self._stream is not None:
+            tracer.count("cache.abandoned")
+            self._stream.close()
+            self._stream = None
+        self._partial_file.unlink(missing_ok=True)
+
+    def _flush(self) -> None:
+        try:
+            pickle.dump(self._chunk, self._stream)
+            self._items += len(self._chunk)
+            self._chunk = []
+        except Exception as exc:
+            self._fail(exc)
+
+    def _fail(self, exc: Exception) -> None:
+        print(f"Failed to write to cache: {str(exc)}")
+        self.abort()
+
 
 class file_cache_custom_key(Generic[P, R]):
     """Decorator for caching function results to file based on an arbitrary key"""
@@ -24,7 +92,9 @@ class file_cache_custom_key(Generic[P, R]):
     def __init__(self, key: str, cache_dir: str | Path | None = None, namespace: str | None = None):
         self.namespace = namespace
         self.key = key
-        cache_dir = cache_dir or CACHE_DIR
+        if cache_dir is None and CACHE_DIR is not None:
+            # the default cache directory is created lazily on first use
+            cache_dir = ensure_dir(Path(CACHE_DIR))
 
         if cache_dir is None:
             raise ValueError("Cache directory not specified")
@@ -39,24 +109,51 @@ class file_cache_custom_key(Generic[P, R]):
             cache_dir = cache_dir.joinpath(*parts)
         self.cache_file = cache_dir / (key + ".txt")
 
+    def exists(self) -> bool:
+        """Check whether the resource is cached and count the cache hit or miss"""
+        exists = self.cache_file.exists()
+        tracer.count(f"cache.{'hit' if exists else 'miss'}")
+        return exists
+
     def read(self) -> R:
-        with self.cache_file.open("rb") as f:
+        with tracer.span("cache.read", namespace=self.namespace) as span, self.cache_file.open("rb") as f:
             content = pickle.load(f)
+            span["bytes"] = f.tell()
         print(f"Resource {self.key} loaded from cache")
         return content
 
+    def read_stream(self) -> Iterator:
+        """Yield the cached items of a generator, unpickling only one chunk at a time"""
+        with self.cache_file.open("rb") as f:
+            first = pickle.load(f)
+            if first != _STREAM_HEADER:
+                # legacy format with all the items pickled as a single list
+                yield from first
+                return
+            print(f"Resource {self.key} streamed from cache")
+            while True:
+                position = f.tell()
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    break
+                tracer.count("cache.read_bytes", f.tell() - position)
+                yield from chunk
+
     def write(self, content: R) -> None:
         try:
-            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
-            with self.cache_file.open(mode="wb") as f:
-                pickle.dump(content, f)
+            with tracer.span("cache.write", namespace=self.namespace) as span:
+                self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+                with self.cache_file.open(mode="wb") as f:
+                    pickle.dump(content, f)
+                    span["bytes"] = f.tell()
             print(f"Resource {self.key} saved to cache")
         except Exception as exc:
             print(f"Failed to write to cache: {str(exc)}")
 
     def sync_wrapper(self, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
         """Wrapper for sync functions"""
-        if self.cache_file.exists():
+        if self.exists():
             return self.read()
         content = func(*args, **kwargs)
         self.write(content)
@@ -64,18 +161,24 @@ class file_cache_custom_key(Generic[P, R]):
 
     def sync_gen_wrapper(self, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
         """Wrapper for sync generators"""
-        if self.cache_file.exists():
-            yield from self.read()
-        else:
-            content = []
+        if self.exists():
+            yield from self.read_stream()
+            return
+
+        writer = _StreamWriter(self.cache_file)
+        try:
             for item in func(*args, **kwargs):
-                content.append(item)
+                writer.append(item)
                 yield item
-            self.write(content)
+        except BaseException:
+            # includes GeneratorExit raised when the consumer stops iterating
+            writer.abort()
+            raise
+        writer.commit()
 
     async def async_wrapper(self, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
         """Wrapper for async functions"""
-        if self.cache_file.exists():
+        if self.exists():
             return self.read()
         content = await func(*args, **kwargs)
         self.write(content)
@@ -83,15 +186,21 @@ class file_cache_custom_key(Generic[P, R]):
 
     async def async_gen_wrapper(self, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
         """Wrapper for async generators"""
-        if self.cache_file.exists():
-            for item in self.read():
+        if self.exists():
+            for item in self.read_stream():
                 yield item
-        else:
-            content = []
+            return
+
+        writer = _StreamWriter(self.cache_file)
+        try:
             async for item in func(*args, **kwargs):
-                content.append(item)
+                writer.append(item)
                 yield item
-            self.write(content)
+        except BaseException:
+            # includes GeneratorExit raised when the consumer stops iterating
+            writer.abort()
+            raise
+        writer.commit()
 
     def __call__(self, func: Callable[P, R]) -> Callable[P, R]:
         """Create async or sync wrapper based on the type of the wrapped function"""
@@ -108,9 +217,12 @@ class file_cache_custom_key(Generic[P, R]):
 
 
 def file_cache(
-    cache_dir: str | None = None, namespace: str | None = None, is_method: bool = False
+    cache_dir: str | None = None, namespace: str | Callable[..., str] | None = None, is_method: bool = False
 ) -> FileCacheDecorator:
-    """Decorator to cache the result of a function call based on its unique arguments"""
+    """
+    Decorator to cache the result of a function call based on its unique arguments.
+    A callable namespace is resolved per call from the first argument, e.g. from the instance of a method.
+    """
 
     def decorator(func: Callable[P, R]):
         # @functools.wraps(func)
@@ -118,7 +230,8 @@ def file_cache(
             # ignore the self argument of a method
             key_args = args[1:] if is_method else args
             key = make_key(func, key_args, kwargs)
-            return file_cache_custom_key[P, R](key, cache_dir, namespace)(func)(*args, **kwargs)
+            call_namespace = namespace(*args[:1]) if callable(namespace) else namespace
+            return file_cache_custom_key[P, R](key, cache_dir, call_namespace)(func)(*args, **kwargs)
 
         return wrapper
 
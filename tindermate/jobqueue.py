@@ -0,0 +1,230 @@
+import contextlib
+import sqlite3
+import time
+from collections.abc import Iterable, Iterator
+from enum import Enum
+from pathlib import Path
+from typing import NamedTuple
+
+from tindermate.configuration import ensure_dir
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    match_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    last_error TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (account, match_id, kind)
+);
+CREATE INDEX IF NOT EXISTS jobs_available ON jobs (account, status, available_at);
+"""
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    LEASED = "leased"
+    DONE = "done"
+    DEAD = "dead"
+    """Failed too many times, kept aside until it is retried explicitly"""
+
+
+class Job(NamedTuple):
+    id: int
+    account: str
+    match_id: str
+    kind: str
+    payload: str
+    """JSON of the match, so the workers don't have to list the matches again"""
+    attempts: int
+    last_error: str | None = None
+
+
+class JobQueue:
+    """
+    Durable queue of the matches to generate the suggestions for, backed by SQLite, shared by multiple processes.
+
+    A worker leases a job for a limited time and either acknowledges it when done, or reports the failure. A failed
+    job is retried after an exponential backoff, until it has been attempted `max_attempts` times and it moves to the
+    dead letters. The lease of a crashed worker expires and the job is leased again, counted as a failed attempt.
+    """
+
+    def __init__(self, db_file: Path | None = None, max_attempts: int = 3, backoff: float = 30):
+        self._db_file = db_file
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        """Seconds before the first retry of a failed job, doubled with every next attempt"""
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self._db_file is None:
+                self._conn = sqlite3.connect(":memory:", isolation_level=None)
+            else:
+                ensure_dir(self._db_file.parent)
+                # the transactions are managed explicitly, a process waits for the others to finish their writes
+                self._conn = sqlite3.connect(self._db_file, isolation_level=None, timeout=30)
+                self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def enqueue(self, account: str, jobs: Iterable[tuple[str, str, str]], again: bool = False) -> int:
+        """
+        Add the (match id, kind, payload) jobs to the queue, return the number of the queued jobs.
+
+        The jobs which are already in the queue are skipped, unless `again` is set and they are done or dead.
+        """
+        now = time.time()
+        reset = (JobStatus.DONE.value, JobStatus.DEAD.value) if again else ()
+        queued = 0
+        with self._transaction():
+            for match_id, kind, payload in jobs:
+                cursor = self.conn.execute(
+                    f"""
+                    INSERT INTO jobs (account, match_id, kind, payload, status, available_at, updated_at)
+                    VALUES (?, ?, ?, ?, '{JobStatus.QUEUED.value}', ?, ?)
+                    ON CONFLICT (account, match_id, kind) DO UPDATE SET
+                        payload = excluded.payload, status = excluded.status, attempts = 0,
+                        available_at = excluded.available_at, lease_owner = NULL, last_error = NULL,
+                        updated_at = excluded.updated_at
+                    WHERE jobs.status IN ({", ".join("?" * len(reset)) or "NULL"})
+                    """,
+                    (account, match_id, kind, payload, now, now, *reset),
+                )
+                queued += cursor.rowcount
+        return queued
+
+    def lease(self, account: str, owner: str, duration: float) -> Job | None:
+        """Lease the next available job of the account for `duration` seconds, return None if there is none"""
+        now = time.time()
+        with self._transaction():
+            # the workers holding the expired leases have most likely crashed
+            self.conn.execute(
+                f"""
+                UPDATE jobs SET status = '{JobStatus.DEAD.value}', lease_owner = NULL, updated_at = ?,
+                    last_error = coalesce(last_error, 'Lease expired')
+                WHERE account = ? AND status = '{JobStatus.LEASED.value}' AND available_at <= ? AND attempts >= ?
+                """,
+                (now, account, now, self.max_attempts),
+            )
+            row = self.conn.execute(
+                f"""
+                SELECT id, account, match_id, kind, payload, attempts, last_error FROM jobs
+                WHERE account = ? AND status IN ('{JobStatus.QUEUED.value}', '{JobStatus.LEASED.value}')
+                    AND available_at <= ?
+                ORDER BY available_at, id LIMIT 1
+                """,
+                (account, now),
+            ).fetchone()
+            if row is None:
+                return None
+            job = Job._make(row)._replace(attempts=row[5] + 1)
+            self.conn.execute(
+                f"""
+                UPDATE jobs SET status = '{JobStatus.LEASED.value}', lease_owner = ?, attempts = ?,
+                    available_at = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (owner, job.attempts, now + duration, now, job.id),
+            )
+        return job
+
+    def ack(self, job: Job, owner: str) -> bool:
+        """Mark the job as done, return False if the lease has been lost in the meantime"""
+        return self._finish(job, owner, JobStatus.DONE, time.time())
+
+    def fail(self, job: Job, owner: str, error: str) -> JobStatus:
+        """Schedule a retry of the failed job, or move it to the dead letters, return its new status"""
+        if job.attempts >= self.max_attempts:
+            status, available_at = JobStatus.DEAD, time.time()
+        else:
+            status, available_at = JobStatus.QUEUED, time.time() + self.backoff * 2 ** (job.attempts - 1)
+        self._finish(job, owner, status, available_at, error)
+        return status
+
+    def release(self, job: Job, owner: str, delay: float = 0) -> None:
+        """Return the job to the queue without counting the attempt, e.g. when the budget or the credentials ran out"""
+        with self._transaction():
+            self.conn.execute(
+                f"""
+                UPDATE jobs SET status = '{JobStatus.QUEUED.value}', lease_owner = NULL, attempts = attempts - 1,
+                    available_at = ?, updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = '{JobStatus.LEASED.value}'
+                """,
+                (time.time() + delay, time.time(), job.id, owner),
+            )
+
+    def retry_dead(self, account: str) -> int:
+        """Move the dead letters of the account back to the queue, return their number"""
+        now = time.time()
+        with self._transaction():
+            cursor = self.conn.execute(
+                f"""
+                UPDATE jobs SET status = '{JobStatus.QUEUED.value}', attempts = 0, available_at = ?, updated_at = ?
+                WHERE account = ? AND status = '{JobStatus.DEAD.value}'
+                """,
+                (now, now, account),
+            )
+        return cursor.rowcount
+
+    def dead_letters(self, account: str) -> list[Job]:
+        rows = self.conn.execute(
+            f"""
+            SELECT id, account, match_id, kind, payload, attempts, last_error FROM jobs
+            WHERE account = ? AND status = '{JobStatus.DEAD.value}' ORDER BY id
+            """,
+            (account,),
+        )
+        return list(map(Job._make, rows))
+
+    def counts(self, account: str | None = None) -> dict[JobStatus, int]:
+        """Return the number of the jobs in every status"""
+        rows = self.conn.execute(
+            "SELECT status, count(*) FROM jobs WHERE ? IS NULL OR account = ? GROUP BY status", (account, account)
+        )
+        return {status: 0 for status in JobStatus} | {JobStatus(status): count for status, count in rows}
+
+    def next_available_in(self, account: str) -> float | None:
+        """Return the seconds until a job of the account can be leased, None if no job is waiting to be processed"""
+        (available_at,) = self.conn.execute(
+            f"""
+            SELECT min(available_at) FROM jobs
+            WHERE account = ? AND status IN ('{JobStatus.QUEUED.value}', '{JobStatus.LEASED.value}')
+            """,
+            (account,),
+        ).fetchone()
+        return None if available_at is None else max(0.0, available_at - time.time())
+
+    def _finish(self, job: Job, owner: str, status: JobStatus, available_at: float, error: str | None = None) -> bool:
+        with self._transaction():
+            cursor = self.conn.execute(
+                f"""
+                UPDATE jobs SET status = ?, lease_owner = NULL, available_at = ?, last_error = ?, updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = '{JobStatus.LEASED.value}'
+                """,
+                (status.value, available_at, error, time.time(), job.id, owner),
+            )
+        return cursor.rowcount == 1
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # the write lock is taken up front, so two workers can't lease the same job
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
@@ -3,7 +3,7 @@ import sys
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
-from configuration import Configuration
+from tindermate.configuration import Configuration, ensure_dir
 
 
 def _init_logger(log_dir: Path) -> logging.Logger:
@@ -17,7 +17,7 @@ def _init_logger(log_dir: Path) -> logging.Logger:
     stdout_handler.setFormatter(logging.Formatter("%(asctime)s: %(levelname)s: %(message)s"))
     stdout_handler.setLevel(logging.DEBUG)
 
-    file_handler = RotatingFileHandler(log_dir / "app.log", maxBytes=20000, backupCount=20)
+    file_handler = RotatingFileHandler(ensure_dir(log_dir) / "app.log", maxBytes=20000, backupCount=20)
     file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]"))
     file_handler.setLevel(logging.INFO)
 
@@ -0,0 +1,73 @@
+import asyncio
+import functools
+from collections.abc import Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from enum import Enum
+from typing import Any, TypeVar
+
+from tindermate.configuration import Configuration
+from tindermate.tracing import tracer
+
+T = TypeVar("T")
+
+
+class ExecutorKind(str, Enum):
+    INLINE = "inline"
+    """Every step runs on the event loop"""
+    THREAD = "thread"
+    """The loop keeps running between the GIL switches of the worker, no data has to be copied"""
+    PROCESS = "process"
+    """The steps run in parallel with the loop, the arguments and results are pickled"""
+
+
+# cost of building the rich Markdown renderables per character relative to the validation of JSON payloads,
+# measured by benchmarks/offload.py
+MARKDOWN_COST = 10
+
+
+class Offloader:
+    """
+    Runs the CPU-bound steps, like the validation of large payloads or the rendering, in a pool of workers, so they
+    don't block the event loop driving the UI. The size of a step is the number of characters of its payload, weighted
+    by the relative cost of the step, e.g. `MARKDOWN_COST`. The steps smaller than the threshold run inline, because
+    handing them over to a worker would cost more than running them. With the process pool, the function and its
+    arguments have to be picklable, i.e. module-level functions or methods of picklable objects.
+    """
+
+    def __init__(self, kind: ExecutorKind = ExecutorKind.THREAD, workers: int = 2, threshold: int = 5000):
+        self.kind = kind
+        self.workers = workers
+        self.threshold = threshold
+        """Minimum size of a step in weighted characters to run it in the pool"""
+        self._executor: Executor | None = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == ExecutorKind.PROCESS:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # forking a process running the terminal UI is unsafe, the workers import the modules instead
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="offload")
+        return self._executor
+
+    async def run(self, size: int, func: Callable[..., T], *args: Any) -> T:
+        """Run the function processing a payload of `size` weighted characters in the pool, or inline if it is small"""
+        if self.kind == ExecutorKind.INLINE or size < self.threshold:
+            return func(*args)
+        with tracer.span("offload.run", kind=self.kind.value, size=size):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+offloader = Offloader(
+    ExecutorKind(Configuration.OFFLOAD_EXECUTOR), Configuration.OFFLOAD_WORKERS, Configuration.OFFLOAD_THRESHOLD
+)
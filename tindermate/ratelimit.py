@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the average rate of the requests while allowing short bursts.
+
+    A request that does not fit into the bucket reserves its token in advance and sleeps until the token is refilled,
+    so the concurrent requests are served in the order they arrived.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        """Number of requests per second, the limiter is disabled if it is not positive"""
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    async def acquire(self) -> float:
+        """Wait until a request is allowed, return the number of seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        self._tokens -= 1
+        wait = max(0.0, -self._tokens / self.rate)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
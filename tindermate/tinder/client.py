@@ -1,19 +1,70 @@
 import asyncio
+import json
 import random
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager
+from enum import Enum
 from http import HTTPStatus
 from operator import attrgetter
-
-import aiohttp
-from aiohttp import ClientResponseError
+from typing import Any
 
 from tindermate.configuration import Configuration
-from tindermate.tinder.exception import TinderAuthError
+from tindermate.tinder.exception import TinderAPIError, TinderAuthError
+from tindermate.tinder.jsonstream import JsonArrayParser
 from tindermate.tinder.schemas import CurrentUser, LikedUserResult, Match, MatchDetail, Message, UserDetail
+from tindermate.ratelimit import RateLimiter
+from tindermate.tracing import tracer
+from tindermate.transport import CachingTransport, Timeouts, Transport, TransportBackend, create_transport
 from tindermate.type_aliases import AnyDict
 from tindermate.filecache import FileCacheDecorator, file_cache
+from tindermate.offload import offloader
+
+
+class EndpointClass(str, Enum):
+    """Endpoints of similar response sizes sharing the same timeouts"""
+
+    PROFILE = "profile"
+    LIST = "list"
+    MESSAGES = "messages"
+
+
+def default_timeouts() -> dict[EndpointClass, Timeouts]:
+    return {endpoint: Timeouts(*Configuration.TINDER_TIMEOUTS[endpoint.value]) for endpoint in EndpointClass}
+
+
+@contextmanager
+def _count_aborted() -> Iterator[None]:
+    """Count the requests that timed out or were cancelled, e.g. because the user discarded their result"""
+    try:
+        yield
+    except asyncio.TimeoutError:
+        tracer.count("tinder.timeouts")
+        raise
+    except asyncio.CancelledError:
+        tracer.count("tinder.cancelled")
+        raise
+
+
+# approximate number of characters of a match in the list of matches, with the last message embedded
+_MATCH_CHARS = 1500
+
+
+def parse_matches(results: list[AnyDict]) -> list[Match]:
+    return [Match.parse_obj(res) for res in results]
+
+
+def build_match_detail(match: Match, user_detail: UserDetail) -> MatchDetail:
+    return MatchDetail.parse_obj(match.dict() | {"person": user_detail.dict()})
 
 
 class TinderClient:
+    """
+    Client of the Tinder API for a single account.
+
+    Each client keeps its own transport with a connection pool and its own rate limiter, so multiple accounts can be
+    used side by side. The pool is opened with the first request and has to be released with `close`.
+    """
+
     _BASE_URL = "https://api.gotinder.com"
     _FAKE_HEADERS = {
         "accept": "application/json",
@@ -29,10 +80,53 @@ class TinderClient:
     _FETCH_MATCHES_LIMIT = 100
     _FETCH_MESSAGES_LIMIT = 100
 
-    def __init__(self, auth_token: str, sleep_between_requests: int = 3):
+    def __init__(
+        self,
+        auth_token: str,
+        sleep_between_requests: int = 3,
+        account: str = Configuration.DEFAULT_ACCOUNT,
+        rate_limiter: RateLimiter | None = None,
+        transport: Transport | None = None,
+        timeouts: dict[EndpointClass, Timeouts] | None = None,
+        http_cache: bool = Configuration.TINDER_HTTP_CACHE,
+    ):
         self._auth_token = auth_token
         # by default, we avoid firing many instant requests to imitate human-like behaviour
         self._sleep_between_requests = sleep_between_requests
+        self.account = account
+        self._rate_limiter = rate_limiter or RateLimiter(
+            Configuration.TINDER_RATE_LIMIT, Configuration.TINDER_RATE_BURST
+        )
+        self._transport = transport or create_transport(
+            f"tinder:{account}",
+            Configuration.TINDER_CONNECTION_LIMIT,
+            backend=TransportBackend(Configuration.TINDER_TRANSPORT),
+            http2=Configuration.TINDER_HTTP2,
+        )
+        if http_cache:
+            heuristic_freshness = {
+                "/user/": Configuration.TINDER_USER_FRESHNESS,
+                "/v2/profile": Configuration.TINDER_PROFILE_FRESHNESS,
+            }
+            self._transport = CachingTransport(
+                self._transport, heuristic_freshness, max_entries=Configuration.TINDER_HTTP_CACHE_SIZE
+            )
+            self._conditional_transport = self._transport
+        else:
+            # the conditional requests are always revalidated, so they keep their validators even without the cache
+            self._conditional_transport = CachingTransport(
+                self._transport, max_entries=Configuration.TINDER_HTTP_CACHE_SIZE
+            )
+        self._timeouts = timeouts or default_timeouts()
+
+    async def __aenter__(self) -> "TinderClient":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self._transport.close()
 
     def _headers(self) -> AnyDict:
         return {
@@ -44,48 +138,135 @@ class TinderClient:
         secs = self._sleep_between_requests * random.random()
         await asyncio.sleep(secs)
 
-    async def _get_v2(self, path: str, params: AnyDict | None = None) -> AnyDict:
-        return (await self._get(f"/v2{path}", params))["data"]
+    async def _get_v2(
+        self,
+        path: str,
+        params: AnyDict | None = None,
+        conditional: bool = False,
+        endpoint: EndpointClass = EndpointClass.PROFILE,
+    ) -> AnyDict:
+        return (await self._get(f"/v2{path}", params, conditional, endpoint))["data"]
 
-    async def _get(self, path: str, params: AnyDict | None = None) -> AnyDict:
+    async def _get(
+        self,
+        path: str,
+        params: AnyDict | None = None,
+        conditional: bool = False,
+        endpoint: EndpointClass = EndpointClass.PROFILE,
+    ) -> AnyDict:
+        """
+        Fetch the JSON payload of the resource. The HTTP cache serves the fresh responses without a request and
+        revalidates the stale ones, conditional requests are revalidated even if the cached response is fresh.
+        Without the HTTP cache, only the conditional requests send the validators of their last response.
+        """
         url = f"{self._BASE_URL}{path}"
         params = {"locale": "en"} | (params or {})
+        headers = self._headers()
+        transport = self._transport
+        if conditional:
+            headers["cache-control"] = "no-cache"
+            transport = self._conditional_transport
 
-        print(f"GET {url}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, headers=self._headers()) as resp:
-                try:
-                    resp.raise_for_status()
-                except ClientResponseError as exc:
-                    if resp.status == HTTPStatus.UNAUTHORIZED:
-                        raise TinderAuthError("Unauthorized user") from exc
-                    raise
-                return await resp.json()
+        # the responses served from the cache do not count against the rate limit
+        if not transport.is_fresh("GET", url, params, headers):
+            await self._throttle()
+        with _count_aborted(), tracer.span("tinder.get", path=path, account=self.account) as span:
+            resp = await transport.request(
+                "GET", url, params=params, headers=headers, timeouts=self._timeouts[endpoint]
+            )
+            span.update(status=resp.status, cached=resp.cached)
+            self._check_status(resp.status, path)
+            span["bytes"] = len(resp.body)
+            if not resp.cached:
+                tracer.count("tinder.bytes", len(resp.body))
+            return json.loads(resp.body)
+
+    async def _stream(
+        self,
+        path: str,
+        parser: JsonArrayParser,
+        params: AnyDict | None = None,
+        endpoint: EndpointClass = EndpointClass.LIST,
+    ) -> AsyncIterator[Any]:
+        """
+        Fetch the JSON payload of the resource and yield the elements of the array parsed by the parser as soon as they
+        are received. The rest of the payload is available as `parser.document` once the elements are exhausted.
+        Only the connect and read timeouts apply, the total one would include the time the consumer spends with the
+        elements, e.g. waiting for a full queue.
+        """
+        url = f"{self._BASE_URL}{path}"
+        params = {"locale": "en"} | (params or {})
+        await self._throttle()
+        timeouts = self._timeouts[endpoint]._replace(total=None)
+        with _count_aborted(), tracer.span("tinder.stream", path=path, account=self.account) as span:
+            async with self._transport.stream(
+                "GET", url, params=params, headers=self._headers(), timeouts=timeouts
+            ) as resp:
+                span["status"] = resp.status
+                self._check_status(resp.status, path)
+                received = 0
+                async for chunk in resp.chunks:
+                    received += len(chunk)
+                    for element in parser.feed(chunk):
+                        yield element
+            span.update(bytes=received, elements=parser.elements)
+            tracer.count("tinder.bytes", received)
+
+    async def _throttle(self) -> None:
+        if (waited := await self._rate_limiter.acquire()) > 0:
+            tracer.observe("tinder.rate_limit_wait", waited * 1000)
+
+    @staticmethod
+    def _check_status(status: int, path: str) -> None:
+        if status == HTTPStatus.UNAUTHORIZED:
+            raise TinderAuthError("Unauthorized user")
+        if status >= HTTPStatus.BAD_REQUEST:
+            raise TinderAPIError(status, path)
 
     async def _messages(self, match_id: str) -> list[Message]:
         params = {"count": self._FETCH_MESSAGES_LIMIT}
-        results = (await self._get_v2(f"/matches/{match_id}/messages", params=params))["messages"]
-        return sorted([Message.parse_obj(res) for res in results], key=attrgetter("timestamp"))
+        parser = JsonArrayParser("data", "messages")
+        results = self._stream(
+            f"/v2/matches/{match_id}/messages", parser, params=params, endpoint=EndpointClass.MESSAGES
+        )
+        return sorted([Message.parse_obj(res) async for res in results], key=attrgetter("timestamp"))
 
     async def _user_detail(self, user_id: str) -> UserDetail:
         result = (await self._get(f"/user/{user_id}"))["results"]
         return UserDetail.parse_obj(result)
 
-    async def matches(self, messaged: bool) -> list[Match]:
+    async def matches(self, messaged: bool, conditional: bool = False) -> list[Match]:
         params = {"count": self._FETCH_MATCHES_LIMIT, "message": 1 if messaged else 0}
-        results = (await self._get_v2("/matches", params=params))["matches"]
-        return [Match.parse_obj(res) for res in results]
+        results = (await self._get_v2("/matches", params, conditional, EndpointClass.LIST))["matches"]
+        return await offloader.run(len(results) * _MATCH_CHARS, parse_matches, results)
+
+    async def iter_matches(self, messaged: bool) -> AsyncIterator[Match]:
+        """Iterate over all the matches, following the pagination of the matches endpoint"""
+        params: AnyDict = {"count": self._FETCH_MATCHES_LIMIT, "message": 1 if messaged else 0}
+        while True:
+            # the matches are built while the rest of the page is still being received
+            parser = JsonArrayParser("data", "matches")
+            async for res in self._stream("/v2/matches", parser, params=params):
+                yield Match.parse_obj(res)
+            if not (page_token := parser.document["data"].get("next_page_token")):
+                break
+            params["page_token"] = page_token
 
     async def fetch_detail_for(self, match: Match) -> MatchDetail:
         user_detail = await self._user_detail(match.person.id)
-        return MatchDetail.parse_obj(match.dict() | {"person": user_detail.dict()})
+        # the match and the profile are copied, the message log is shared
+        size = 2 * _MATCH_CHARS + len(user_detail.bio or "")
+        detail = await offloader.run(size, build_match_detail, match, user_detail)
+        # share the message log, so the messages fetched later are visible from both objects
+        detail._message_log = match.message_log
+        return detail
 
     async def fetch_messages_for(self, match: Match) -> None:
-        """Update the match with all the exchanged messages"""
-        match.messages = await self._messages(match.id)
+        """Update the message log of the match with the newly exchanged messages"""
+        match.message_log.extend(await self._messages(match.id))
 
     async def my_likes(self) -> list[LikedUserResult]:
-        results = (await self._get_v2("/my-likes"))["results"]
+        results = (await self._get_v2("/my-likes", endpoint=EndpointClass.LIST))["results"]
         return [LikedUserResult.parse_obj(res) for res in results]
 
     async def current_user_info(self) -> CurrentUser:
@@ -93,18 +274,24 @@ class TinderClient:
         return CurrentUser.parse_obj(resp)
 
 
-_tinder_cache: FileCacheDecorator = file_cache("tinder", is_method=True)
+# every account has its own cache namespace, so the accounts don't read each other's payloads
+_tinder_cache: FileCacheDecorator = file_cache(namespace=lambda client: f"tinder.{client.account}", is_method=True)
 
 
 class CachingTinderClient(TinderClient):
     """Tinder client that caches the response payloads in order to avoid unnecessary requests while debugging"""
 
-    def __init__(self, auth_token: str):
-        super().__init__(auth_token, sleep_between_requests=2)
+    def __init__(self, auth_token: str, account: str = Configuration.DEFAULT_ACCOUNT):
+        super().__init__(auth_token, sleep_between_requests=2, account=account)
+
+    @_tinder_cache
+    async def matches(self, messaged: bool, conditional: bool = False) -> list[Match]:
+        return await super().matches(messaged, conditional)
 
     @_tinder_cache
-    async def matches(self, messaged: bool) -> list[Match]:
-        return await super().matches(messaged)
+    async def iter_matches(self, messaged: bool) -> AsyncIterator[Match]:
+        async for match in super().iter_matches(messaged):
+            yield match
 
     @_tinder_cache
     async def current_user_info(self) -> CurrentUser:
@@ -123,5 +310,7 @@ class CachingTinderClient(TinderClient):
         return await super().fetch_detail_for(match)
 
 
-def create_tinder_client(auth_token: str) -> TinderClient:
-    return CachingTinderClient(auth_token) if Configuration.DEBUG else TinderClient(auth_token)
+def create_tinder_client(auth_token: str, account: str = Configuration.DEFAULT_ACCOUNT) -> TinderClient:
+    if Configuration.DEBUG:
+        return CachingTinderClient(auth_token, account=account)
+    return TinderClient(auth_token, account=account)
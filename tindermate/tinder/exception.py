@@ -1,2 +1,8 @@
 class TinderAuthError(Exception):
     pass
+
+
+class TinderAPIError(Exception):
+    def __init__(self, status: int, path: str):
+        super().__init__(f"Tinder API responded with status {status} to {path}")
+        self.status = status
@@ -0,0 +1,212 @@
+import codecs
+import json
+import re
+from typing import Any
+
+_STRUCTURAL = re.compile(r'["{}\[\],:]')
+_STRING_END = re.compile(r'["\\]')
+_ELEMENT_STRUCTURAL = re.compile(r'["{}\[\]]')
+_SCALAR_END = re.compile(r"[ \t\n\r,\]]")
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class JsonArrayParser:
+    """
+    Incremental parser of a JSON document returning the elements of one of its nested arrays as soon as they are
+    complete, e.g. the matches of `{"data": {"matches": [...]}}` with the path ("data", "matches").
+
+    Only the element being received is buffered, the rest of the document is kept in a skeleton, in which the array
+    is empty, and which is available as `document` once the whole document was fed. The nesting of the element being
+    received is tracked across the chunks, so every element is scanned once and decoded by the C decoder of the json
+    module only when it is complete. A malformed element raises ValueError as soon as it is received.
+    """
+
+    def __init__(self, *path: str):
+        self.path = list(path)
+        self.elements = 0
+        """Number of the elements returned so far"""
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._skeleton: list[str] = []
+        self._in_array = False
+        self._done = False
+        self._element_start: int | None = None
+        """Position of the element being received in the buffer"""
+        self._element_depth = 0
+        self._expect_separator = False
+        self._containers: list[bool] = []
+        """Whether each of the open containers is an object"""
+        self._keys: list[str | None] = []
+        self._expect_key = False
+        self._key_start: int | None = None
+        self._in_string = False
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        """Parse the next chunk of the document, return the elements of the array completed by it"""
+        self._buffer += self._text_decoder.decode(chunk)
+        elements: list[Any] = []
+        while self._scan_array(elements) if self._in_array else self._scan_document():
+            pass
+        self._trim()
+        return elements
+
+    @property
+    def document(self) -> Any:
+        """Whole document with the elements of the array left out"""
+        if self._in_array or self._text_decoder.decode(b"", final=True):
+            raise ValueError(f"Incomplete JSON document, the {'.'.join(self.path)} array is not closed")
+        return json.loads("".join(self._skeleton) + self._buffer)
+
+    def _scan_document(self) -> bool:
+        """Scan the document up to the start of the array, return whether the array was entered"""
+        buffer, pos = self._buffer, self._pos
+        while True:
+            if self._in_string:
+                pos = self._scan_string(buffer, pos)
+                if self._in_string:
+                    break
+                continue
+
+            if (match := _STRUCTURAL.search(buffer, pos)) is None:
+                pos = len(buffer)
+                break
+            char, pos = match.group(), match.end()
+            if char == '"':
+                self._in_string = True
+                if self._expect_key:
+                    self._key_start = match.start()
+            elif char == "[" and not self._done and self._keys == self.path and all(self._containers):
+                self._in_array = True
+                self._skeleton.append(buffer[:pos])
+                self._buffer, self._pos = buffer[pos:], 0
+                return True
+            else:
+                self._track_container(char)
+        self._pos = pos
+        return False
+
+    def _track_container(self, char: str) -> None:
+        if char in "{[":
+            self._containers.append(char == "{")
+            self._keys.append(None)
+            self._expect_key = char == "{"
+        elif char == ",":
+            self._expect_key = bool(self._containers) and self._containers[-1]
+        elif char == ":":
+            self._expect_key = False
+        else:
+            self._containers.pop()
+            self._keys.pop()
+            self._expect_key = False
+
+    def _scan_string(self, buffer: str, pos: int) -> int:
+        """Scan to the end of the string, return the position after it or where to continue with the next chunk"""
+        while (match := _STRING_END.search(buffer, pos)) is not None:
+            if match.group() == "\\":
+                if match.end() >= len(buffer):
+                    # the escaped character is in the next chunk
+                    return match.start()
+                pos = match.end() + 1
+                continue
+            self._in_string = False
+            if self._key_start is not None:
+                self._keys[-1] = json.loads(buffer[self._key_start : match.end()])
+                self._key_start = None
+            return match.end()
+        return len(buffer)
+
+    def _scan_array(self, elements: list[Any]) -> bool:
+        """Decode the complete elements of the array, return whether the end of the array was reached"""
+        buffer = self._buffer
+        while True:
+            if self._element_start is None:
+                pos = self._skip_separators(buffer)
+                if pos == len(buffer):
+                    self._pos = pos
+                    return False
+                if buffer[pos] == "]":
+                    self._in_array, self._done, self._expect_separator = False, True, False
+                    self._buffer, self._pos = buffer[pos:], 1
+                    return True
+                self._element_start = self._pos = pos
+            if (end := self._scan_element(buffer)) is None:
+                return False
+            elements.append(self._decode_element(buffer, end))
+            self.elements += 1
+            self._element_start, self._pos, self._expect_separator = None, end, True
+
+    def _skip_separators(self, buffer: str) -> int:
+        """Skip the whitespace and the commas, return where the next element or the end of the array starts"""
+        pos = self._pos
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer) or buffer[pos] == "]":
+                return pos
+            if buffer[pos] != ",":
+                break
+            pos, self._expect_separator = pos + 1, False
+        if self._expect_separator:
+            raise ValueError(f"Malformed {'.'.join(self.path)} array, expected ',' or ']' at {buffer[pos]!r}")
+        return pos
+
+    def _decode_element(self, buffer: str, end: int) -> Any:
+        assert self._element_start is not None
+        try:
+            element, decoded_end = _decoder.raw_decode(buffer, self._element_start)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Malformed element of the {'.'.join(self.path)} array: {exc}") from exc
+        if decoded_end != end:
+            raise ValueError(f"Malformed element of the {'.'.join(self.path)} array: {buffer[decoded_end:end]!r}")
+        return element
+
+    def _scan_element(self, buffer: str) -> int | None:
+        """Scan the element being received, return the position after it or None if it continues in the next chunk"""
+        assert self._element_start is not None
+        if buffer[self._element_start] not in '{["':
+            # a number or a literal ends with the first character that can't be a part of it
+            if (match := _SCALAR_END.search(buffer, self._pos)) is None:
+                self._pos = len(buffer)
+                return None
+            return match.start()
+        return self._scan_container(buffer)
+
+    def _scan_container(self, buffer: str) -> int | None:
+        """Scan an object, an array or a string element, tracking its nesting from where the last chunk ended"""
+        pos = self._pos
+        while True:
+            if self._in_string:
+                pos = self._scan_string(buffer, pos)
+                if self._in_string:
+                    break
+                if self._element_depth == 0:
+                    return pos
+                continue
+
+            if (match := _ELEMENT_STRUCTURAL.search(buffer, pos)) is None:
+                pos = len(buffer)
+                break
+            char, pos = match.group(), match.end()
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._element_depth += 1
+            else:
+                self._element_depth -= 1
+                if self._element_depth == 0:
+                    return pos
+        self._pos = pos
+        return None
+
+    def _trim(self) -> None:
+        """Drop the scanned part of the buffer, which is either decoded or copied into the skeleton"""
+        keep = next(pos for pos in (self._element_start, self._key_start, self._pos) if pos is not None)
+        if not self._in_array:
+            self._skeleton.append(self._buffer[:keep])
+        self._buffer = self._buffer[keep:]
+        self._pos -= keep
+        if self._key_start is not None:
+            self._key_start -= keep
+        if self._element_start is not None:
+            self._element_start -= keep
@@ -0,0 +1,151 @@
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from operator import attrgetter
+from typing import TYPE_CHECKING, NamedTuple, overload
+
+if TYPE_CHECKING:
+    from tindermate.tinder.schemas import Message
+
+
+class LogEntry(NamedTuple):
+    sender_id: str
+    text: str
+    timestamp: int
+    """Unix timestamp in milliseconds"""
+    message_id: str | None = None
+
+    @property
+    def identity(self) -> str | tuple[str, str, int]:
+        """The message id if the API sent one, otherwise the sender, text and timestamp"""
+        return self.message_id if self.message_id is not None else (self.sender_id, self.text, self.timestamp)
+
+    @property
+    def sent_date(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp / 1000, tz=timezone.utc)
+
+
+class MessageLog:
+    """
+    Compact message history of a single match.
+
+    The log stores only what is needed to display and prompt a conversation. The columns are kept separately:
+    sender ids are interned and referenced by a small index, timestamps live in a typed array and texts and message
+    ids in plain lists. The fetched messages are merged into the log in chronological order, the already logged ones
+    are skipped.
+    """
+
+    __slots__ = ("_senders", "_sender_idx", "_timestamps", "_texts", "_ids")
+
+    def __init__(self) -> None:
+        self._senders: list[str] = []
+        self._sender_idx = array("H")
+        self._timestamps = array("q")
+        self._texts: list[str] = []
+        self._ids: list[str | None] = []
+
+    @classmethod
+    def from_messages(cls, messages: Iterable["Message"]) -> "MessageLog":
+        log = cls()
+        log.extend(messages)
+        return log
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def __iter__(self) -> Iterator[LogEntry]:
+        return (self._entry(idx) for idx in range(len(self)))
+
+    @overload
+    def __getitem__(self, idx: int) -> LogEntry:
+        ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> list[LogEntry]:
+        ...
+
+    def __getitem__(self, idx: int | slice) -> LogEntry | list[LogEntry]:
+        if isinstance(idx, slice):
+            return [self._entry(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("message log index out of range")
+        return self._entry(idx)
+
+    def __repr__(self) -> str:
+        return f"MessageLog(messages={len(self)}, senders={self._senders})"
+
+    @property
+    def last_timestamp(self) -> int | None:
+        return self._timestamps[-1] if self._timestamps else None
+
+    @property
+    def last_entry(self) -> LogEntry | None:
+        return self[-1] if self._timestamps else None
+
+    def last(self, n: int) -> list[LogEntry]:
+        """Return the last n messages in chronological order"""
+        return self[-n:] if n > 0 else []
+
+    def append(self, sender_id: str, text: str, timestamp: int) -> bool:
+        """Add a message to the log, return False if it is already logged"""
+        return self.merge([LogEntry(sender_id, text, timestamp)]) == 1
+
+    def extend(self, messages: Iterable["Message"]) -> int:
+        """Merge the messages into the log, return the number of added messages"""
+        return self.merge(
+            LogEntry(message.from_, message.message, message.timestamp, message.id) for message in messages
+        )
+
+    def merge(self, entries: Iterable[LogEntry]) -> int:
+        """
+        Merge the entries into the log, return the number of added entries.
+
+        The entries are identified by their message id, or by their sender, text and timestamp if they have none. Only
+        the entries already in the log are skipped, identical messages sent within the same millisecond are all kept.
+        Entries newer than the last logged one are appended, older ones are merged in chronological order.
+        """
+        new = sorted(entries, key=attrgetter("timestamp"))
+        if not new:
+            return 0
+        if (last := self.last_timestamp) is None or new[0].timestamp > last:
+            for entry in new:
+                self._append(entry)
+            return len(new)
+        # only the logged messages from the oldest new one on are compared and rewritten
+        start = bisect_left(self._timestamps, new[0].timestamp)
+        tail = self[start:]
+        # every logged entry matches one merged entry at most, the other identical ones are new
+        known = Counter(entry.identity for entry in tail)
+        added = []
+        for entry in new:
+            if known[entry.identity] > 0:
+                known[entry.identity] -= 1
+            else:
+                added.append(entry)
+        if not added:
+            return 0
+        del self._sender_idx[start:], self._timestamps[start:], self._texts[start:], self._ids[start:]
+        for entry in sorted(tail + added, key=attrgetter("timestamp")):
+            self._append(entry)
+        return len(added)
+
+    def _append(self, entry: LogEntry) -> None:
+        self._sender_idx.append(self._intern_sender(entry.sender_id))
+        self._timestamps.append(entry.timestamp)
+        self._texts.append(entry.text)
+        self._ids.append(entry.message_id)
+
+    def _intern_sender(self, sender_id: str) -> int:
+        try:
+            return self._senders.index(sender_id)
+        except ValueError:
+            self._senders.append(sys.intern(sender_id))
+            return len(self._senders) - 1
+
+    def _entry(self, idx: int) -> LogEntry:
+        return LogEntry(self._senders[self._sender_idx[idx]], self._texts[idx], self._timestamps[idx], self._ids[idx])
@@ -0,0 +1,105 @@
+import heapq
+import math
+from collections.abc import Iterable
+from dataclasses import dataclass
+from operator import itemgetter
+
+from tindermate.tinder.schemas import Match, MatchDetail, is_reply_pending
+from tindermate.tinder.sync import MatchDiff
+from tindermate.tracing import tracer
+
+_DAY_MS = 24 * 60 * 60 * 1000
+
+
+@dataclass(frozen=True)
+class RankingWeights:
+    reply_pending: float = 3.0
+    common_interest: float = 0.5
+    """Score per common interest"""
+    velocity: float = 1.0
+    """Score per order of magnitude of the messages exchanged per day"""
+    recency_days_per_point: float = 2.0
+    """Inactivity after which a match loses one point"""
+    velocity_window: int = 10
+    """Number of the most recent messages the velocity is computed from"""
+
+
+def last_activity_ms(match: Match) -> int:
+    """Timestamp of the last message, or of the match creation if there are no messages yet"""
+    if (last_timestamp := match.message_log.last_timestamp) is not None:
+        return last_timestamp
+    return int(match.created_date.timestamp() * 1000)
+
+
+def message_velocity(match: Match, window: int) -> float:
+    """Number of messages exchanged per day over the most recent messages of the conversation"""
+    recent = match.message_log.last(window)
+    if len(recent) < 2:
+        return 0.0
+    span_days = max((recent[-1].timestamp - recent[0].timestamp) / _DAY_MS, 1 / 24)
+    return (len(recent) - 1) / span_days
+
+
+class MatchRanker:
+    """
+    Ranks the matches by their conversation priority.
+
+    The score sums the weighted features of a match: a pending reply, the common interests, the message velocity and
+    the recency. The recency grows linearly with the last activity, by a point per `recency_days_per_point` since the
+    epoch. Measuring it from the epoch instead of from now shifts every score by the same constant, so the precomputed
+    scores stay comparable over time without rescoring.
+    Only the changed matches are scored again and the top matches are selected with a heap.
+    """
+
+    def __init__(self, weights: RankingWeights | None = None):
+        self.weights = weights or RankingWeights()
+        self.scores: dict[str, float] = {}
+        self._matches: dict[str, Match] = {}
+        self._common_interests: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def score(self, match: Match) -> float:
+        weights = self.weights
+        recency = last_activity_ms(match) / (weights.recency_days_per_point * _DAY_MS)
+        velocity = math.log10(1 + message_velocity(match, weights.velocity_window))
+        return (
+            weights.reply_pending * is_reply_pending(match)
+            + weights.common_interest * self._common_interests.get(match.id, 0)
+            + weights.velocity * velocity
+            + recency
+        )
+
+    def update(self, matches: Iterable[Match]) -> None:
+        """Score the given matches, adding them to the ranking or replacing their previous score"""
+        with tracer.span("ranking.update") as span:
+            updated = 0
+            for match in matches:
+                self._matches[match.id] = match
+                self.scores[match.id] = self.score(match)
+                updated += 1
+            span.update(matches=updated)
+
+    def remove(self, match_ids: Iterable[str]) -> None:
+        for match_id in match_ids:
+            self.scores.pop(match_id, None)
+            self._matches.pop(match_id, None)
+            self._common_interests.pop(match_id, None)
+
+    def apply_diff(self, diff: MatchDiff) -> None:
+        self.remove(diff.removed)
+        self.update(diff.added + diff.updated)
+
+    def update_detail(self, detail: MatchDetail) -> None:
+        """Account the common interests, which are only known from the detail of the matched user"""
+        common = sum(1 for interest in detail.person.user_interests.selected_interests if interest.is_common)
+        if detail.id not in self._matches or self._common_interests.get(detail.id, 0) == common:
+            return
+        self._common_interests[detail.id] = common
+        self.scores[detail.id] = self.score(self._matches[detail.id])
+
+    def top(self, k: int) -> list[Match]:
+        """Return the k best ranked matches, ordered from the best one"""
+        best = heapq.nlargest(k, self.scores.items(), key=itemgetter(1))
+        return [self._matches[match_id] for match_id, _ in best]
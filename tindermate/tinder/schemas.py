@@ -1,7 +1,9 @@
 from datetime import datetime
+from typing import Any
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, parse_obj_as
 
+from tindermate.tinder.message_log import MessageLog
 from tindermate.tinder.utils import calculate_age, resolve_gender
 from tindermate.type_aliases import AnyDict
 
@@ -96,6 +98,10 @@ class LikedUser(User):
     def job(self) -> str | None:
         return None if len(jobs := self.jobs) == 0 else jobs[0].as_string()
 
+    @property
+    def city_name(self) -> str | None:
+        return None if self.city is None else self.city.name
+
 
 class UserDetail(LikedUser):
     user_interests: UserInterests = UserInterests(selected_interests=[])
@@ -132,6 +138,7 @@ class LikedUserResult(BaseModel):
 
 
 class Message(BaseModel):
+    id: str | None = Field(None, alias="_id")
     match_id: str
     sent_date: datetime
     message: str
@@ -143,6 +150,10 @@ class Message(BaseModel):
         return super().dict(*args, **kwargs) | {"from": self.from_}
 
 
+def messages_link(match_id: str) -> str:
+    return f"https://tinder.com/app/messages/{match_id}"
+
+
 class Match(BaseModel):
     seen: AnyDict
     id: str
@@ -151,7 +162,6 @@ class Match(BaseModel):
     dead: bool
     last_activity_date: datetime
     message_count: int
-    messages: list[Message]
     participants: list[str]
     pending: bool
     is_super_like: bool
@@ -167,9 +177,36 @@ class Match(BaseModel):
     person: User
     is_archived: bool
 
+    _message_log: MessageLog = PrivateAttr(default_factory=MessageLog)
+
+    def __init__(self, **data: Any):
+        # the embedded messages are kept only in the compact message log
+        messages = parse_obj_as(list[Message], data.pop("messages", []))
+        super().__init__(**data)
+        self._message_log.extend(messages)
+
+    @property
+    def message_log(self) -> MessageLog:
+        """Compact history of the exchanged messages, seeded with the messages embedded in the payload"""
+        return self._message_log
+
     @property
     def open_messages_link(self) -> str:
-        return f"https://tinder.com/app/messages/{self.id}"
+        return messages_link(self.id)
+
+
+ThreadKey = tuple[int, int | None]
+
+
+def thread_key(match: Match) -> ThreadKey:
+    """State of the conversation, it changes with every new message"""
+    return len(match.message_log), match.message_log.last_timestamp
+
+
+def is_reply_pending(match: Match) -> bool:
+    """Check whether the match sent the last message of the conversation"""
+    last_message = match.message_log.last_entry
+    return last_message is not None and last_message.sender_id == match.person.id
 
 
 class MatchDetail(Match):
@@ -0,0 +1,192 @@
+import re
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+from typing import NamedTuple
+
+from tindermate.configuration import ensure_dir
+from tindermate.tinder.schemas import Match, UserDetail, messages_link
+from tindermate.tracing import tracer
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_matches (
+    match_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    last_message_ts INTEGER NOT NULL DEFAULT 0
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS profile_fts USING fts5(
+    match_id UNINDEXED, name, bio, interests, jobs, schools, tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+    match_id UNINDEXED, timestamp UNINDEXED, text, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+_SNIPPET_TOKENS = 10
+_SNIPPET_CHARS = 80
+_MESSAGE_SCAN_LIMIT = 5000
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+
+class SearchHit(NamedTuple):
+    match_id: str
+    name: str
+    source: str
+    """Either "profile" or "message" """
+    snippet: str
+    """Matching text with the matched words wrapped in the highlight markers"""
+    timestamp: int | None = None
+    """Unix timestamp in milliseconds of the matching message"""
+
+    @property
+    def open_messages_link(self) -> str:
+        return messages_link(self.match_id)
+
+
+def fts_query(text: str) -> str | None:
+    """Turn the user input into an FTS5 query matching all the words as prefixes"""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def highlight(text: str, words: list[str]) -> str:
+    """Wrap the words starting with any of the searched words in the highlight markers and shorten the text around"""
+    pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, words)) + r")\w*", re.IGNORECASE)
+    if (first := pattern.search(text)) is not None and len(text) > _SNIPPET_CHARS:
+        start = max(0, min(first.start() - _SNIPPET_CHARS // 4, len(text) - _SNIPPET_CHARS))
+        text = (
+            ("…" if start else "")
+            + text[start : start + _SNIPPET_CHARS]
+            + ("…" if start + _SNIPPET_CHARS < len(text) else "")
+        )
+    return pattern.sub(lambda match: f"{HIGHLIGHT_START}{match.group()}{HIGHLIGHT_END}", text)
+
+
+class SearchIndex:
+    """
+    Full-text index over the profiles and the message history of the matches, backed by SQLite FTS5.
+
+    The index is updated incrementally: a profile is replaced when its detail is indexed and only the messages newer
+    than the last indexed one are added, so the matches can be indexed again every time they are fetched.
+    """
+
+    def __init__(self, db_file: Path | None = None):
+        self._db_file = db_file
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self._db_file is None:
+                self._conn = sqlite3.connect(":memory:")
+            else:
+                ensure_dir(self._db_file.parent)
+                self._conn = sqlite3.connect(self._db_file)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def index_matches(self, matches: Iterable[Match]) -> int:
+        """Index the profiles and the new messages of the matches, return the number of indexed messages"""
+        with tracer.span("search.index") as span, self.conn:
+            indexed = sum(self._index_match(match) for match in matches)
+            span.update(messages=indexed)
+        return indexed
+
+    def search(self, text: str, limit: int = 20) -> list[SearchHit]:
+        """Return the matching profiles followed by the most recent matching messages, at most one hit per match"""
+        if (query := fts_query(text)) is None:
+            return []
+        with tracer.span("search.query", limit=limit) as span:
+            hits: dict[str, SearchHit] = {}
+            for hit in self._search_profiles(query, limit):
+                hits.setdefault(hit.match_id, hit)
+            if len(hits) < limit:
+                for hit in self._search_messages(query, text, limit - len(hits), exclude=hits.keys()):
+                    hits.setdefault(hit.match_id, hit)
+            span.update(hits=len(hits))
+        return list(hits.values())
+
+    def _search_profiles(self, query: str, limit: int) -> list[SearchHit]:
+        rows = self.conn.execute(
+            f"""
+            SELECT m.match_id, m.name, 'profile', snippet(profile_fts, -1, ?, ?, '…', {_SNIPPET_TOKENS}), NULL
+            FROM profile_fts JOIN indexed_matches m USING (match_id)
+            WHERE profile_fts MATCH ? ORDER BY rank LIMIT ?
+            """,
+            (HIGHLIGHT_START, HIGHLIGHT_END, query, limit),
+        )
+        return list(map(SearchHit._make, rows))
+
+    def _search_messages(self, query: str, text: str, limit: int, exclude: Iterable[str]) -> list[SearchHit]:
+        # ranking or highlighting the messages in SQL scores every matching row, which takes hundreds of milliseconds
+        # for common words, walking the hits from the newest one stops as soon as enough matches are found
+        latest: dict[str, int] = {}
+        excluded = set(exclude)
+        rows = self.conn.execute(
+            "SELECT rowid, match_id FROM message_fts WHERE message_fts MATCH ? ORDER BY rowid DESC", (query,)
+        )
+        for scanned, (rowid, match_id) in enumerate(rows):
+            if match_id not in excluded:
+                latest.setdefault(match_id, rowid)
+            if len(latest) >= limit or scanned >= _MESSAGE_SCAN_LIMIT:
+                break
+        if not latest:
+            return []
+
+        placeholders = ", ".join("?" * len(latest))
+        rows = self.conn.execute(
+            f"""
+            SELECT f.match_id, m.name, f.text, f.timestamp
+            FROM message_fts f JOIN indexed_matches m USING (match_id)
+            WHERE f.rowid IN ({placeholders}) ORDER BY f.rowid DESC
+            """,
+            tuple(latest.values()),
+        )
+        words = re.findall(r"\w+", text)
+        return [
+            SearchHit(match_id, name, "message", highlight(message, words), timestamp)
+            for match_id, name, message, timestamp in rows
+        ]
+
+    def _index_match(self, match: Match) -> int:
+        row = self.conn.execute(
+            "SELECT last_message_ts FROM indexed_matches WHERE match_id = ?", (match.id,)
+        ).fetchone()
+        last_message_ts = row[0] if row is not None else 0
+        person = match.person
+        detail = person if isinstance(person, UserDetail) else None
+        if row is None or detail is not None:
+            # the profile of a plain match only holds the name and the bio, the detail replaces it
+            self.conn.execute("DELETE FROM profile_fts WHERE match_id = ?", (match.id,))
+            self.conn.execute(
+                "INSERT INTO profile_fts (match_id, name, bio, interests, jobs, schools) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    match.id,
+                    person.name,
+                    person.bio,
+                    ", ".join(detail.interests) if detail else None,
+                    detail.job if detail else None,
+                    detail.school if detail else None,
+                ),
+            )
+
+        new_messages = [entry for entry in match.message_log if entry.timestamp > last_message_ts]
+        self.conn.executemany(
+            "INSERT INTO message_fts (match_id, timestamp, text) VALUES (?, ?, ?)",
+            ((match.id, entry.timestamp, entry.text) for entry in new_messages),
+        )
+        self.conn.execute(
+            """
+            INSERT INTO indexed_matches (match_id, name, last_message_ts) VALUES (?, ?, ?)
+            ON CONFLICT (match_id) DO UPDATE SET name = excluded.name, last_message_ts = excluded.last_message_ts
+            """,
+            (match.id, person.name, max([last_message_ts] + [entry.timestamp for entry in new_messages])),
+        )
+        return len(new_messages)
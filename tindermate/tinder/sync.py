@@ -0,0 +1,92 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass, field
+
+from tindermate.tinder.client import TinderClient
+from tindermate.tinder.exception import TinderAuthError
+from tindermate.tinder.schemas import Match
+from tindermate.tracing import tracer
+
+
+@dataclass
+class MatchDiff:
+    added: list[Match] = field(default_factory=list)
+    updated: list[Match] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    """Ids of the matches that are no longer returned by the API"""
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+
+def diff_matches(previous: dict[str, Match], current: Iterable[Match]) -> MatchDiff:
+    """Compare the matches by their id and the date of their last activity"""
+    diff = MatchDiff()
+    seen = set()
+    for match in current:
+        seen.add(match.id)
+        if (old := previous.get(match.id)) is None:
+            diff.added.append(match)
+        elif old.last_activity_date != match.last_activity_date:
+            diff.updated.append(match)
+    diff.removed = [match_id for match_id in previous if match_id not in seen]
+    return diff
+
+
+class MatchRefresher:
+    """
+    Polls the matches endpoint in the background and reports the changes against the known state.
+
+    The polling interval adapts to the activity: it drops to the minimum after a change is detected
+    and grows exponentially up to the maximum while nothing changes. The requests are conditional,
+    so an unchanged list of matches is not downloaded again if the API supports validators.
+    A failed poll is traced and retried after the maximum interval, only invalid credentials stop the polling.
+    """
+
+    def __init__(
+        self,
+        tinder: TinderClient,
+        messaged: bool,
+        min_interval: float = 30,
+        max_interval: float = 300,
+        backoff: float = 2,
+    ):
+        self._tinder = tinder
+        self._messaged = messaged
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self.interval = min_interval
+        self.matches: dict[str, Match] = {}
+
+    def seed(self, matches: Iterable[Match]) -> None:
+        """Set the known state, typically from the initial load of the matches"""
+        self.matches = {match.id: match for match in matches}
+
+    async def poll(self) -> MatchDiff:
+        with tracer.span("sync.poll", messaged=self._messaged) as span:
+            current = await self._tinder.matches(messaged=self._messaged, conditional=True)
+            diff = diff_matches(self.matches, current)
+            for match in diff.updated:
+                # keep the already fetched message history and add the messages embedded in the new payload
+                self.matches[match.id].message_log.merge(match.message_log)
+                match._message_log = self.matches[match.id].message_log
+            changed = {match.id for match in diff.added + diff.updated}
+            self.matches = {match.id: match if match.id in changed else self.matches[match.id] for match in current}
+            span.update(added=len(diff.added), updated=len(diff.updated), removed=len(diff.removed))
+
+        self.interval = self._min_interval if diff else min(self.interval * self._backoff, self._max_interval)
+        return diff
+
+    async def run(self, on_change: Callable[[MatchDiff], Awaitable[None]]) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if diff := await self.poll():
+                    await on_change(diff)
+            except TinderAuthError:
+                raise
+            except Exception as exc:
+                # e.g. a timeout or a server error, the polling continues at the slowest pace
+                tracer.event("sync.error", messaged=self._messaged, error=f"{type(exc).__name__}: {exc}")
+                self.interval = self._max_interval
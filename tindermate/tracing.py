@@ -0,0 +1,133 @@
+import asyncio
+import bisect
+import json
+import math
+import time
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TextIO
+
+from tindermate.configuration import Configuration, ensure_dir
+from tindermate.type_aliases import AnyDict
+
+
+class Histogram:
+    """Latency histogram with fixed buckets and a window of the most recent samples for accurate percentiles"""
+
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, math.inf)
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(self.BUCKETS_MS)
+        self._recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(self.BUCKETS_MS, value)] += 1
+        self._recent.append(value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Return the q-th percentile (0-100) of the recent samples"""
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        idx = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+        return ordered[idx]
+
+    def summary(self) -> AnyDict:
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 2),
+            "p50": round(self.percentile(50), 2),
+            "p95": round(self.percentile(95), 2),
+            "p99": round(self.percentile(99), 2),
+            "max": round(self.max, 2),
+        }
+
+
+class Tracer:
+    """
+    Collects the timing spans and metrics of the application.
+
+    Each finished span is recorded in a latency histogram of the same name and, if an export file is configured,
+    appended to it as a JSON line. Counters accumulate arbitrary quantities such as bytes, cache hits or tokens.
+    """
+
+    def __init__(self, export_file: Path | None = None):
+        self.histograms: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.counters: defaultdict[str, float] = defaultdict(float)
+        self._export_file = export_file
+        self._export_stream: TextIO | None = None
+
+    @contextmanager
+    def span(self, name: str, **attrs: object) -> Iterator[AnyDict]:
+        """Measure the duration of the block, the yielded attributes can be extended from within the block"""
+        started_at = time.time()
+        start = time.perf_counter()
+        error: str | None = None
+        try:
+            yield attrs
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            self.observe(name, duration_ms)
+            if error is not None:
+                self.count(f"{name}.errors")
+            self._export({"span": name, "ts": started_at, "duration_ms": round(duration_ms, 3), "error": error} | attrs)
+
+    def observe(self, name: str, value: float) -> None:
+        self.histograms[name].observe(value)
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.counters[name] += value
+
+    def event(self, name: str, **attrs: object) -> None:
+        """Count a discrete event, such as a decision of a controller, and export it with its attributes"""
+        self.count(name)
+        self._export({"event": name, "ts": time.time()} | attrs)
+
+    def snapshot(self) -> AnyDict:
+        return {
+            "histograms": {name: hist.summary() for name, hist in sorted(self.histograms.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def export_snapshot(self) -> None:
+        self._export({"snapshot": self.snapshot(), "ts": time.time()})
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.counters.clear()
+
+    def _export(self, record: AnyDict) -> None:
+        if self._export_file is None:
+            return
+        if self._export_stream is None:
+            ensure_dir(self._export_file.parent)
+            self._export_stream = self._export_file.open("a", encoding="utf-8")
+        self._export_stream.write(json.dumps(record, default=str) + "\n")
+        self._export_stream.flush()
+
+
+tracer = Tracer(Configuration.TRACE_FILE)
+
+
+async def monitor_loop_lag(interval: float) -> None:
+    """Observe by how much the event loop wakes up later than scheduled, i.e. for how long it was blocked"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        tracer.observe("loop.lag", (loop.time() - scheduled) * 1000)
@@ -0,0 +1,662 @@
+import asyncio
+import contextlib
+import functools
+import json
+import math
+import random
+import time
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import AsyncIterator, Awaitable, Iterator
+from dataclasses import asdict, dataclass, field, replace
+from email.utils import parsedate_to_datetime
+from enum import Enum
+from http import HTTPStatus
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple, TextIO, TypeVar
+from urllib.parse import urlsplit
+
+from tindermate.configuration import Configuration, ensure_dir
+from tindermate.tracing import tracer
+from tindermate.type_aliases import AnyDict
+
+if TYPE_CHECKING:
+    import aiohttp
+    import httpx
+
+T = TypeVar("T")
+
+
+@dataclass
+class HttpResponse:
+    status: int
+    headers: dict[str, str] = field(default_factory=dict)
+    """Response headers with lowercase names"""
+    body: bytes = b""
+    cached: bool = False
+    """Served by the HTTP cache, without a request or after the server confirmed it was not modified"""
+
+
+@dataclass
+class StreamedResponse:
+    status: int
+    headers: dict[str, str]
+    chunks: AsyncIterator[bytes]
+    """Chunks of the body as they are received"""
+
+
+class Timeouts(NamedTuple):
+    """Timeouts of a request in seconds, exceeding any of them raises `asyncio.TimeoutError`, None disables it"""
+
+    connect: float | None = None
+    """Establishing a new connection"""
+    read: float | None = None
+    """Waiting for the next chunk of the response"""
+    total: float | None = None
+    """The whole request including the download of the body"""
+
+
+class Deadline:
+    """Bounds a sequence of awaits by a total timeout in seconds, exceeding it raises `asyncio.TimeoutError`"""
+
+    def __init__(self, timeout: float | None):
+        self._expires_at = None if timeout is None else asyncio.get_running_loop().time() + timeout
+
+    async def wait(self, aw: Awaitable[T]) -> T:
+        if self._expires_at is None:
+            return await aw
+        return await asyncio.wait_for(aw, max(self._expires_at - asyncio.get_running_loop().time(), 0))
+
+    async def iterate(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        while True:
+            try:
+                chunk = await self.wait(chunks.__anext__())
+            except StopAsyncIteration:
+                return
+            yield chunk
+
+
+async def _single_chunk(body: bytes) -> AsyncIterator[bytes]:
+    yield body
+
+
+class Transport:
+    """Sends the HTTP requests of an API client, so the network layer can be replaced, e.g. by a recording"""
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> HttpResponse:
+        raise NotImplementedError
+
+    @contextlib.asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        """Send the request and read the body as it is received, the transports without streaming read it at once"""
+        response = await self.request(method, url, params=params, headers=headers, timeouts=timeouts)
+        yield StreamedResponse(response.status, response.headers, _single_chunk(response.body))
+
+    def is_fresh(
+        self, method: str, url: str, params: AnyDict | None = None, headers: dict[str, str] | None = None
+    ) -> bool:
+        """Whether the request would be answered from a cache without any network access"""
+        return False
+
+    async def close(self) -> None:
+        pass
+
+
+class AiohttpTransport(Transport):
+    """Transport keeping a pool of connections, the pool is opened with the first request"""
+
+    def __init__(self, connection_limit: int = 100):
+        self._connection_limit = connection_limit
+        self._session: "aiohttp.ClientSession | None" = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            # aiohttp is a heavy import, so it is postponed until the first request
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=self._connection_limit)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @staticmethod
+    def _timeout_kwargs(timeouts: Timeouts | None) -> AnyDict:
+        """Timeouts of the request, the default timeouts of the session are used if None"""
+        if timeouts is None:
+            return {}
+        import aiohttp
+
+        # the connect timeout does not include the wait for a free connection of the pool
+        return {
+            "timeout": aiohttp.ClientTimeout(timeouts.total, sock_connect=timeouts.connect, sock_read=timeouts.read)
+        }
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> HttpResponse:
+        request = self._get_session().request(
+            method, url, params=params, headers=headers, **self._timeout_kwargs(timeouts)
+        )
+        async with request as resp:
+            body = await resp.read()
+            return HttpResponse(
+                status=resp.status, headers={name.lower(): value for name, value in resp.headers.items()}, body=body
+            )
+
+    @contextlib.asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        request = self._get_session().request(
+            method, url, params=params, headers=headers, **self._timeout_kwargs(timeouts)
+        )
+        async with request as resp:
+            yield StreamedResponse(
+                status=resp.status,
+                headers={name.lower(): value for name, value in resp.headers.items()},
+                chunks=resp.content.iter_any(),
+            )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class HttpxTransport(Transport):
+    """
+    Transport based on httpx, which can multiplex the concurrent requests over a single HTTP/2 connection.
+
+    HTTP/2 requires the optional `h2` package (`pip install httpx[http2]`), without it HTTP/1.1 is used.
+    Plain HTTP URLs use HTTP/2 only with `prior_knowledge`, i.e. when the server is known to support it.
+    """
+
+    def __init__(self, connection_limit: int = 100, http2: bool = True, prior_knowledge: bool = False):
+        self._connection_limit = connection_limit
+        self._http2 = http2
+        self._prior_knowledge = prior_knowledge
+        self._client: "httpx.AsyncClient | None" = None
+
+    def _get_client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            import httpx
+
+            limits = httpx.Limits(max_connections=self._connection_limit)
+            try:
+                self._client = httpx.AsyncClient(
+                    http1=not (self._http2 and self._prior_knowledge), http2=self._http2, limits=limits
+                )
+            except ImportError:
+                print("HTTP/2 is not available without the h2 package, falling back to HTTP/1.1")
+                self._client = httpx.AsyncClient(limits=limits)
+        return self._client
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _timeouts(timeouts: Timeouts | None) -> Iterator[AnyDict]:
+        """
+        Yield the timeouts of the request, the default timeouts of the client are used if None. Httpx has no total
+        timeout, so it is enforced around the request, and its timeout errors are raised as `asyncio.TimeoutError`.
+        """
+        import httpx
+
+        if timeouts is None:
+            kwargs = {}
+        else:
+            kwargs = {"timeout": httpx.Timeout(None, connect=timeouts.connect, read=timeouts.read)}
+        try:
+            yield kwargs
+        except httpx.TimeoutException as exc:
+            raise asyncio.TimeoutError(str(exc)) from exc
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> HttpResponse:
+        with self._timeouts(timeouts) as kwargs:
+            request = self._get_client().request(method, url, params=params, headers=headers, **kwargs)
+            resp = await asyncio.wait_for(request, timeouts.total if timeouts else None)
+        tracer.count(f"http.{resp.http_version}")
+        return HttpResponse(status=resp.status_code, headers=dict(resp.headers), body=resp.content)
+
+    @contextlib.asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        client = self._get_client()
+        deadline = Deadline(timeouts.total if timeouts else None)
+        with self._timeouts(timeouts) as kwargs:
+            request = client.build_request(method, url, params=params, headers=headers, **kwargs)
+            resp = await deadline.wait(client.send(request, stream=True))
+            try:
+                tracer.count(f"http.{resp.http_version}")
+                chunks = deadline.iterate(resp.aiter_bytes())
+                yield StreamedResponse(status=resp.status_code, headers=dict(resp.headers), chunks=chunks)
+            finally:
+                await resp.aclose()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class TransportBackend(str, Enum):
+    AIOHTTP = "aiohttp"
+    HTTPX = "httpx"
+
+
+class ReplayLatency(str, Enum):
+    RECORDED = "recorded"
+    """Every response is delayed by the latency it was recorded with"""
+    SAMPLED = "sampled"
+    """The delays are drawn from the latencies recorded for the same endpoint"""
+    NONE = "none"
+    """The responses are returned at maximum speed"""
+
+
+class CassetteMissError(Exception):
+    pass
+
+
+# the credentials are never written to the cassettes
+_SENSITIVE_HEADERS = frozenset({"x-auth-token", "authorization", "cookie", "set-cookie"})
+# network errors are replayed as the closest built-in exception
+_REPLAYED_ERRORS: dict[str, type[Exception]] = {"TimeoutError": asyncio.TimeoutError}
+
+
+@dataclass
+class Interaction:
+    """Recorded request and the response or the network error it resulted in"""
+
+    scope: str
+    """Client the request was made by, e.g. "tinder:default" or "openai" """
+    method: str
+    url: str
+    params: AnyDict = field(default_factory=dict)
+    request_body: AnyDict | None = None
+    status: int | None = None
+    headers: dict[str, str] = field(default_factory=dict)
+    body: str | None = None
+    error: str | None = None
+    """Name of the exception raised instead of receiving a response"""
+    duration_ms: float = 0.0
+    recorded_at: float = field(default_factory=time.time)
+
+    @property
+    def key(self) -> tuple[str, str, str, str]:
+        payload = json.dumps([self.params, self.request_body], sort_keys=True, default=str)
+        return self.scope, self.method, self.url, payload
+
+    @property
+    def endpoint(self) -> tuple[str, str, str]:
+        return self.scope, self.method, self.url
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise _REPLAYED_ERRORS.get(self.error, ConnectionError)(f"Replayed {self.error} of {self.url}")
+
+    def to_response(self) -> HttpResponse:
+        self.raise_error()
+        return HttpResponse(status=self.status or 200, headers=self.headers, body=(self.body or "").encode())
+
+
+class Cassette:
+    """Interactions stored in a JSON lines file, each recorded interaction is appended right away"""
+
+    def __init__(self, path: Path, interactions: list[Interaction] | None = None):
+        self.path = path
+        self.interactions = interactions or []
+        self._stream: TextIO | None = None
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        with path.open(encoding="utf-8") as f:
+            return cls(path, [Interaction(**json.loads(line)) for line in f if line.strip()])
+
+    def record(self, interaction: Interaction) -> None:
+        if self._stream is None:
+            # a new recording replaces the previous one
+            ensure_dir(self.path.parent)
+            self._stream = self.path.open("w", encoding="utf-8")
+        self.interactions.append(interaction)
+        self._stream.write(json.dumps(asdict(interaction), ensure_ascii=False) + "\n")
+        self._stream.flush()
+
+
+class CassettePlayer:
+    """
+    Replays the recorded interactions in the order they were recorded.
+
+    The requests are matched by their scope, method, URL, parameters and body. When the recorded responses to a
+    request run out, the last one is repeated, so polling loops can run longer than during the recording.
+    """
+
+    def __init__(self, cassette: Cassette, latency: ReplayLatency = ReplayLatency.RECORDED, seed: int = 0):
+        self.latency = latency
+        self._queues: defaultdict[tuple, deque[Interaction]] = defaultdict(deque)
+        self._last: dict[tuple, Interaction] = {}
+        self._latencies: defaultdict[tuple, list[float]] = defaultdict(list)
+        self._random = random.Random(seed)
+        for interaction in cassette.interactions:
+            self._queues[interaction.key].append(interaction)
+            self._latencies[interaction.endpoint].append(interaction.duration_ms)
+
+    async def play(self, request: Interaction) -> Interaction:
+        """Return the recorded interaction matching the request after the replayed latency"""
+        key = request.key
+        if queue := self._queues.get(key):
+            self._last[key] = queue.popleft()
+        elif key not in self._last:
+            raise CassetteMissError(f"No recorded interaction for {request.method} {request.url} ({request.scope})")
+        interaction = self._last[key]
+
+        if (delay := self._delay_ms(interaction)) > 0:
+            await asyncio.sleep(delay / 1000)
+        tracer.count("replay.interactions")
+        return interaction
+
+    def _delay_ms(self, interaction: Interaction) -> float:
+        if self.latency == ReplayLatency.RECORDED:
+            return interaction.duration_ms
+        if self.latency == ReplayLatency.SAMPLED:
+            return self._random.choice(self._latencies[interaction.endpoint])
+        return 0.0
+
+
+def _public_headers(headers: dict[str, str] | None) -> dict[str, str]:
+    return {name: value for name, value in (headers or {}).items() if name.lower() not in _SENSITIVE_HEADERS}
+
+
+class RecordingTransport(Transport):
+    """Transport recording every request made through the wrapped transport together with its timing"""
+
+    def __init__(self, delegate: Transport, cassette: Cassette, scope: str):
+        self._delegate = delegate
+        self._cassette = cassette
+        self._scope = scope
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> HttpResponse:
+        interaction = Interaction(scope=self._scope, method=method, url=url, params=params or {})
+        start = time.perf_counter()
+        try:
+            response = await self._delegate.request(method, url, params=params, headers=headers, timeouts=timeouts)
+        except Exception as exc:
+            interaction.error = type(exc).__name__
+            interaction.duration_ms = (time.perf_counter() - start) * 1000
+            self._cassette.record(interaction)
+            raise
+
+        interaction.duration_ms = (time.perf_counter() - start) * 1000
+        interaction.status = response.status
+        interaction.headers = _public_headers(response.headers)
+        interaction.body = response.body.decode("utf-8", errors="replace")
+        self._cassette.record(interaction)
+        return response
+
+    async def close(self) -> None:
+        await self._delegate.close()
+
+
+class ReplayTransport(Transport):
+    """Transport answering the requests from a cassette without any network access"""
+
+    def __init__(self, player: CassettePlayer, scope: str):
+        self._player = player
+        self._scope = scope
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> HttpResponse:
+        request = Interaction(scope=self._scope, method=method, url=url, params=params or {})
+        # the replayed latency is subject to the timeouts, so the timeouts can be tested against a recording
+        interaction = await asyncio.wait_for(self._player.play(request), timeouts.total if timeouts else None)
+        return interaction.to_response()
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    """Parse the Cache-Control directives, e.g. `max-age=60, private` to `{"max-age": "60", "private": None}`"""
+    directives: dict[str, str | None] = {}
+    for directive in (value or "").split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def _seconds(value: str | None) -> float | None:
+    """Parse the number of seconds of a header or directive, None if it is malformed"""
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+    return seconds if math.isfinite(seconds) and seconds >= 0 else None
+
+
+def _http_date(value: str | None) -> float | None:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+# headers describing the body of a response, a 304 response updates only the other headers of the stored one
+_BODY_HEADERS = frozenset({"content-length", "content-encoding", "content-type", "transfer-encoding"})
+
+
+@dataclass
+class CachedResponse:
+    response: HttpResponse
+    stored_at: float
+    """Monotonic time the response was received or last revalidated"""
+    freshness: float
+    """For how many seconds after it was stored the response can be served without a request"""
+
+    @property
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.stored_at < self.freshness
+
+    def validators(self) -> dict[str, str]:
+        headers = {}
+        if (etag := self.response.headers.get("etag")) is not None:
+            headers["if-none-match"] = etag
+        if (last_modified := self.response.headers.get("last-modified")) is not None:
+            headers["if-modified-since"] = last_modified
+        return headers
+
+
+class CachingTransport(Transport):
+    """
+    Private HTTP cache of the successful GET responses in front of another transport.
+
+    A stored response is served without a request while it is fresh: for the `max-age` of its Cache-Control header,
+    until its Expires date, or, if the server sets neither, for the heuristic freshness of the first path prefix it
+    matches. A stale response is revalidated with a conditional request using its ETag and Last-Modified validators
+    and served again if the server answers 304 Not Modified. Responses with `no-store` or with malformed caching headers
+    are not stored. Requests with `cache-control: no-cache` are always revalidated, the directives of the requests are
+    not sent on. The least recently used responses are evicted above the limit. The streamed responses are not cached.
+    """
+
+    def __init__(
+        self, delegate: Transport, heuristic_freshness: dict[str, float] | None = None, max_entries: int = 1000
+    ):
+        self._delegate = delegate
+        self.heuristic_freshness = heuristic_freshness or {}
+        """Seconds the responses without explicit freshness are fresh for by the prefix of the URL path"""
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], CachedResponse] = OrderedDict()
+
+    @staticmethod
+    def _key(url: str, params: AnyDict | None) -> tuple[str, str]:
+        return url, json.dumps(params or {}, sort_keys=True, default=str)
+
+    def _fresh_entry(
+        self, method: str, url: str, params: AnyDict | None, headers: dict[str, str] | None
+    ) -> CachedResponse | None:
+        if method != "GET" or "no-cache" in parse_cache_control((headers or {}).get("cache-control")):
+            return None
+        entry = self._entries.get(self._key(url, params))
+        return entry if entry is not None and entry.is_fresh else None
+
+    def is_fresh(
+        self, method: str, url: str, params: AnyDict | None = None, headers: dict[str, str] | None = None
+    ) -> bool:
+        return self._fresh_entry(method, url, params, headers) is not None
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> HttpResponse:
+        if method != "GET":
+            return await self._delegate.request(method, url, params=params, headers=headers, timeouts=timeouts)
+        key = self._key(url, params)
+        if (entry := self._fresh_entry(method, url, params, headers)) is not None:
+            self._entries.move_to_end(key)
+            tracer.count("http_cache.hits")
+            tracer.count("http_cache.bytes_saved", len(entry.response.body))
+            return entry.response
+
+        # the directives of the request are meant for this cache, the API does not get them
+        headers = {name: value for name, value in (headers or {}).items() if name != "cache-control"}
+        if (entry := self._entries.get(key)) is not None:
+            headers |= entry.validators()
+        response = await self._delegate.request(method, url, params=params, headers=headers, timeouts=timeouts)
+        if response.status == HTTPStatus.NOT_MODIFIED and entry is not None:
+            tracer.count("http_cache.revalidated")
+            tracer.count("http_cache.bytes_saved", len(entry.response.body))
+            updated = {name: value for name, value in response.headers.items() if name not in _BODY_HEADERS}
+            response = HttpResponse(
+                entry.response.status, entry.response.headers | updated, entry.response.body, cached=True
+            )
+        else:
+            tracer.count("http_cache.misses")
+        self._store(key, url, response)
+        return response
+
+    def _store(self, key: tuple[str, str], url: str, response: HttpResponse) -> None:
+        if response.status != HTTPStatus.OK:
+            # an error does not invalidate the stored response
+            return
+        directives = parse_cache_control(response.headers.get("cache-control"))
+        freshness = self._freshness(url, response, directives)
+        if "no-store" in directives or freshness is None:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = CachedResponse(replace(response, cached=True), time.monotonic(), freshness)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _freshness(self, url: str, response: HttpResponse, directives: dict[str, str | None]) -> float | None:
+        """Return for how many seconds the response is fresh, None if its caching headers are malformed"""
+        if (age := _seconds(response.headers.get("age") or "0")) is None:
+            return None
+        if "no-cache" in directives:
+            return 0.0
+        if "max-age" in directives:
+            max_age = _seconds(directives["max-age"])
+            return None if max_age is None else max(0.0, max_age - age)
+        if (expires := _http_date(response.headers.get("expires"))) is not None:
+            date = _http_date(response.headers.get("date")) or time.time()
+            return max(0.0, expires - date - age)
+        path = urlsplit(url).path
+        return next((seconds for prefix, seconds in self.heuristic_freshness.items() if path.startswith(prefix)), 0.0)
+
+    @contextlib.asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        url: str,
+        params: AnyDict | None = None,
+        headers: dict[str, str] | None = None,
+        timeouts: Timeouts | None = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        async with self._delegate.stream(method, url, params=params, headers=headers, timeouts=timeouts) as response:
+            yield response
+
+    async def close(self) -> None:
+        await self._delegate.close()
+
+
+@functools.cache
+def recording_cassette() -> Cassette | None:
+    """Cassette shared by all the clients of the process if the recording is enabled"""
+    if Configuration.RECORD_CASSETTE is None:
+        return None
+    return Cassette(Configuration.RECORD_CASSETTE)
+
+
+@functools.cache
+def replay_player() -> CassettePlayer | None:
+    """Player shared by all the clients of the process if the replay is enabled"""
+    if Configuration.REPLAY_CASSETTE is None:
+        return None
+    return CassettePlayer(Cassette.load(Configuration.REPLAY_CASSETTE), ReplayLatency(Configuration.REPLAY_LATENCY))
+
+
+def create_transport(
+    scope: str,
+    connection_limit: int = 100,
+    backend: TransportBackend = TransportBackend.AIOHTTP,
+    http2: bool = True,
+) -> Transport:
+    """Create the network transport, or the recording or replaying one if configured"""
+    if (player := replay_player()) is not None:
+        return ReplayTransport(player, scope)
+    transport: Transport
+    if backend == TransportBackend.HTTPX:
+        transport = HttpxTransport(connection_limit, http2=http2)
+    else:
+        transport = AiohttpTransport(connection_limit)
+    if (cassette := recording_cassette()) is not None:
+        transport = RecordingTransport(transport, cassette, scope)
+    return transport
@@ -1,3 +1,5 @@
+import asyncio
+
 from rich.text import Text
 from textual.app import App, ComposeResult
 from textual.containers import Container
@@ -6,13 +8,19 @@ from textual.widgets import Button, Footer, Header, Input, Static
 
 from tindermate.configuration import Configuration
 from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.speculation import SpeculativeGenerator
 from tindermate.tinder.client import create_tinder_client
+from tindermate.tinder.schemas import CurrentUser
+from tindermate.tinder.search import SearchIndex
+from tindermate.tracing import monitor_loop_lag
 from tindermate.ui import utils
 from tindermate.ui.components.body import Body
 from tindermate.ui.components.generic import AboveFold
 from tindermate.ui.components.sidebar import Sidebar
 from tindermate.ui.context import AppContext
-from tindermate.ui.tokens import InvalidTokenError, Tokens, validate_tokens
+from tindermate.ui.tokens import InvalidTokenError, Tokens, ValidationRecord, validate_tokens
+
+_VALIDATION_TIMEOUT_MESSAGE = "The tokens could not be validated, Tinder did not answer in time. Please try again."
 
 
 class LoadingScreen(Screen):
@@ -21,8 +29,12 @@ class LoadingScreen(Screen):
 
 
 class AuthScreen(Screen):
+    def __init__(self, account: str = Configuration.DEFAULT_ACCOUNT):
+        super().__init__()
+        self.account = account
+
     def compose(self) -> ComposeResult:
-        tokens = Tokens.load()
+        tokens = Tokens.load(self.account)
         yield Container(
             Static("OpenAI token", classes="label"),
             Input(value=tokens.openai_token or "", placeholder="OpenAI token", id="openai-inp"),
@@ -37,23 +49,33 @@ class AuthScreen(Screen):
         if event.button.id == "submit":
             openai_token = self.query_one("#openai-inp", Input).value
             tinder_token = self.query_one("#tinder-inp", Input).value
-            tokens = Tokens(openai_token=openai_token, tinder_token=tinder_token)
+            tokens = Tokens(openai_token=openai_token, tinder_token=tinder_token, account=self.account)
             try:
-                await validate_tokens(tokens)
+                current_user = await validate_tokens(tokens)
                 tokens.save()
-                self.app.push_screen(AppScreen())
+                self.app.push_screen(AppScreen(account=self.account, current_user=current_user))
             except InvalidTokenError as exc:
                 message = Text.assemble(("ERROR: ", "bold red"), exc.args[0])
                 utils.show_notification(self.app, message, delay=10)
+            except asyncio.TimeoutError:
+                utils.show_notification(self.app, _VALIDATION_TIMEOUT_MESSAGE, delay=10)
 
 
 class AppScreen(Screen):
-    def __init__(self):
+    def __init__(self, account: str = Configuration.DEFAULT_ACCOUNT, current_user: CurrentUser | None = None):
         super().__init__()
-        tokens = Tokens.load()
+        tokens = Tokens.load(account)
+        agent = ConversationAgent(api_key=tokens.openai_token)
+        tinder = create_tinder_client(auth_token=tokens.tinder_token, account=account)
+        speculator = None
+        if Configuration.SPECULATIVE_GENERATION:
+            speculator = SpeculativeGenerator(tinder, agent, max_requests=Configuration.SPECULATIVE_GENERATION_LIMIT)
         self.ctx = AppContext(
-            agent=ConversationAgent(api_key=tokens.openai_token),
-            tinder=create_tinder_client(auth_token=tokens.tinder_token),
+            agent=agent,
+            tinder=tinder,
+            current_user=current_user,
+            speculator=speculator,
+            search_index=SearchIndex(Configuration.SEARCH_INDEX_FILE),
         )
 
     def compose(self) -> ComposeResult:
@@ -64,6 +86,9 @@ class AppScreen(Screen):
             Footer(),
         )
 
+    async def on_unmount(self) -> None:
+        await self.ctx.tinder.close()
+
 
 class TinderMate(App):
     BINDINGS = [
@@ -71,22 +96,46 @@ class TinderMate(App):
         ("ctrl+t", "app.toggle_dark", "Toggle Dark mode"),
         ("ctrl+c,ctrl+q", "app.quit", "Quit"),
     ]
-    SCREENS = {"input": AuthScreen(), "body": AppScreen(), "loading": LoadingScreen()}
+    # the screens are built on demand, so no tokens are loaded and no clients are created at import time
+    SCREENS = {"input": AuthScreen, "body": AppScreen, "loading": LoadingScreen}
     CSS_PATH = Configuration.CSS_PATH
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, account: str = Configuration.DEFAULT_ACCOUNT, **kwargs):
         super().__init__(*args, **kwargs)
+        self.account = account
 
     async def on_mount(self) -> None:
-        self.push_screen(LoadingScreen())
+        if Configuration.LOOP_LAG_INTERVAL > 0:
+            utils.fire_task(self, monitor_loop_lag(Configuration.LOOP_LAG_INTERVAL))
+        self.push_screen("loading")
+        tokens = Tokens.load(self.account)
+        if ValidationRecord.load_for(tokens) is not None:
+            # the tokens were validated recently, so we trust them and only revalidate them in the background
+            self.push_screen(AppScreen(account=self.account))
+            utils.fire_task(self, self.revalidate_tokens(tokens))
+            return
+
         try:
-            tokens = Tokens.load()
-            await validate_tokens(tokens)
+            current_user = await validate_tokens(tokens)
             utils.show_notification(self, "The tokens are valid")
-            self.push_screen(AppScreen())
+            self.push_screen(AppScreen(account=self.account, current_user=current_user))
+        except InvalidTokenError as exc:
+            utils.show_notification(self, exc.args[0])
+            self.push_screen(AuthScreen(account=self.account))
+        except asyncio.TimeoutError:
+            utils.show_notification(self, _VALIDATION_TIMEOUT_MESSAGE)
+            self.push_screen(AuthScreen(account=self.account))
+
+    async def revalidate_tokens(self, tokens: Tokens) -> None:
+        try:
+            await validate_tokens(tokens)
         except InvalidTokenError as exc:
+            ValidationRecord.clear(self.account)
             utils.show_notification(self, exc.args[0])
-            self.push_screen(AuthScreen())
+            self.push_screen(AuthScreen(account=self.account))
+        except asyncio.TimeoutError:
+            # the remembered validation is kept, the tokens are checked again on the next start
+            print("The tokens could not be revalidated, Tinder did not answer in time")
 
     def action_toggle_dark(self) -> None:
         """An action to toggle dark mode."""
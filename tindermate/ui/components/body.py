@@ -1,15 +1,22 @@
-from collections.abc import Callable, Coroutine
+import asyncio
+import time
+from collections.abc import Iterable
 from contextlib import contextmanager
-from operator import attrgetter
-from typing import Any
+from dataclasses import dataclass
 
+from rich.markup import escape
 from textual.app import ComposeResult
 from textual.containers import Container
 from textual.reactive import Reactive, reactive
 from textual.widget import Widget
-from textual.widgets import Static
+from textual.widgets import Input, Static
 
+from tindermate.configuration import Configuration
+from tindermate.tinder.ranking import MatchRanker
 from tindermate.tinder.schemas import CurrentUser, Match
+from tindermate.tinder.search import HIGHLIGHT_END, HIGHLIGHT_START, SearchHit
+from tindermate.tinder.sync import MatchDiff, MatchRefresher
+from tindermate.tracing import tracer
 from tindermate.type_aliases import EmptyGenerator
 from tindermate.ui import utils
 from tindermate.ui.components.generic import Column, Row, SubTitle, Tab
@@ -43,9 +50,36 @@ class ErrorMessage(Static):
     ...
 
 
+def render_search_hit(hit: SearchHit) -> str:
+    snippet = escape(hit.snippet).replace(HIGHLIGHT_START, "[b]").replace(HIGHLIGHT_END, "[/b]")
+    return f"{render_link(link=hit.open_messages_link, label=escape(hit.name.upper()))} ({hit.source}): {snippet}"
+
+
+@dataclass
+class TabSpec:
+    label: str
+    messaged: bool
+    widget_cls: type[TinderMatch]
+
+
+TABS = {
+    "new": TabSpec("New matches", False, NewTinderMatch),
+    "messaged": TabSpec("Messaged matches", True, MessagedTinderMatch),
+}
+
+
 class Body(Static):
+    """
+    Main content of the application with a tab for the new and for the messaged matches.
+
+    Each tab keeps its own container with the mounted matches, so switching between the tabs only toggles
+    their visibility. The matches of a tab are fetched again only when they get older than the configured TTL.
+    The displayed matches are the best ranked ones, the ranking is updated with every change of the matches.
+    """
+
     _TAB_CONTENT_MAX_ITEMS = 10
     """How many past matches to display at most"""
+    _SEARCH_MAX_RESULTS = 20
 
     active_tab: Reactive[str | None] = reactive("new")
 
@@ -53,16 +87,25 @@ class Body(Static):
         super().__init__()
         self.ctx = context
         self._current_user: CurrentUser | None = None
+        self._refreshers: dict[str, MatchRefresher] = {}
+        self._rankers: dict[str, MatchRanker] = {}
+        self._loaded_at: dict[str, float] = {}
+        self._loading_tasks: dict[str, asyncio.Task] = {}
+        self._refresh_task: asyncio.Task | None = None
 
     def compose(self) -> ComposeResult:
         yield UserProfile(Title("Your profile"))
-        yield Row(Tab("New matches", "new"), Tab("Messaged matches", "messaged"))
+        yield Row(*(Tab(spec.label, key) for key, spec in TABS.items()))
+        yield Input(placeholder="Search the profiles and messages of your matches", id="search")
+        yield Static(id="search-results", classes="hidden pad")
         yield Static("Your matches are loading...", id="loading-matches", classes="hidden text-row")
-        yield Column(id="content")
+        for key in TABS:
+            yield Column(id=f"content-{key}", classes="hidden")
 
     async def get_current_user(self) -> CurrentUser:
         if self._current_user is None:
-            self._current_user = await self.ctx.tinder.current_user_info()
+            # reuse the user fetched during the token validation if there is one
+            self._current_user = self.ctx.current_user or await self.ctx.tinder.current_user_info()
 
         return self._current_user
 
@@ -70,26 +113,58 @@ class Body(Static):
         current_user = await self.get_current_user()
         self.query_one(UserProfile).on_user_loaded(current_user)
 
+    def on_unmount(self) -> None:
+        self.stop_refresh()
+
     def on_tab_selected(self, message: Tab.Selected) -> None:
         self.active_tab = message.tab_key
 
+    def on_tinder_match_detail_loaded(self, message: TinderMatch.DetailLoaded) -> None:
+        for ranker in self._rankers.values():
+            ranker.update_detail(message.match_detail)
+        self.index_matches([message.match_detail])
+
+    def on_input_changed(self, message: Input.Changed) -> None:
+        if message.input.id == "search":
+            self.show_search_results(message.value)
+
+    def show_search_results(self, text: str) -> None:
+        results = self.query_one("#search-results", Static)
+        results.set_class(not text.strip(), "hidden")
+        if self.ctx.search_index is None or not text.strip():
+            return
+        hits = self.ctx.search_index.search(text, limit=self._SEARCH_MAX_RESULTS)
+        results.update("\n".join(map(render_search_hit, hits)) if hits else "Nothing found")
+
+    def index_matches(self, matches: Iterable[Match]) -> None:
+        if self.ctx.search_index is not None:
+            self.ctx.search_index.index_matches(matches)
+
     def watch_active_tab(self, active_tab: str) -> None:
-        print(f"handling it {active_tab}")
+        if active_tab not in TABS:
+            raise ValueError(f"Unknown tab {active_tab}")
+
         tabs = self.query(Tab)
         tabs.remove_class("active")
         next(tab for tab in tabs if tab.key == active_tab).add_class("active")
 
-        # unmount current content
-        self.query("#content *").remove()
+        # only the active tab is displayed and refreshed in the background
+        self.stop_refresh()
+        for key in TABS:
+            self.tab_content(key).set_class(key != active_tab, "hidden")
 
-        # fetch new content
-        if active_tab == "new":
-            task = self.fetch_new_matches()
-        elif active_tab == "messaged":
-            task = self.fetch_messaged_matches()
+        if (task := self._loading_tasks.get(active_tab)) is not None and not task.done():
+            # the content is being loaded, the refresh starts once it is done
+            return
+        if active_tab not in self._loaded_at:
+            self._loading_tasks[active_tab] = utils.fire_task(self.app, self.fetch_tab_content(active_tab))
+        elif time.monotonic() - self._loaded_at[active_tab] > Configuration.TAB_CONTENT_TTL:
+            self._loading_tasks[active_tab] = utils.fire_task(self.app, self.refresh_tab_content(active_tab))
         else:
-            raise ValueError(f"Unknown tab {active_tab}")
-        utils.fire_task(self.app, task)
+            self.start_refresh(active_tab)
+
+    def tab_content(self, key: str) -> Column:
+        return self.query_one(f"#content-{key}", Column)
 
     @contextmanager
     def loading_data(self) -> EmptyGenerator:
@@ -99,36 +174,101 @@ class Body(Static):
         loading.add_class("hidden")
         loading.refresh()
 
-    async def fetch_new_matches(self) -> None:
-        await self.fetch_tab_content(
-            self.ctx.tinder.matches(messaged=False), NewTinderMatch, sort_key=attrgetter("created_date")
-        )
+    async def fetch_tab_content(self, key: str) -> None:
+        spec = TABS[key]
+        with self.loading_data():
+            current_user = await self.get_current_user()
+            matches = await self.ctx.tinder.matches(messaged=spec.messaged)
+            ranker = self._rankers[key] = MatchRanker()
+            ranker.update(matches)
+            self.index_matches(matches)
+            widgets: list[Widget] = []
+            for idx, match in enumerate(ranker.top(self._TAB_CONTENT_MAX_ITEMS)):
+                widgets.append(spec.widget_cls(self.ctx, match, current_user, batch=idx))
+            widgets.append(Static(id=f"more-{key}", classes="text-row"))
+
+            with tracer.span("ui.mount", widgets=len(widgets)):
+                await self.tab_content(key).mount(*widgets)
 
-    async def fetch_messaged_matches(self) -> None:
-        await self.fetch_tab_content(
-            self.ctx.tinder.matches(messaged=True), MessagedTinderMatch, sort_key=lambda m: m.messages[-1].sent_date
+        refresher = MatchRefresher(
+            self.ctx.tinder,
+            messaged=spec.messaged,
+            min_interval=Configuration.MATCH_REFRESH_MIN_INTERVAL,
+            max_interval=Configuration.MATCH_REFRESH_MAX_INTERVAL,
         )
+        refresher.seed(matches)
+        self._refreshers[key] = refresher
+        self._loaded_at[key] = time.monotonic()
+        self.update_tab_count(key)
+        if key == self.active_tab:
+            self.start_refresh(key)
 
-    async def fetch_tab_content(
-        self,
-        fetch_coro: Coroutine[Any, Any, list[Match]],
-        widget_cls: type[TinderMatch],
-        sort_key: Callable[[Match], Any],
-    ) -> None:
+    async def refresh_tab_content(self, key: str) -> None:
+        """Bring the outdated content of a tab up to date by patching the changed matches"""
         with self.loading_data():
-            current_user = await self.get_current_user()
-            matches = list(await fetch_coro)
-            sorted_matches = sorted(matches, key=sort_key, reverse=True)
-            sliced_matches = sorted_matches[: self._TAB_CONTENT_MAX_ITEMS]
-            widgets: list[Widget] = []
-            for idx, match in enumerate(sliced_matches):
-                widgets.append(widget_cls(self.ctx, match, current_user, batch=idx))
+            if diff := await self._refreshers[key].poll():
+                await self.apply_match_diff(key, diff)
+            self._loaded_at[key] = time.monotonic()
+        if key == self.active_tab:
+            self.start_refresh(key)
 
-            if (num_hidden := len(matches) - len(sliced_matches)) > 0:
-                widgets.append(Static(f"... ({num_hidden} more hidden)", classes="text-row"))
+    def update_tab_count(self, key: str) -> None:
+        """Display the number of list items in the tab name and the number of the hidden ones below the list"""
+        count = len(self._refreshers[key].matches)
+        tab = next(tab for tab in self.query(Tab) if tab.key == key)
+        tab.update(tab.label + f" ({count})")
 
-            await self.query_one("#content").mount(*widgets)
+        num_hidden = count - len(self.tab_content(key).query(TinderMatch))
+        more = self.query_one(f"#more-{key}", Static)
+        more.update(f"... ({num_hidden} more hidden)")
+        more.set_class(num_hidden <= 0, "hidden")
+
+    def start_refresh(self, key: str) -> None:
+        if not Configuration.MATCH_REFRESH or key not in self._refreshers:
+            return
+
+        async def on_change(diff: MatchDiff) -> None:
+            await self.apply_match_diff(key, diff)
+
+        self.stop_refresh()
+        self._refresh_task = utils.fire_task(self.app, self._refreshers[key].run(on_change))
+
+    def stop_refresh(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def apply_match_diff(self, key: str, diff: MatchDiff) -> None:
+        """
+        Patch only the widgets of the changed matches instead of remounting the whole content. The displayed matches
+        follow the updated ranking: the outranked ones are removed, the newly ranked ones mounted and all reordered.
+        """
+        content = self.tab_content(key)
+        ranker = self._rankers[key]
+        ranker.apply_diff(diff)
+        self.index_matches(diff.added + diff.updated)
+        top = ranker.top(self._TAB_CONTENT_MAX_ITEMS)
+        top_ids = {match.id for match in top}
+
+        widgets = {widget.match.id: widget for widget in content.query(TinderMatch)}
+        for match_id in [match_id for match_id in widgets if match_id not in top_ids]:
+            await widgets.pop(match_id).remove()
+        for match in diff.updated:
+            if (widget := widgets.get(match.id)) is not None:
+                widget.update_match(match)
+
+        if new_matches := [match for match in top if match.id not in widgets]:
+            current_user = await self.get_current_user()
+            widget_cls = TABS[key].widget_cls
+            new_widgets = [
+                widget_cls(self.ctx, match, current_user, batch=idx) for idx, match in enumerate(new_matches)
+            ]
+            widgets.update((widget.match.id, widget) for widget in new_widgets)
+            with tracer.span("ui.mount", widgets=len(new_widgets)):
+                await content.mount(*new_widgets, before=0)
+        for idx, match in enumerate(top):
+            if content.children[idx] is not widgets[match.id]:
+                content.move_child(widgets[match.id], before=idx)
 
-        # display the number of list items in the tab name
-        active_tab = next(tab for tab in self.query(Tab) if tab.key == self.active_tab)
-        active_tab.update(active_tab.label + f" ({len(matches)})")
+        self._loaded_at[key] = time.monotonic()
+        self.update_tab_count(key)
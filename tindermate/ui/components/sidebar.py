@@ -1,10 +1,12 @@
 from rich.console import RenderableType
+from rich.table import Table
 from textual.app import ComposeResult
 from textual.containers import Container, Horizontal
 from textual.reactive import watch
 from textual.widgets import Checkbox, Static
 
 from tindermate.configuration import Configuration
+from tindermate.tracing import tracer
 
 MESSAGE = """
 I hope you enjoy using TinderMate.
@@ -46,6 +48,24 @@ class Message(Static):
     pass
 
 
+class PerformancePanel(Static):
+    """Live overview of the latencies and counters collected by the tracer"""
+
+    REFRESH_INTERVAL = 2
+
+    def on_mount(self) -> None:
+        self.set_interval(self.REFRESH_INTERVAL, self.refresh)
+
+    def render(self) -> RenderableType:
+        snapshot = tracer.snapshot()
+        table = Table("Performance", "n", "p50", "p95", box=None, expand=True)
+        for name, hist in snapshot["histograms"].items():
+            table.add_row(name, str(hist["count"]), f"{hist['p50']:.0f}ms", f"{hist['p95']:.0f}ms")
+        for name, value in snapshot["counters"].items():
+            table.add_row(name, f"{value:g}", "", "")
+        return table
+
+
 class Version(Static):
     def render(self) -> RenderableType:
         return f"[b]v{Configuration.APP_VERSION}"
@@ -54,5 +74,5 @@ class Version(Static):
 class Sidebar(Container):
     def compose(self) -> ComposeResult:
         yield Title("TinderMate")
-        yield OptionGroup(Message(MESSAGE), Version())
+        yield OptionGroup(Message(MESSAGE), PerformancePanel(), Version())
         yield DarkSwitch()
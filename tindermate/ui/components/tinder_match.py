@@ -1,17 +1,23 @@
 import contextlib
+from collections.abc import Coroutine
 from contextlib import contextmanager
 from enum import Enum
+from typing import Any
 
 from rich.console import RenderableType
 from rich.markdown import Markdown
 from rich.text import Text
+from textual._types import MessageTarget
 from textual.app import ComposeResult
 from textual.css.query import NoMatches
+from textual.message import Message
 from textual.reactive import reactive
 from textual.widgets import Button, Static
 
+from tindermate.cancellation import CancellationToken
 from tindermate.conversation.prompts import FirstMessagePrompt, MessageReplyPrompt, Prompt
-from tindermate.tinder.schemas import CurrentUser, Match, MatchDetail
+from tindermate.offload import MARKDOWN_COST, offloader
+from tindermate.tinder.schemas import CurrentUser, Match, MatchDetail, is_reply_pending
 from tindermate.type_aliases import EmptyGenerator
 from tindermate.ui import utils
 from tindermate.ui.components.generic import Row, Section, SubTitle
@@ -24,20 +30,24 @@ class MatchInfo(Static):
         match_info = {
             "Age": match.person.age,
             "Interests": ", ".join(match.person.interests),
-            "City": city.name if (city := match.person.city) else None,
+            "City": match.person.city_name,
             "School": match.person.school,
             "Job": match.person.job,
             "Bio": match.person.bio_oneline,
         }
-        if len(match.messages) > 0:
-            last_message = match.messages[-1]
+        if (last_message := match.message_log.last_entry) is not None:
             match_info["Last message"] = (
                 f"{utils.format_datetime(last_message.sent_date)} "
-                f"({'them' if last_message.from_ == match.person.id else 'you'})"
+                f"({'them' if last_message.sender_id == match.person.id else 'you'})"
             )
         self.update(render_markdown_info_list(match_info))
 
 
+def render_prompt(rendered: str) -> RenderableType:
+    lines = ["**Prompt**".upper(), "", rendered.replace("\n", "\n\n")]
+    return Markdown("\n".join(lines))
+
+
 class MatchView(Enum):
     DEFAULT = "DEFAULT"
     PROMPT = "PROMPT"
@@ -48,13 +58,28 @@ class TinderMatch(Static):
     result: reactive[RenderableType | None] = reactive(None)
     current_view: reactive[MatchView] = reactive(MatchView.DEFAULT, init=False)
 
+    class DetailLoaded(Message):
+        """The detail of the matched user was fetched."""
+
+        def __init__(self, sender: MessageTarget, match_detail: MatchDetail) -> None:
+            self.match_detail = match_detail
+            super().__init__(sender)
+
     def __init__(self, context: AppContext, match: Match, current_user: CurrentUser, batch: int):
-        super().__init__()
+        super().__init__(id=self.widget_id(match.id))
         self.ctx = context
         self.match = match
         self.current_user = current_user
         self.match_detail: MatchDetail | None = None
         self.batch = batch
+        self._cancellation = CancellationToken(self.widget_id(match.id))
+        """Cancels the work of the widget, such as the fetch of the match detail, when it is unmounted"""
+        self._result_cancellation = CancellationToken(self.widget_id(match.id))
+        """Cancels the fetches and completions of the displayed result when it is discarded or replaced"""
+
+    @staticmethod
+    def widget_id(match_id: str) -> str:
+        return f"match-{match_id}"
 
     def compose(self) -> ComposeResult:
         """Create child widgets of a match"""
@@ -89,7 +114,23 @@ class TinderMatch(Static):
     async def on_mount(self) -> None:
         # offset the request, so we don't fire all requests at once
         delay_interval = (self.batch, self.batch + 1)
-        utils.fire_task(self.app, self.get_match_detail(), delay_interval)
+        self.fire_task(self.get_match_detail(), "fetch", delay_interval)
+
+    def on_unmount(self) -> None:
+        self._cancellation.cancel()
+        self._result_cancellation.cancel()
+
+    def fire_task(
+        self, coro: Coroutine[None, None, Any], kind: str, delay_interval: tuple[int, int] | None = None
+    ) -> None:
+        """Run the coroutine in the background until it finishes or the widget is unmounted"""
+        self._cancellation.track(utils.fire_task(self.app, coro, delay_interval), kind)
+
+    def fire_result_task(self, coro: Coroutine[None, None, Any], kind: str) -> None:
+        """Run the coroutine producing the displayed result, the work for the previous result is cancelled"""
+        self._result_cancellation.cancel()
+        self._result_cancellation = CancellationToken(self._cancellation.name)
+        self._result_cancellation.track(utils.fire_task(self.app, coro), kind)
 
     async def get_match_detail(self) -> MatchDetail:
         if self.match_detail is None:
@@ -97,21 +138,34 @@ class TinderMatch(Static):
             # populate the match info on the first load
             with contextlib.suppress(NoMatches):
                 self.query_one(MatchInfo).on_match_info_loaded(self.match_detail)
+            await self.post_message(self.DetailLoaded(self, self.match_detail))
 
         return self.match_detail
 
+    def update_match(self, match: Match) -> None:
+        """Patch the widget with a newer state of the match"""
+        self.match = match
+        if self.match_detail is not None:
+            # the detail shares the message log with the match, so only the rendered info is outdated
+            with contextlib.suppress(NoMatches):
+                self.query_one(MatchInfo).on_match_info_loaded(self.match_detail)
+
     @contextmanager
     def loading_data(self) -> EmptyGenerator:
         loading = self.query_one("#loading-data")
         loading.remove_class("hidden")
-        yield
-        loading.add_class("hidden")
-        loading.refresh()
+        try:
+            yield
+        finally:
+            # also when the generation is cancelled
+            loading.add_class("hidden")
+            loading.refresh()
 
     async def handle_generation(self) -> None:
         with self.loading_data():
-            result = await self.ctx.agent.complete_text(await self.get_prompt())
-            self.result = self.render_result(result)
+            result = await self.generate()
+            # a static method, so the process pool can pickle it
+            self.result = await offloader.run(sum(map(len, result)) * MARKDOWN_COST, self.render_result, result)
 
         utils.show_notification(
             self.app,
@@ -121,8 +175,8 @@ class TinderMatch(Static):
     async def handle_show_prompt(self) -> None:
         with self.loading_data():
             prompt = await self.get_prompt()
-            lines = ["**Prompt**".upper(), "", prompt.render().replace("\n", "\n\n")]
-            self.result = Markdown("\n".join(lines))
+            rendered = await offloader.run(prompt.size, prompt.render)
+            self.result = await offloader.run(len(rendered) * MARKDOWN_COST, render_prompt, rendered)
 
         utils.show_notification(
             self.app,
@@ -131,14 +185,16 @@ class TinderMatch(Static):
 
     async def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id in ["generate", "regenerate"]:
-            utils.fire_task(self.app, self.handle_generation())
+            self.fire_result_task(self.handle_generation(), "generation")
             self.current_view = MatchView.RESULT
 
         elif event.button.id == "show-prompt":
-            utils.fire_task(self.app, self.handle_show_prompt())
+            self.fire_result_task(self.handle_show_prompt(), "prompt")
             self.current_view = MatchView.PROMPT
 
         elif event.button.id == "discard":
+            # the result of a generation still running would be shown after it was discarded
+            self._result_cancellation.cancel()
             self.result = None
             self.current_view = MatchView.DEFAULT
 
@@ -158,10 +214,14 @@ class TinderMatch(Static):
             self.add_class("expanded")
             self.query_one("#results", Static).update(result)
 
+    async def generate(self) -> list[str]:
+        return await self.ctx.agent.complete_text(await self.get_prompt(), match_id=self.match.id)
+
     async def get_prompt(self) -> Prompt:
         raise NotImplementedError()
 
-    def render_result(self, result: list[str]) -> RenderableType:
+    @staticmethod
+    def render_result(result: list[str]) -> RenderableType:
         raise NotImplementedError()
 
 
@@ -169,7 +229,8 @@ class NewTinderMatch(TinderMatch):
     async def get_prompt(self) -> FirstMessagePrompt:
         return FirstMessagePrompt(current_user=self.current_user, matched_user=(await self.get_match_detail()).person)
 
-    def render_result(self, result: list[str]) -> RenderableType:
+    @staticmethod
+    def render_result(result: list[str]) -> RenderableType:
         lines = ["**Message suggestions**".upper()]
         for idx, text in enumerate(result):
             lines.append("")
@@ -178,15 +239,40 @@ class NewTinderMatch(TinderMatch):
 
 
 class MessagedTinderMatch(TinderMatch):
+    async def on_mount(self) -> None:
+        await super().on_mount()
+        if self.ctx.speculator is not None and is_reply_pending(self.match):
+            # start after the match detail is loaded, so it is not fetched twice
+            delay_interval = (self.batch + 1, self.batch + 2)
+            self.fire_task(self.pregenerate(), "pregeneration", delay_interval)
+
+    def update_match(self, match: Match) -> None:
+        super().update_match(match)
+        if self.ctx.speculator is not None:
+            self.ctx.speculator.invalidate(match)
+            if is_reply_pending(match):
+                self.fire_task(self.pregenerate(), "pregeneration")
+
+    async def pregenerate(self) -> None:
+        if self.ctx.speculator is not None:
+            detail = await self.get_match_detail()
+            await self.ctx.speculator.pregenerate(self.match, detail.person, self.current_user)
+
+    async def generate(self) -> list[str]:
+        if self.ctx.speculator is not None and (suggestions := self.ctx.speculator.pop(self.match)) is not None:
+            return suggestions
+        return await super().generate()
+
     async def get_prompt(self) -> MessageReplyPrompt:
         await self.ctx.tinder.fetch_messages_for(self.match)
         return MessageReplyPrompt(
             current_user=self.current_user,
             matched_user=(await self.get_match_detail()).person,
-            message_history=self.match.messages,
+            message_history=self.match.message_log,
         )
 
-    def render_result(self, result: list[str]) -> RenderableType:
+    @staticmethod
+    def render_result(result: list[str]) -> RenderableType:
         lines = ["**Message suggestions**".upper()]
         for idx, text in enumerate(result):
             lines.append("")
@@ -1,10 +1,16 @@
 from dataclasses import dataclass
 
 from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.speculation import SpeculativeGenerator
 from tindermate.tinder.client import TinderClient
+from tindermate.tinder.schemas import CurrentUser
+from tindermate.tinder.search import SearchIndex
 
 
 @dataclass
 class AppContext:
     tinder: TinderClient
     agent: ConversationAgent
+    current_user: CurrentUser | None = None
+    speculator: SpeculativeGenerator | None = None
+    search_index: SearchIndex | None = None
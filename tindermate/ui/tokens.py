@@ -1,54 +1,156 @@
 import asyncio
+import hashlib
+import json
+import re
+import time
 from dataclasses import dataclass
+from pathlib import Path
 
 from tindermate.configuration import Configuration
 from tindermate.conversation.agent import ConversationAgent
-from tindermate.conversation.gpt import OpenAIAuthError
+from tindermate.conversation.gpt import OpenAIAuthError, OpenAITimeoutError
 from tindermate.tinder.client import create_tinder_client
 from tindermate.tinder.exception import TinderAuthError
+from tindermate.tinder.schemas import CurrentUser
+
+_ACCOUNT_NAME = re.compile(r"[\w-]+")
 
 
 class InvalidTokenError(Exception):
     pass
 
 
+def token_file(account: str) -> Path:
+    if not _ACCOUNT_NAME.fullmatch(account):
+        raise ValueError(f"Invalid account name {account!r}, only letters, digits, '_' and '-' are allowed")
+    if account == Configuration.DEFAULT_ACCOUNT:
+        return Configuration.TOKEN_FILE
+    return Configuration.TOKEN_FILE.with_name(f"{Configuration.TOKEN_FILE.name}-{account}")
+
+
+def validation_file(account: str) -> Path:
+    if account == Configuration.DEFAULT_ACCOUNT:
+        return Configuration.TOKEN_VALIDATION_FILE
+    return token_file(account).with_suffix(".validation")
+
+
+def list_accounts() -> list[str]:
+    """Return the names of the accounts with stored tokens"""
+    prefix = f"{Configuration.TOKEN_FILE.name}-"
+    accounts = sorted(
+        path.name.removeprefix(prefix)
+        for path in Configuration.TOKEN_FILE.parent.glob(f"{prefix}*")
+        if path.suffix != ".validation"
+    )
+    if Configuration.TOKEN_FILE.exists():
+        accounts.insert(0, Configuration.DEFAULT_ACCOUNT)
+    return accounts
+
+
 @dataclass
 class Tokens:
     openai_token: str | None = Configuration.OPENAI_API_KEY
     tinder_token: str | None = Configuration.TINDER_AUTH_TOKEN
+    account: str = Configuration.DEFAULT_ACCOUNT
 
     @classmethod
-    def load(cls) -> "Tokens":
-        print("loading tokens from " + str(Configuration.TOKEN_FILE))
-        lines = Configuration.TOKEN_FILE.read_text().splitlines()
+    def load(cls, account: str = Configuration.DEFAULT_ACCOUNT) -> "Tokens":
+        path = token_file(account)
+        print("loading tokens from " + str(path))
+        lines = path.read_text().splitlines() if path.exists() else []
         openai, tinder = None, None
         if len(lines) >= 2:
             openai, tinder = lines[:2]
         return Tokens(
             openai_token=openai or Configuration.OPENAI_API_KEY,
             tinder_token=tinder or Configuration.TINDER_AUTH_TOKEN,
+            account=account,
         )
 
     def save(self) -> None:
-        print("saving tokens to " + str(Configuration.TOKEN_FILE))
+        path = token_file(self.account)
+        print("saving tokens to " + str(path))
         lines = "\n".join([self.openai_token or "", self.tinder_token or ""])
-        Configuration.TOKEN_FILE.write_text(lines)
+        path.write_text(lines)
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(f"{self.openai_token}:{self.tinder_token}".encode()).hexdigest()
+
+
+@dataclass
+class ValidationRecord:
+    """
+    Last successful token validation, so the tokens don't have to be validated on every launch.
+
+    Only the fingerprint of the tokens and the time of the validation are stored, nothing about the user.
+    """
+
+    fingerprint: str
+    validated_at: float
+    account: str = Configuration.DEFAULT_ACCOUNT
+
+    @classmethod
+    def load_for(cls, tokens: Tokens) -> "ValidationRecord | None":
+        """Return the validation record of the tokens if it is still within the trusted time window"""
+        try:
+            content = json.loads(validation_file(tokens.account).read_text())
+            record = ValidationRecord(
+                fingerprint=content["fingerprint"],
+                validated_at=float(content["validated_at"]),
+                account=tokens.account,
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        if record.fingerprint != tokens.fingerprint:
+            return None
+        if time.time() - record.validated_at > Configuration.TOKEN_VALIDATION_TTL:
+            return None
+        return record
+
+    @classmethod
+    def clear(cls, account: str = Configuration.DEFAULT_ACCOUNT) -> None:
+        validation_file(account).unlink(missing_ok=True)
+
+    def save(self) -> None:
+        content = {"fingerprint": self.fingerprint, "validated_at": self.validated_at}
+        validation_file(self.account).write_text(json.dumps(content))
 
 
-async def validate_tokens(tokens: Tokens) -> None:
+async def validate_tokens(tokens: Tokens) -> CurrentUser:
+    """
+    Validate the tokens against both APIs and return the current user fetched during the validation.
+
+    If the OpenAI API does not answer in time, the token is accepted without remembering the validation, so it is
+    checked again on the next start.
+    """
     if tokens.tinder_token is None:
         raise InvalidTokenError("Tinder token is not valid")
     if tokens.openai_token is None:
         raise InvalidTokenError("Open AI token is not valid")
 
-    tinder = create_tinder_client(auth_token=tokens.tinder_token)
     agent = ConversationAgent(api_key=tokens.openai_token)
-
     try:
-        await asyncio.gather(tinder.current_user_info(), agent.test_connection())
+        async with create_tinder_client(auth_token=tokens.tinder_token, account=tokens.account) as tinder:
+            current_user, verified = await asyncio.gather(tinder.current_user_info(), _test_openai(agent))
     except TinderAuthError as exc:
         print("Validation failed because because tinder token is invalid")
         raise InvalidTokenError("Tinder token is not valid") from exc
     except OpenAIAuthError as exc:
         print("Validation failed because because open AI token is invalid")
         raise InvalidTokenError("Open AI token is not valid") from exc
+
+    if verified:
+        ValidationRecord(fingerprint=tokens.fingerprint, validated_at=time.time(), account=tokens.account).save()
+    return current_user
+
+
+async def _test_openai(agent: ConversationAgent) -> bool:
+    """Return False if the connection could not be tested in time"""
+    try:
+        await agent.test_connection()
+    except OpenAITimeoutError as exc:
+        print(f"Open AI token could not be verified now: {exc}")
+        return False
+    return True
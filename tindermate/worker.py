@@ -0,0 +1,253 @@
+import asyncio
+import math
+import os
+import socket
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import TextIO
+
+from tindermate.batch import BatchResult, BatchStats, MatchKind, build_prompt_job, should_process
+from tindermate.configuration import Configuration, ensure_dir
+from tindermate.conversation.agent import ConversationAgent
+from tindermate.conversation.gpt import OpenAIAuthError
+from tindermate.conversation.usage import BudgetExceededError, UsageLedger
+from tindermate.jobqueue import Job, JobQueue, JobStatus
+from tindermate.offload import offloader
+from tindermate.tinder.client import TinderClient
+from tindermate.tinder.exception import TinderAuthError
+from tindermate.tinder.schemas import CurrentUser, Match
+
+_ENQUEUE_CHUNK = 100
+
+
+async def enqueue_matches(
+    tinder: TinderClient,
+    queue: JobQueue,
+    account: str,
+    kinds: list[MatchKind],
+    pending_only: bool = False,
+    limit: int | None = None,
+    again: bool = False,
+) -> int:
+    """Add the matches of the account to the queue, return the number of the newly queued jobs"""
+    queued, seen = 0, 0
+    chunk: list[tuple[str, str, str]] = []
+    for kind in kinds:
+        async for match in tinder.iter_matches(messaged=kind == MatchKind.MESSAGED):
+            if limit is not None and seen >= limit:
+                break
+            if not should_process(kind, match, pending_only):
+                continue
+            seen += 1
+            chunk.append((match.id, kind.value, match.json(by_alias=True)))
+            if len(chunk) >= _ENQUEUE_CHUNK:
+                queued += queue.enqueue(account, chunk, again=again)
+                chunk = []
+    return queued + queue.enqueue(account, chunk, again=again)
+
+
+class QueueWorker:
+    """
+    Generates the message suggestions for the jobs leased from the durable queue until no job is left.
+
+    A job that does not fit into the OpenAI budget is postponed without counting the attempt, but only a few times in a
+    row, so the jobs cannot circle forever when the budget keeps running out.
+    """
+
+    _MAX_POSTPONES = 10
+
+    def __init__(
+        self,
+        tinder: TinderClient,
+        agent: ConversationAgent,
+        queue: JobQueue,
+        account: str,
+        output: Path,
+        concurrency: int = 4,
+        lease_duration: float = 300,
+        poll_interval: float = 5,
+        owner: str | None = None,
+        progress_stream: TextIO = sys.stderr,
+    ):
+        self._tinder = tinder
+        self._agent = agent
+        self._queue = queue
+        self._account = account
+        self._output = output
+        self._concurrency = concurrency
+        self._lease_duration = lease_duration
+        self._poll_interval = poll_interval
+        """Maximum number of seconds to wait before checking the queue again when all the jobs are leased"""
+        self._owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._progress_stream = progress_stream
+        self._stats = BatchStats()
+        self._postponed: Counter[int] = Counter()
+        """Number of times the jobs were postponed since their last attempt"""
+
+    async def run(self) -> BatchStats:
+        current_user = await self._tinder.current_user_info()
+        ensure_dir(self._output.parent)
+        # the processes append to the same file, every result is written with a single call, so the lines don't mix
+        fd = os.open(self._output, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            await asyncio.gather(*(self._work(current_user, fd) for _ in range(self._concurrency)))
+        finally:
+            os.close(fd)
+        return self._stats
+
+    async def _work(self, current_user: CurrentUser, fd: int) -> None:
+        while True:
+            job = self._queue.lease(self._account, self._owner, self._lease_duration)
+            if job is not None:
+                await self._process(job, current_user, fd)
+                continue
+            # the jobs leased by the other workers return to the queue if the workers crash
+            wait = self._queue.next_available_in(self._account)
+            if wait is None:
+                return
+            await asyncio.sleep(min(wait, self._poll_interval))
+
+    async def _process(self, job: Job, current_user: CurrentUser, fd: int) -> None:
+        kind = MatchKind(job.kind)
+        try:
+            match = Match.parse_raw(job.payload)
+            prompt = (await build_prompt_job(self._tinder, kind, match, current_user)).build_prompt()
+            rendered = await offloader.run(prompt.size, prompt.render)
+            suggestions = await self._agent.complete_rendered(rendered, prompt.stop_words(), match_id=match.id)
+        except BudgetExceededError as exc:
+            self._postponed[job.id] += 1
+            if math.isinf(exc.retry_after) or self._postponed[job.id] > self._MAX_POSTPONES:
+                # the request does not fit into the budget at all, or the budget keeps running out
+                del self._postponed[job.id]
+                self._fail(job, exc)
+                return
+            # not the fault of the job, it is retried once the spending window moves on
+            delay = max(exc.retry_after, self._poll_interval)
+            self._queue.release(job, self._owner, delay=delay)
+            self._report(f"{exc}, postponing {job.match_id} by {delay:.0f}s")
+            return
+        except (TinderAuthError, OpenAIAuthError, asyncio.CancelledError):
+            # there is no point in continuing with invalid credentials, the job is left to the other workers
+            self._queue.release(job, self._owner)
+            raise
+        except Exception as exc:
+            self._fail(job, exc)
+            return
+
+        result = BatchResult(match_id=match.id, kind=kind, name=match.person.name, suggestions=suggestions)
+        result.prompt = rendered
+        os.write(fd, (result.to_json() + "\n").encode())
+        self._queue.ack(job, self._owner)
+        self._postponed.pop(job.id, None)
+        self._stats.succeeded += 1
+
+    def _fail(self, job: Job, exc: Exception) -> None:
+        self._stats.failed += 1
+        status = self._queue.fail(job, self._owner, f"{type(exc).__name__}: {exc}")
+        if status == JobStatus.DEAD:
+            self._report(f"Giving up on {job.match_id} after {job.attempts} attempts: {type(exc).__name__}: {exc}")
+
+    def _report(self, message: str) -> None:
+        print(f"[{self._owner}] {message}", file=self._progress_stream, flush=True)
+
+
+def run_worker_process(
+    account: str, queue_file: Path, output: Path, concurrency: int, lease_duration: float, budget_share: float = 1.0
+) -> BatchStats:
+    """
+    Entry point of a worker process, it uses its own clients and connection to the queue. The process spends only its
+    share of the OpenAI budgets, so the processes together stay within them.
+    """
+    return asyncio.run(_run_worker(account, queue_file, output, concurrency, lease_duration, budget_share))
+
+
+async def _run_worker(
+    account: str, queue_file: Path, output: Path, concurrency: int, lease_duration: float, budget_share: float
+) -> BatchStats:
+    from tindermate.tinder.client import create_tinder_client
+    from tindermate.ui.tokens import Tokens
+
+    tokens = Tokens.load(account)
+    ledger = UsageLedger(
+        Configuration.USAGE_LEDGER_FILE,
+        budget_per_minute=Configuration.OPENAI_CONFIG.BUDGET_PER_MINUTE,
+        budget_per_day=Configuration.OPENAI_CONFIG.BUDGET_PER_DAY,
+        share=budget_share,
+    )
+    queue = JobQueue(queue_file, Configuration.JOB_MAX_ATTEMPTS, Configuration.JOB_RETRY_BACKOFF)
+    try:
+        async with create_tinder_client(auth_token=tokens.tinder_token, account=account) as tinder:
+            worker = QueueWorker(
+                tinder=tinder,
+                agent=ConversationAgent(api_key=tokens.openai_token, ledger=ledger),
+                queue=queue,
+                account=account,
+                output=output,
+                concurrency=concurrency,
+                lease_duration=lease_duration,
+            )
+            return await worker.run()
+    finally:
+        queue.close()
+        offloader.shutdown()
+
+
+async def run_workers(
+    processes: int,
+    account: str,
+    queue_file: Path,
+    output: Path,
+    concurrency: int = 4,
+    lease_duration: float = 300,
+    progress_interval: float = 10,
+    progress_stream: TextIO = sys.stderr,
+) -> tuple[BatchStats, list[BaseException]]:
+    """
+    Run the worker processes until the queue of the account is drained, reporting the throughput of all of them.
+
+    The OpenAI budgets are split evenly between the processes. Return the aggregated statistics and the errors of the
+    processes which stopped early.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    queue = JobQueue(queue_file)
+    stats = BatchStats()
+    done_before = queue.counts(account)[JobStatus.DONE]
+    # the workers import the modules instead of forking the state of this process
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            loop.run_in_executor(
+                executor,
+                run_worker_process,
+                account,
+                queue_file,
+                output,
+                concurrency,
+                lease_duration,
+                1 / processes,
+            )
+            for _ in range(processes)
+        ]
+        gathered = asyncio.gather(*futures, return_exceptions=True)
+        while not gathered.done():
+            await asyncio.wait([gathered], timeout=progress_interval)
+            counts = queue.counts(account)
+            done = counts[JobStatus.DONE] - done_before
+            print(
+                f"[{stats.elapsed:.0f}s] {done} done ({done / stats.elapsed:.2f} matches/s), "
+                + ", ".join(f"{count} {status.value}" for status, count in counts.items() if status != JobStatus.DONE),
+                file=progress_stream,
+                flush=True,
+            )
+        results = gathered.result()
+    queue.close()
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for result in results:
+        if isinstance(result, BatchStats):
+            stats.succeeded += result.succeeded
+            stats.failed += result.failed
+    return stats, errors